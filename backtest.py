@@ -0,0 +1,366 @@
+import argparse
+import glob
+import heapq
+import itertools
+import json
+import os
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+from itertools import islice
+
+import recorder
+import utils
+from bots.records import API_RATE_DECIMAL_PLACES, from_size, parse_rate, parse_scaled, to_rate, to_scaled
+from bots.snapshot import TickSnapshot
+from bots.step import StepBot
+from configuration import AccountConfiguration
+
+
+MILLISECONDS_PER_DAY = 24 * 60 * 60 * 1000
+
+BACKTEST_ACCOUNT_DATA = {
+    "active": True,
+    "name": "backtest",
+    "kill": False,
+    "bot": "step",
+    "base_url": "",
+    "api_key": "",
+    "api_secret": "",
+    "api_passphrase": "",
+}
+
+
+def load_snapshots(path: str) -> list:
+    # One recorded tick per line: {"timestamp": ms, "lending_market": [...], "active_orders": {...}}
+    with open(path) as snapshots_file:
+        return [json.loads(line) for line in snapshots_file if line.strip()]
+
+
+# A recorded tick parsed once into scaled integers, see bots.records. The book is merged by rate and the live
+# bot's own orders are taken out of it, which leaves a few rates without size: those are kept apart so the
+# simulated open order can still be added to them. The size sums over the recorded book as is drive the fills.
+class BacktestTick:
+
+    __slots__ = ("timestamp", "rates", "sizes", "empty_sizes", "market_rates", "market_size_sums")
+
+    timestamp: int
+    rates: list
+    sizes: list
+    empty_sizes: dict
+    market_rates: list
+    market_size_sums: list
+
+    def __init__(self, timestamp: int, book_lines, my_orders) -> None:
+        # book_lines are the (rate, size) of the recorded book, my_orders the (rate, pending size) of the live bot
+        self.timestamp = timestamp
+
+        market_sizes_by_rate = dict()
+        for rate, size in book_lines:
+            market_sizes_by_rate[rate] = market_sizes_by_rate.get(rate, 0) + size
+
+        self.market_rates = sorted(market_sizes_by_rate)
+        self.market_size_sums = [0] + list(itertools.accumulate(market_sizes_by_rate[rate] for rate in self.market_rates))
+
+        sizes_by_rate = dict(market_sizes_by_rate)
+        for rate, pending_size in my_orders:
+            if rate in sizes_by_rate:
+                sizes_by_rate[rate] -= pending_size
+
+        self.rates = [rate for rate in self.market_rates if sizes_by_rate[rate] > 0]
+        self.sizes = [sizes_by_rate[rate] for rate in self.rates]
+        self.empty_sizes = {rate: size for rate, size in sizes_by_rate.items() if size <= 0}
+
+
+    def get_cumulative_size(self, rate: int, include_rate: bool) -> int:
+        # Size of the recorded book priced below rate, or up to and including it
+        if include_rate:
+            return self.market_size_sums[bisect_right(self.market_rates, rate)]
+        return self.market_size_sums[bisect_left(self.market_rates, rate)]
+
+
+def prepare_snapshots(snapshots: list, size_decimal_places: int) -> list:
+    ticks = list()
+    for snapshot in snapshots:
+        book_lines = [(parse_rate(line["dailyIntRate"]), parse_scaled(line["size"], size_decimal_places)) for line in snapshot["lending_market"]]
+        my_orders = [(parse_rate(order["dailyIntRate"]), parse_scaled(order["size"], size_decimal_places) - parse_scaled(order["filledSize"], size_decimal_places)) for order in snapshot.get("active_orders", dict()).get("items", list())]
+        ticks.append(BacktestTick(snapshot["timestamp"], book_lines, my_orders))
+    return ticks
+
+
+def load_history(path: str, account: str, currency: str, size_decimal_places: int) -> list:
+    # Ticks of one account and currency from a recorder .klb file, or every history file of a recorder_path.
+    # The recorder scales rates and sizes by recorder.SCALE, they are rescaled to the ones of bots.records.
+    if os.path.isdir(path):
+        file_paths = sorted(glob.glob(os.path.join(path, "history-*.klb")))
+    else:
+        file_paths = [path]
+
+    rate_divisor = recorder.SCALE // 10 ** API_RATE_DECIMAL_PLACES
+    size_divisor = recorder.SCALE // 10 ** size_decimal_places
+
+    ticks_by_account = dict()
+    for file_path in file_paths:
+        for frame in recorder.read_history(file_path):
+            if currency not in frame["currencies"]:
+                continue
+            currency_index = frame["currencies"].index(currency)
+
+            tick_columns = {column: values.tolist() for column, values in frame["ticks"].items()}
+            book_rates = (frame["book"]["rate"] // rate_divisor).tolist()
+            book_sizes = (frame["book"]["size"] // size_divisor).tolist()
+            order_rates = (frame["orders"]["rate"] // rate_divisor).tolist()
+            order_pending_sizes = (frame["orders"]["size"] // size_divisor - frame["orders"]["filled_size"] // size_divisor).tolist()
+
+            for index in range(len(tick_columns["timestamp"])):
+                if tick_columns["currency"][index] != currency_index:
+                    continue
+
+                book_start = tick_columns["book_offset"][index]
+                book_end = book_start + tick_columns["book_count"][index]
+                order_start = tick_columns["order_offset"][index]
+                order_end = order_start + tick_columns["order_count"][index]
+
+                tick = BacktestTick(
+                    tick_columns["timestamp"][index],
+                    zip(book_rates[book_start:book_end], book_sizes[book_start:book_end]),
+                    zip(order_rates[order_start:order_end], order_pending_sizes[order_start:order_end]),
+                )
+                ticks_by_account.setdefault(frame["accounts"][tick_columns["account"][index]], list()).append(tick)
+
+    if account is None:
+        if len(ticks_by_account) > 1:
+            raise ValueError(f"{path} holds the ticks of several accounts, pick one of {sorted(ticks_by_account)}")
+        return next(iter(ticks_by_account.values()), list())
+
+    return ticks_by_account.get(account, list())
+
+
+# Stands in for kucoin.client.Margin and serves the book of the current tick, with the simulated open order put
+# in instead of the live bot's own orders
+class FakeMarginClient:
+
+    rates: list
+    sizes: list
+    open_order: dict = None
+
+    def __init__(self) -> None:
+        self.rates = list()
+        self.sizes = list()
+
+
+    def set_tick(self, tick: BacktestTick, open_order: dict, size_decimal_places: int) -> None:
+        self.open_order = open_order
+        if open_order is None:
+            self.rates = tick.rates
+            self.sizes = tick.sizes
+            return
+
+        rate = to_rate(open_order["DailyInterestRate"])
+        pending_size = to_scaled(open_order["Size"] - open_order["FilledSize"], size_decimal_places)
+        index = bisect_left(tick.rates, rate)
+        if index < len(tick.rates) and tick.rates[index] == rate:
+            self.rates = tick.rates
+            self.sizes = list(tick.sizes)
+            self.sizes[index] += pending_size
+            return
+
+        size = tick.empty_sizes.get(rate, 0) + pending_size
+        if size <= 0:
+            self.rates = tick.rates
+            self.sizes = tick.sizes
+            return
+
+        self.rates = tick.rates[:index] + [rate] + tick.rates[index:]
+        self.sizes = tick.sizes[:index] + [size] + tick.sizes[index:]
+
+
+    def get_active_order(self, currency: str = None, **kwargs) -> dict:
+        if self.open_order is None:
+            return {"totalNum": 0, "items": list()}
+
+        return {
+            "totalNum": 1,
+            "items": [{
+                "orderId": self.open_order["OrderId"],
+                "dailyIntRate": str(self.open_order["DailyInterestRate"] / 100),
+                "size": str(self.open_order["Size"]),
+                "filledSize": str(self.open_order["FilledSize"]),
+            }],
+        }
+
+
+class BacktestBot(StepBot):
+
+    def log(self, message) -> None:
+        pass
+
+
+    def call(self, name: str, fn, *args, labels: dict = None, **kwargs):
+        return fn(*args, **kwargs)
+
+
+    def iter_book_lines(self, min_rate: int):
+        # The tick's book is already parsed, no need to go through the shared market cache
+        rates = self.margin_client.rates
+        start = bisect_left(rates, min_rate)
+        return zip(islice(rates, start, None), islice(self.margin_client.sizes, start, None))
+
+
+    def get_lowest_rate(self) -> int:
+        return self.margin_client.rates[0]
+
+
+def run_backtest(account_data: dict, step_bot_data: dict, ticks: list, initial_balance: Decimal) -> dict:
+    config = AccountConfiguration("backtest", dict(BACKTEST_ACCOUNT_DATA, **account_data), step_bot_data)
+    margin_client = FakeMarginClient()
+    bot = BacktestBot(config, user_client=object(), margin_client=margin_client)
+
+    size_decimal_places = bot.size_decimal_places
+    fee_ratio = (100 - config.lending_fee_rate) / 100
+
+    available_balance = initial_balance
+    open_order = None
+    # Heap of (maturity time, tick, size, daily interest rate), with the running totals over it
+    loans = list()
+    lent_balance = Decimal(0)
+    lent_weighted_rate = Decimal(0)
+    earned_interest = Decimal(0)
+
+    created_count = 0
+    canceled_count = 0
+    filled_size = Decimal(0)
+    filled_weighted_rate = Decimal(0)
+    cumulative_utilization = Decimal(0)
+
+    previous_tick = None
+    for tick_index, tick in enumerate(ticks):
+        timestamp = tick.timestamp
+
+        # Accrue interest since the last tick and release matured loans
+        if previous_tick is not None:
+            elapsed_days = Decimal(timestamp - previous_tick.timestamp) / MILLISECONDS_PER_DAY
+            earned_interest += lent_weighted_rate / 100 * elapsed_days * fee_ratio
+
+        while len(loans) > 0 and loans[0][0] <= timestamp:
+            _, _, loan_size, loan_rate = heapq.heappop(loans)
+            available_balance += loan_size
+            lent_balance -= loan_size
+            lent_weighted_rate -= loan_size * loan_rate
+
+        # Borrowers take the cheapest offers first. Whatever they took beyond the liquidity priced below
+        # our order is assumed to have filled it, ahead of other offers at the same rate.
+        if open_order is not None and previous_tick is not None:
+            rate = to_rate(open_order["DailyInterestRate"])
+            taken_size = previous_tick.get_cumulative_size(rate, True) - tick.get_cumulative_size(rate, True)
+            cheaper_size = previous_tick.get_cumulative_size(rate, False)
+            pending_size = to_scaled(open_order["Size"] - open_order["FilledSize"], size_decimal_places)
+            fill_size = min(pending_size, max(taken_size - cheaper_size, 0))
+            if fill_size > 0:
+                fill_size = from_size(fill_size, size_decimal_places)
+                open_order["FilledSize"] += fill_size
+                heapq.heappush(loans, (timestamp + open_order["Term"] * MILLISECONDS_PER_DAY, tick_index, fill_size, open_order["DailyInterestRate"]))
+                lent_balance += fill_size
+                lent_weighted_rate += fill_size * open_order["DailyInterestRate"]
+                filled_size += fill_size
+                filled_weighted_rate += fill_size * open_order["DailyInterestRate"]
+            if open_order["FilledSize"] >= open_order["Size"]:
+                open_order = None
+
+        previous_tick = tick
+        margin_client.set_tick(tick, open_order, size_decimal_places)
+        bot.snapshot = bot.account_snapshot = TickSnapshot()
+
+        my_active_open_orders = bot.get_my_active_open_orders()
+        pending_balance = from_size(sum(order.pending_size for order in my_active_open_orders), size_decimal_places)
+        total_balance = available_balance + pending_balance + lent_balance
+
+        balance_utilization_rate = utils.round_down(lent_balance / total_balance * 100, 2)
+        cumulative_utilization += balance_utilization_rate
+
+        min_daily_interest_rate = bot.calculate_minimum_daily_interest_rate(balance_utilization_rate)
+        try:
+            market_data = bot.get_market_data(my_active_open_orders, min_daily_interest_rate)
+        except Exception:
+            continue
+        my_optimal_rate = bot.calculate_my_optimal_daily_interest_rate(market_data, my_active_open_orders, min_daily_interest_rate)
+
+        if open_order is not None:
+            if open_order["DailyInterestRate"] <= my_optimal_rate:
+                continue
+            available_balance += open_order["Size"] - open_order["FilledSize"]
+            open_order = None
+            canceled_count += 1
+
+        lending_size = bot.calculate_lending_size(total_balance, available_balance)
+        if lending_size == 0:
+            continue
+
+        open_order = {
+            "OrderId": str(tick),
+            "DailyInterestRate": my_optimal_rate,
+            "Size": lending_size,
+            "FilledSize": Decimal(0),
+            "Term": bot.calculate_term(my_optimal_rate),
+        }
+        available_balance -= lending_size
+        created_count += 1
+
+    if len(ticks) > 1:
+        elapsed_days = Decimal(ticks[-1].timestamp - ticks[0].timestamp) / MILLISECONDS_PER_DAY
+    else:
+        elapsed_days = Decimal(0)
+
+    return {
+        "step_bot": step_bot_data,
+        "ticks": len(ticks),
+        "created_orders": created_count,
+        "canceled_orders": canceled_count,
+        "filled_size": str(filled_size),
+        "average_filled_daily_interest_rate": str(utils.round_down(filled_weighted_rate / filled_size, 5)) if filled_size > 0 else None,
+        "average_utilization_rate": str(utils.round_down(cumulative_utilization / len(ticks), 2)) if len(ticks) > 0 else None,
+        "earned_interest": str(utils.round_down(earned_interest, config.currency_earning_report_decimal_places)),
+        "effective_daily_interest_rate": str(utils.round_down(earned_interest / initial_balance / elapsed_days * 100, 5)) if elapsed_days > 0 else None,
+    }
+
+
+def expand_sweep(step_bot_data: dict, sweep: dict) -> list:
+    if len(sweep) == 0:
+        return [step_bot_data]
+
+    keys = sorted(sweep.keys())
+    return [dict(step_bot_data, **dict(zip(keys, values))) for values in itertools.product(*[sweep[key] for key in keys])]
+
+
+def run_sweep(snapshots_path: str, backtest_config: dict, max_workers: int = None, account: str = None) -> list:
+    step_bot_data_list = expand_sweep(backtest_config["step_bot"], backtest_config.get("sweep", dict()))
+    initial_balance = Decimal(backtest_config["initial_balance"])
+
+    # Every configuration replays the same ticks, parse them once
+    config = AccountConfiguration("backtest", dict(BACKTEST_ACCOUNT_DATA, **backtest_config["account"]), step_bot_data_list[0])
+    if os.path.isdir(snapshots_path) or snapshots_path.endswith(".klb"):
+        ticks = load_history(snapshots_path, account, config.currency, config.currency_precision_decimal_places)
+    else:
+        ticks = prepare_snapshots(load_snapshots(snapshots_path), config.currency_precision_decimal_places)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_backtest, backtest_config["account"], step_bot_data, ticks, initial_balance) for step_bot_data in step_bot_data_list]
+        return [future.result() for future in futures]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay recorded lending books through the StepBot rate decisions")
+    parser.add_argument("snapshots", help="JSONL file of recorded ticks, or a recorder .klb file or recorder_path directory")
+    parser.add_argument("config", help="JSON file with account, step_bot, initial_balance and an optional sweep of step_bot values")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+    parser.add_argument("--account", default=None, help="Account name to replay from a recorder history that holds several")
+    args = parser.parse_args()
+
+    with open(args.config) as config_file:
+        backtest_config = json.load(config_file)
+
+    print(json.dumps(run_sweep(args.snapshots, backtest_config, args.workers, args.account), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import statistics
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import configuration
+import main
+from benchmarks.fake_firestore import FakeFirestore
+from benchmarks.kucoin_simulator import KucoinSimulator
+
+
+STEP_BOT_DATA = {
+    "minimum_lending_size_ratio": "0.05",
+    "maximum_lending_size_ratio": "0.2",
+    "minimum_daily_interest_rate": "0.03",
+    "40p_minimum_daily_interest_rate": "0.035",
+    "60p_minimum_daily_interest_rate": "0.04",
+    "80p_minimum_daily_interest_rate": "0.05",
+    "big_player_size_threshold": "200000",
+    "happy_daily_interest_rate": "0.06",
+    "happy_cumulative_size_threshold": "50000",
+    "term_14_daily_interest_rate": "0.07",
+    "term_28_daily_interest_rate": "0.08",
+}
+
+
+class BenchmarkRequest:
+
+    def __init__(self, should_execute: bool) -> None:
+        self.args = {"execute": "1"} if should_execute else dict()
+        self.headers = dict()
+
+
+    def get_json(self, silent: bool = False) -> dict:
+        return {"get_lending_status": 1}
+
+
+class ShardRequest:
+
+    def __init__(self, args: dict, json_params: dict, headers: dict) -> None:
+        self.args = args
+        self.json_params = json_params
+        self.headers = headers
+
+
+    def get_json(self, silent: bool = False) -> dict:
+        return self.json_params
+
+
+# Serves main.http_request over HTTP, so a coordinator tick can fan its shards out to this process
+class ShardServer:
+
+    def __init__(self) -> None:
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="shard-server", daemon=True)
+
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}/"
+
+
+    def start(self) -> "ShardServer":
+        self.thread.start()
+        return self
+
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+    def create_handler(self):
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+
+            def do_POST(self) -> None:
+                url_parts = urlsplit(self.path)
+                args = {key: values[0] for key, values in parse_qs(url_parts.query).items()}
+                content_length = int(self.headers.get("Content-Length") or 0)
+                json_params = json.loads(self.rfile.read(content_length)) if content_length > 0 else None
+
+                shard_response = main.http_request(ShardRequest(args, json_params, dict(self.headers)))
+                if isinstance(shard_response, str):
+                    body, content_type, status = shard_response.encode("utf-8"), "text/plain", 200
+                else:
+                    body, content_type, status = shard_response.get_data(), shard_response.mimetype, shard_response.status_code
+
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+
+CURRENCY_DATA = {
+    "currency_precision_decimal_places": 8,
+    "currency_earning_report_decimal_places": 4,
+    "currency_minimum_lending_size": "10",
+    "currency_lending_decimal_places": 0,
+    "lending_fee_rate": "10",
+    "reserved_balance": "0",
+}
+
+
+def create_firestore(base_url: str, number_of_accounts: int, max_concurrent_accounts: int, currencies: list, shards: int = 1, shard_url: str = None) -> FakeFirestore:
+    db = FakeFirestore()
+    lending_ref = db.collection("kucoin").document("lending")
+    lending_ref.set({"max_concurrent_accounts": max_concurrent_accounts, "account_deadline_seconds": 60, "shards": shards, "shard_url": shard_url})
+
+    for index in range(number_of_accounts):
+        account_ref = lending_ref.collection("accounts").document(f"account-{index:03d}")
+        account_data = {
+            "active": True,
+            "name": f"account-{index:03d}",
+            "kill": False,
+            "base_url": base_url,
+            "api_key": f"key-{index:03d}",
+            "api_secret": "secret",
+            "api_passphrase": "passphrase",
+        }
+
+        # A single currency uses the original account layout, several use the currencies map
+        if len(currencies) == 1:
+            account_ref.set(dict(account_data, currency=currencies[0], **CURRENCY_DATA))
+            account_ref.collection("bots").document("step").set(STEP_BOT_DATA)
+        else:
+            account_ref.set(dict(account_data, currencies={currency: CURRENCY_DATA for currency in currencies}))
+            for currency in currencies:
+                account_ref.collection("bots").document(f"step_{currency}").set(STEP_BOT_DATA)
+
+    return db
+
+
+def main_benchmark() -> None:
+    parser = argparse.ArgumentParser(description="Measure full http_request ticks against the local KuCoin simulator")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per KuCoin call")
+    parser.add_argument("--book-depth", type=int, default=2000)
+    parser.add_argument("--unsettled-orders", type=int, default=500)
+    parser.add_argument("--utilization", type=Decimal, default=Decimal("0.7"), help="Share of every balance lent out at the start")
+    parser.add_argument("--open-orders", type=int, default=1, help="Lend orders every account starts with, left by an earlier run")
+    parser.add_argument("--maturing-ratio", type=float, default=0.02, help="Share of the loans maturing within the first minute")
+    parser.add_argument("--repayment-rate", type=float, default=0.05, help="Chance per account read that a borrower repays a loan early")
+    parser.add_argument("--book-churn", type=float, default=0.02, help="Share of the book lines resized on every market read")
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--max-concurrent-accounts", type=int, default=8)
+    parser.add_argument("--execute", action="store_true", help="Place and cancel orders too")
+    parser.add_argument("--currencies", nargs="+", default=["USDT"], help="Currencies lent by every account")
+    parser.add_argument("--shards", type=int, default=1, help="Fan every tick out to this many shard invocations served by this process")
+    args = parser.parse_args()
+
+    shard_server = ShardServer().start() if args.shards > 1 else None
+
+    for number_of_accounts in args.accounts:
+        simulator = KucoinSimulator(latency_seconds=args.latency, error_rate=args.error_rate, book_depth=args.book_depth, unsettled_orders=args.unsettled_orders, currencies=tuple(args.currencies), utilization=args.utilization, open_orders=args.open_orders, maturing_ratio=args.maturing_ratio, repayment_rate=args.repayment_rate, book_churn=args.book_churn).start()
+        configuration.use_client(create_firestore(simulator.base_url, number_of_accounts, args.max_concurrent_accounts, args.currencies, args.shards, shard_server.url if shard_server is not None else None))
+
+        durations = list()
+        for _ in range(args.ticks):
+            start = time.perf_counter()
+            main.http_request(BenchmarkRequest(args.execute))
+            durations.append(time.perf_counter() - start)
+
+        simulator.stop()
+        print(f"Accounts=[{number_of_accounts}] Ticks=[{args.ticks}] Median=[{statistics.median(durations) * 1000:.1f}ms] Min=[{min(durations) * 1000:.1f}ms] Max=[{max(durations) * 1000:.1f}ms] Requests=[{simulator.request_count}]")
+
+    if shard_server is not None:
+        shard_server.stop()
+
+
+if __name__ == "__main__":
+    main_benchmark()
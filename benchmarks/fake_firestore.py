@@ -0,0 +1,132 @@
+from threading import RLock
+
+
+# Minimal in-memory stand-in for google.cloud.firestore.Client, enough to load a Configuration and take
+# account leases locally
+class DocumentSnapshot:
+
+    def __init__(self, reference, data: dict) -> None:
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.data = data
+
+
+    def to_dict(self) -> dict:
+        return dict(self.data) if self.data is not None else None
+
+
+class DocumentReference:
+
+    def __init__(self, client, path: str) -> None:
+        self.client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+
+    def collection(self, name: str):
+        return CollectionReference(self.client, f"{self.path}/{name}")
+
+
+    def get(self, transaction=None) -> DocumentSnapshot:
+        return DocumentSnapshot(self, self.client.documents.get(self.path))
+
+
+    def set(self, data: dict) -> None:
+        self.client.documents[self.path] = dict(data)
+
+
+    def delete(self) -> None:
+        self.client.documents.pop(self.path, None)
+
+
+class CollectionReference:
+
+    def __init__(self, client, path: str) -> None:
+        self.client = client
+        self.path = path
+
+
+    def document(self, document_id: str) -> DocumentReference:
+        return DocumentReference(self.client, f"{self.path}/{document_id}")
+
+
+    def stream(self):
+        prefix = self.path + "/"
+        for path in sorted(self.client.documents.keys()):
+            if path.startswith(prefix) and "/" not in path[len(prefix):]:
+                yield DocumentSnapshot(DocumentReference(self.client, path), self.client.documents[path])
+
+
+# Speaks the part of google.cloud.firestore.Transaction that the transactional decorator drives. Transactions run
+# one at a time, which is what Firestore's retries on contention amount to, so none is ever aborted.
+class Transaction:
+
+    _read_only = False
+    _max_attempts = 1
+
+    def __init__(self, client) -> None:
+        self.client = client
+        self.writes = list()
+        self._id = None
+
+
+    def set(self, reference: DocumentReference, data: dict) -> None:
+        self.writes.append((reference, data))
+
+
+    def delete(self, reference: DocumentReference) -> None:
+        self.writes.append((reference, None))
+
+
+    def _clean_up(self) -> None:
+        self.writes = list()
+
+
+    def _begin(self, retry_id=None) -> None:
+        self.client.transaction_lock.acquire()
+        self._id = id(self)
+
+
+    def _commit(self) -> None:
+        for reference, data in self.writes:
+            if data is None:
+                reference.delete()
+            else:
+                reference.set(data)
+        self._end()
+
+
+    def _rollback(self) -> None:
+        if self._id is not None:
+            self._end()
+
+
+    def _end(self) -> None:
+        self.writes = list()
+        self._id = None
+        self.client.transaction_lock.release()
+
+
+class FakeFirestore:
+
+    def __init__(self) -> None:
+        self.documents = dict()
+        self.transaction_lock = RLock()
+
+
+    def collection(self, name: str) -> CollectionReference:
+        return CollectionReference(self, name)
+
+
+    def document(self, path: str) -> DocumentReference:
+        return DocumentReference(self, path)
+
+
+    def get_all(self, references: list):
+        for reference in references:
+            yield reference.get()
+
+
+    def transaction(self) -> Transaction:
+        return Transaction(self)
@@ -0,0 +1,74 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+
+# What a cold instance runs before it can serve: importing the entry point, and importing it plus waiting for
+# the background prewarm of the heavy client libraries
+SCENARIOS = {
+    "import_main": "import main",
+    "import_main_prewarmed": "import main; main.prewarm_thread.join()",
+}
+
+
+def run_scenario(code: str) -> tuple:
+    # Every run is a fresh interpreter, so nothing is cached in sys.modules
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True, check=True)
+    wall_seconds = time.perf_counter() - start
+
+    # Lines look like "import time:       self [us] |  cumulative | imported package"
+    modules = list()
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        modules.append((name.rstrip(), int(self_us), int(cumulative_us)))
+
+    return wall_seconds, modules
+
+
+def main_benchmark() -> None:
+    parser = argparse.ArgumentParser(description="Measure the cold start import time of the Cloud Function entry point")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to show")
+    parser.add_argument("--history", help="Append the result as a JSON line to this file to track it over time")
+    args = parser.parse_args()
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "scenarios": dict(),
+    }
+
+    for scenario, code in SCENARIOS.items():
+        wall_times = list()
+        modules = None
+        for _ in range(args.runs):
+            wall_seconds, modules = run_scenario(code)
+            wall_times.append(wall_seconds)
+
+        # Nesting is not reliable once the prewarm thread imports in parallel, so rank the modules by their own time
+        main_ms = next((cumulative_us for name, _, cumulative_us in modules if name.strip() == "main"), 0) / 1000
+        slowest = sorted(modules, key=lambda module: module[1], reverse=True)
+        result["scenarios"][scenario] = {
+            "wall_ms": round(statistics.median(wall_times) * 1000, 1),
+            "main_ms": round(main_ms, 1),
+            "modules": len(modules),
+        }
+
+        print(f"Scenario=[{scenario}] Wall=[{statistics.median(wall_times) * 1000:.1f}ms] ImportMain=[{main_ms:.1f}ms] Modules=[{len(modules)}]")
+        for name, self_us, _ in slowest[:args.top]:
+            print(f"  {name.strip()}=[{self_us / 1000:.1f}ms]")
+
+    if args.history is not None:
+        with open(args.history, "a") as history_file:
+            history_file.write(json.dumps(result) + "\n")
+
+
+if __name__ == "__main__":
+    main_benchmark()
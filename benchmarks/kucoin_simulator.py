@@ -0,0 +1,502 @@
+import asyncio
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import websockets
+from websockets.asyncio.server import serve
+
+
+# In-process stand-in for the KuCoin REST endpoints the bots use. Requests are not authenticated, accounts are
+# told apart by their KC-API-KEY header and created on first use. Account reads without a currency filter
+# cover every currency in `currencies`.
+#
+# Every account starts with loans adding up to `utilization` of its balance, a settled history and `open_orders`
+# resting lend orders. Account reads
+# let the borrowers repay the loans past their maturity, and with `repayment_rate` one loan early.
+#
+# The private WebSocket feed is served too: /api/v1/bullet-private hands out a local endpoint, whose connections
+# receive the /account/balance and /margin/loan events of the account that asked for the token. fill_order and
+# repay_loan let a caller play the borrower.
+class KucoinSimulator:
+
+    MILLISECONDS_PER_DAY = 24 * 60 * 60 * 1000
+    MATURING_WINDOW_MILLISECONDS = 60 * 1000
+
+    def __init__(self, latency_seconds: float = 0, error_rate: float = 0, rate_limit_rate: float = 0, book_depth: int = 200, unsettled_orders: int = 100, balance: Decimal = Decimal(100000), currencies: tuple = ("USDT",), utilization: Decimal = Decimal("0.7"), settled_orders: int = 100, open_orders: int = 0, maturing_ratio: float = 0, repayment_rate: float = 0, book_churn: float = 0) -> None:
+        self.latency_seconds = latency_seconds
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.book_depth = book_depth
+        self.unsettled_orders = unsettled_orders
+        self.balance = balance
+        self.currencies = currencies
+
+        # Share of the balance lent out by the generated loans, and the settled history behind them
+        self.utilization = utilization
+        self.settled_orders = settled_orders
+        # Lend orders left open by an earlier run, at a random rate of the book
+        self.open_orders = open_orders
+        # Share of the generated loans maturing within the first MATURING_WINDOW_MILLISECONDS
+        self.maturing_ratio = maturing_ratio
+        # Chance per account read that a borrower repays a loan early, all of it or half
+        self.repayment_rate = repayment_rate
+        # Share of the book lines resized on every market read
+        self.book_churn = book_churn
+
+        self.lock = threading.Lock()
+        self.accounts = dict()
+        self.books = dict()
+        self.request_count = 0
+        self.request_counts = Counter()
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.create_handler())
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, name="kucoin-simulator", daemon=True)
+
+        # Only touched on the WebSocket thread
+        self.websocket_loop = asyncio.new_event_loop()
+        self.websocket_server = None
+        self.pusher = None
+        self.subscribers = list()
+        self.outbox = None
+        self.websocket_started = threading.Event()
+        self.websocket_thread = threading.Thread(target=self.serve_websocket_forever, name="kucoin-simulator-websocket", daemon=True)
+
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+
+    @property
+    def websocket_url(self) -> str:
+        return f"ws://127.0.0.1:{self.websocket_server.sockets[0].getsockname()[1]}/"
+
+
+    def start(self) -> "KucoinSimulator":
+        self.thread.start()
+        self.websocket_thread.start()
+        self.websocket_started.wait()
+        return self
+
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+        asyncio.run_coroutine_threadsafe(self.stop_websocket_server(), self.websocket_loop).result()
+        self.websocket_loop.call_soon_threadsafe(self.websocket_loop.stop)
+        self.websocket_thread.join()
+        self.websocket_loop.close()
+
+
+    def get_book(self, currency: str) -> list:
+        book = self.books.get(currency)
+        if book is None:
+            book = list()
+            for index in range(self.book_depth):
+                rate = Decimal(20 + index * 80 // max(self.book_depth, 1)) / 100000
+                book.append({"dailyIntRate": str(rate), "term": random.choice((7, 14, 28)), "size": self.draw_line_size()})
+            self.books[currency] = book
+        return book
+
+
+    def churn_book(self, book: list) -> None:
+        # Other lenders come and go
+        for _ in range(int(len(book) * self.book_churn)):
+            random.choice(book)["size"] = self.draw_line_size()
+
+
+    def draw_line_size(self) -> str:
+        # Mostly small offers and the odd big lender, so the big player rate moves as the book churns
+        if random.random() < 0.01:
+            return str(random.randint(50000, 400000))
+        return str(random.randint(10, 2000))
+
+
+    def get_account(self, api_key: str, currency: str) -> dict:
+        key = (api_key, currency)
+        account = self.accounts.get(key)
+        if account is None:
+            now = int(time.time() * 1000)
+
+            # The loans add up to the utilization of the balance
+            weights = [random.randint(10, 500) for _ in range(self.unsettled_orders)]
+            lent_target = self.balance * self.utilization
+            maturing_count = int(self.unsettled_orders * self.maturing_ratio)
+
+            unsettled_orders = list()
+            lent = Decimal(0)
+            for index, weight in enumerate(weights):
+                size = max(int(lent_target * weight / sum(weights)), 1)
+                term = random.choice((7, 14, 28))
+                if index < maturing_count:
+                    maturity_time = now + random.randint(1, self.MATURING_WINDOW_MILLISECONDS)
+                else:
+                    maturity_time = now + random.randint(1, term * 24) * 60 * 60 * 1000
+                lent += size
+                unsettled_orders.append({
+                    "tradeId": uuid.uuid4().hex,
+                    "currency": currency,
+                    "size": str(size),
+                    "accruedInterest": str(size * Decimal("0.0005")),
+                    "repaid": "0",
+                    "dailyIntRate": str(Decimal(random.randint(30, 90)) / 100000),
+                    "term": term,
+                    "maturityTime": maturity_time,
+                })
+            random.shuffle(unsettled_orders)
+
+            settled_orders = list()
+            for _ in range(self.settled_orders):
+                size = Decimal(random.randint(10, 500))
+                interest = size * Decimal(random.randint(30, 90)) / 100000 * random.randint(1, 28)
+                settled_orders.append({
+                    "tradeId": uuid.uuid4().hex,
+                    "currency": currency,
+                    "size": str(size),
+                    "interest": str(interest),
+                    "repaid": str(size + interest),
+                    "dailyIntRate": str(Decimal(random.randint(30, 90)) / 100000),
+                    "term": random.choice((7, 14, 28)),
+                    "settledAt": now - random.randint(1, 28 * self.MILLISECONDS_PER_DAY),
+                    "note": "",
+                })
+            settled_orders.sort(key=lambda order: order["settledAt"], reverse=True)
+
+            available = self.balance - lent
+            open_orders = list()
+            for _ in range(self.open_orders):
+                size = int(available / 4 / self.open_orders)
+                available -= size
+                open_orders.append({
+                    "orderId": uuid.uuid4().hex,
+                    "currency": currency,
+                    "size": str(size),
+                    "filledSize": "0",
+                    "dailyIntRate": random.choice(self.get_book(currency))["dailyIntRate"],
+                    "term": random.choice((7, 14, 28)),
+                    "createdAt": now - random.randint(1, self.MILLISECONDS_PER_DAY),
+                })
+
+            account = {
+                "available": available,
+                "unsettled_orders": unsettled_orders,
+                "settled_orders": settled_orders,
+                "open_orders": open_orders,
+            }
+            self.accounts[key] = account
+        return account
+
+
+    def advance(self, api_key: str, currency: str) -> None:
+        # Borrowers repay the loans past their maturity, and one early now and then. Called with the lock held.
+        account = self.get_account(api_key, currency)
+        now = int(time.time() * 1000)
+        for loan in [loan for loan in account["unsettled_orders"] if loan["maturityTime"] <= now]:
+            self.repay(api_key, currency, account, loan, None)
+
+        if len(account["unsettled_orders"]) > 0 and random.random() < self.repayment_rate:
+            loan = random.choice(account["unsettled_orders"])
+            remaining_size = Decimal(loan["size"]) - Decimal(loan["repaid"])
+            self.repay(api_key, currency, account, loan, random.choice((None, max(remaining_size // 2, 1))))
+
+
+    def get_main_account(self, api_key: str, currency: str) -> dict:
+        # Lent funds leave the main account, open lend orders stay in it as holds
+        account = self.get_account(api_key, currency)
+        pending = sum((Decimal(order["size"]) - Decimal(order["filledSize"]) for order in account["open_orders"]), Decimal(0))
+        return {"id": f"{api_key}-{currency}", "currency": currency, "type": "main", "balance": str(account["available"] + pending), "available": str(account["available"]), "holds": str(pending)}
+
+
+    def fill_order(self, api_key: str, currency: str, order_id: str, size: Decimal) -> Decimal:
+        # Lends up to size of an open order to a borrower, returns the size filled
+        with self.lock:
+            account = self.get_account(api_key, currency)
+            order = next((order for order in account["open_orders"] if order["orderId"] == order_id), None)
+            if order is None:
+                return Decimal(0)
+
+            filled_size = min(size, Decimal(order["size"]) - Decimal(order["filledSize"]))
+            order["filledSize"] = str(Decimal(order["filledSize"]) + filled_size)
+
+            # New loans are listed first
+            account["unsettled_orders"].insert(0, {
+                "tradeId": uuid.uuid4().hex,
+                "currency": currency,
+                "size": str(filled_size),
+                "accruedInterest": "0",
+                "repaid": "0",
+                "dailyIntRate": order["dailyIntRate"],
+                "term": order["term"],
+                "maturityTime": int(time.time() * 1000) + order["term"] * 24 * 60 * 60 * 1000,
+            })
+
+            if Decimal(order["filledSize"]) >= Decimal(order["size"]):
+                account["open_orders"].remove(order)
+                self.publish_loan(api_key, currency, "order.done", {"orderId": order_id, "reason": "filled"})
+            else:
+                self.publish_loan(api_key, currency, "order.update", {"orderId": order_id, "dailyIntRate": order["dailyIntRate"], "term": order["term"], "size": order["size"], "lentSize": order["filledSize"]})
+            self.publish_balance(api_key, currency, "main.lend")
+            return filled_size
+
+
+    def repay_loan(self, api_key: str, currency: str, trade_id: str, size: Decimal = None) -> None:
+        # A borrower repays size of a loan, all of it by default
+        with self.lock:
+            account = self.get_account(api_key, currency)
+            loan = next(loan for loan in account["unsettled_orders"] if loan["tradeId"] == trade_id)
+            self.repay(api_key, currency, account, loan, size)
+
+
+    def repay(self, api_key: str, currency: str, account: dict, loan: dict, size: Decimal) -> None:
+        # The accrued interest is paid along with the principal and credited to the main balance, a loan repaid in
+        # full is settled
+        remaining_size = Decimal(loan["size"]) - Decimal(loan["repaid"])
+        repaid_size = remaining_size if size is None else min(size, remaining_size)
+        interest = Decimal(loan["accruedInterest"])
+        account["available"] += repaid_size + interest
+
+        if repaid_size < remaining_size:
+            loan["repaid"] = str(Decimal(loan["repaid"]) + repaid_size)
+            loan["accruedInterest"] = "0"
+        else:
+            account["unsettled_orders"].remove(loan)
+            # Newest first, like KuCoin lists them
+            account["settled_orders"].insert(0, {
+                "tradeId": loan["tradeId"],
+                "currency": currency,
+                "size": loan["size"],
+                "interest": str(interest),
+                "repaid": str(Decimal(loan["size"]) + interest),
+                "dailyIntRate": loan["dailyIntRate"],
+                "term": loan["term"],
+                "settledAt": int(time.time() * 1000),
+                "note": "",
+            })
+        self.publish_balance(api_key, currency, "main.repay")
+
+
+    def publish_balance(self, api_key: str, currency: str, relation_event: str) -> None:
+        main_account = self.get_main_account(api_key, currency)
+        self.publish(api_key, {
+            "type": "message",
+            "topic": "/account/balance",
+            "subject": "account.balance",
+            "channelType": "private",
+            "data": {
+                "accountId": main_account["id"],
+                "currency": currency,
+                "total": main_account["balance"],
+                "available": main_account["available"],
+                "hold": main_account["holds"],
+                "relationEvent": relation_event,
+                "time": str(int(time.time() * 1000)),
+            },
+        })
+
+
+    def publish_loan(self, api_key: str, currency: str, subject: str, data: dict) -> None:
+        self.publish(api_key, {
+            "type": "message",
+            "topic": f"/margin/loan:{currency}",
+            "subject": subject,
+            "channelType": "private",
+            "data": dict(data, currency=currency, ts=time.time_ns()),
+        })
+
+
+    def publish(self, api_key: str, message: dict) -> None:
+        # Called from any thread, one queue keeps the events in order
+        self.websocket_loop.call_soon_threadsafe(self.outbox.put_nowait, (api_key, message))
+
+
+    def serve_websocket_forever(self) -> None:
+        asyncio.set_event_loop(self.websocket_loop)
+        self.websocket_loop.run_until_complete(self.start_websocket_server())
+        self.websocket_started.set()
+        self.websocket_loop.run_forever()
+
+
+    async def start_websocket_server(self) -> None:
+        self.outbox = asyncio.Queue()
+        self.websocket_server = await serve(self.handle_websocket, "127.0.0.1", 0)
+        self.pusher = asyncio.get_running_loop().create_task(self.push_events())
+
+
+    async def stop_websocket_server(self) -> None:
+        self.pusher.cancel()
+        self.websocket_server.close()
+        await self.websocket_server.wait_closed()
+
+
+    async def push_events(self) -> None:
+        while True:
+            api_key, message = await self.outbox.get()
+            for subscriber_key, topics, connection in list(self.subscribers):
+                if subscriber_key == api_key and message["topic"] in topics:
+                    try:
+                        await connection.send(json.dumps(message))
+                    except websockets.ConnectionClosed:
+                        pass
+
+
+    async def handle_websocket(self, connection) -> None:
+        query = {key: values[0] for key, values in parse_qs(urlsplit(connection.request.path).query).items()}
+        subscriber = (query.get("token", ""), set(), connection)
+        self.subscribers.append(subscriber)
+        try:
+            await connection.send(json.dumps({"id": query.get("connectId"), "type": "welcome"}))
+            async for raw_message in connection:
+                message = json.loads(raw_message)
+                if message.get("type") == "subscribe":
+                    subscriber[1].add(message["topic"])
+                    await connection.send(json.dumps({"id": message.get("id"), "type": "ack"}))
+                elif message.get("type") == "ping":
+                    await connection.send(json.dumps({"id": message.get("id"), "type": "pong"}))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.subscribers.remove(subscriber)
+
+
+    def handle(self, method: str, path: str, query: dict, body: dict, api_key: str):
+        currency = query.get("currency") or body.get("currency")
+        currencies = [currency] if currency is not None else self.currencies
+
+        if path == "/api/v1/margin/market":
+            book = self.get_book(currency or "USDT")
+            self.churn_book(book)
+            return book
+
+        if path in ("/api/v1/accounts", "/api/v1/margin/lend/trade/unsettled", "/api/v1/margin/lend/trade/settled", "/api/v1/margin/lend/active"):
+            for account_currency in currencies:
+                self.advance(api_key, account_currency)
+
+        if path == "/api/v1/accounts":
+            return [self.get_main_account(api_key, account_currency) for account_currency in currencies]
+
+        if path == "/api/v1/bullet-private":
+            # The token tells the WebSocket connections apart by account. The SDK passes encrypt on as the ssl
+            # argument, which websockets only accepts as None for a ws:// URI.
+            return {"token": api_key, "instanceServers": [{"endpoint": self.websocket_url, "encrypt": None, "protocol": "websocket", "pingInterval": 18000, "pingTimeout": 10000}]}
+
+        if path == "/api/v1/margin/lend/trade/unsettled":
+            return self.paginate([order for account_currency in currencies for order in self.get_account(api_key, account_currency)["unsettled_orders"]], query)
+
+        if path == "/api/v1/margin/lend/trade/settled":
+            settled_orders = [order for account_currency in currencies for order in self.get_account(api_key, account_currency)["settled_orders"]]
+            return self.paginate(sorted(settled_orders, key=lambda order: order["settledAt"], reverse=True), query)
+
+        if path == "/api/v1/margin/lend/active":
+            return self.paginate([order for account_currency in currencies for order in self.get_account(api_key, account_currency)["open_orders"]], query)
+
+        account = self.get_account(api_key, currency or "USDT")
+
+        if path == "/api/v1/margin/lend" and method == "POST":
+            size = Decimal(body["size"])
+            if size > account["available"]:
+                raise ValueError("Insufficient balance")
+            account["available"] -= size
+            order_id = uuid.uuid4().hex
+            account["open_orders"].append({
+                "orderId": order_id,
+                "currency": currency,
+                "size": body["size"],
+                "filledSize": "0",
+                "dailyIntRate": body["dailyIntRate"],
+                "term": int(body["term"]),
+                "createdAt": int(time.time() * 1000),
+            })
+            self.publish_loan(api_key, currency, "order.open", {"orderId": order_id, "dailyIntRate": body["dailyIntRate"], "term": int(body["term"]), "size": body["size"], "side": "lend"})
+            self.publish_balance(api_key, currency, "main.lend")
+            return {"orderId": order_id}
+
+        if path.startswith("/api/v1/margin/lend/") and method == "DELETE":
+            order_id = path.rsplit("/", 1)[1]
+            for (order_api_key, order_currency), other_account in self.accounts.items():
+                for order in other_account["open_orders"]:
+                    if order["orderId"] == order_id:
+                        other_account["open_orders"].remove(order)
+                        other_account["available"] += Decimal(order["size"]) - Decimal(order["filledSize"])
+                        self.publish_loan(order_api_key, order_currency, "order.done", {"orderId": order_id, "reason": "canceled"})
+                        self.publish_balance(order_api_key, order_currency, "main.lend")
+                        return dict()
+            raise KeyError(f"Unknown order {order_id}")
+
+        raise KeyError(f"Unknown endpoint {method} {path}")
+
+
+    def paginate(self, items: list, query: dict) -> dict:
+        current_page = int(query.get("currentPage", 1))
+        page_size = int(query.get("pageSize", 50))
+        total_num = len(items)
+        return {
+            "currentPage": current_page,
+            "pageSize": page_size,
+            "totalNum": total_num,
+            "totalPage": (total_num + page_size - 1) // page_size,
+            "items": items[(current_page - 1) * page_size:current_page * page_size],
+        }
+
+
+    def create_handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+
+            def do_GET(self) -> None:
+                self.dispatch("GET")
+
+
+            def do_POST(self) -> None:
+                self.dispatch("POST")
+
+
+            def do_DELETE(self) -> None:
+                self.dispatch("DELETE")
+
+
+            def dispatch(self, method: str) -> None:
+                url_parts = urlsplit(self.path)
+                query = {key: values[0] for key, values in parse_qs(url_parts.query).items()}
+                content_length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(content_length) or b"{}") if content_length > 0 else dict()
+
+                if simulator.latency_seconds > 0:
+                    time.sleep(simulator.latency_seconds)
+
+                with simulator.lock:
+                    simulator.request_count += 1
+                    simulator.request_counts[(self.headers.get("KC-API-KEY", ""), url_parts.path)] += 1
+                    roll = random.random()
+                    if roll < simulator.rate_limit_rate:
+                        status, payload = 429, {"code": "429000", "msg": "Too Many Requests"}
+                    elif roll < simulator.rate_limit_rate + simulator.error_rate:
+                        status, payload = 500, {"code": "500000", "msg": "Injected error"}
+                    else:
+                        try:
+                            status, payload = 200, {"code": "200000", "data": simulator.handle(method, url_parts.path, query, body, self.headers.get("KC-API-KEY", ""))}
+                        except Exception as ex:
+                            status, payload = 400, {"code": "400100", "msg": repr(ex)}
+
+                response = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+        return Handler
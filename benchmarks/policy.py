@@ -0,0 +1,91 @@
+import random
+import timeit
+from decimal import Decimal
+from types import SimpleNamespace
+
+import utils
+from configuration import StepBotConfiguration
+from policy import StepBotPolicy
+
+
+STEP_BOT_DATA = {
+    "minimum_lending_size_ratio": "0.05",
+    "maximum_lending_size_ratio": "0.2",
+    "minimum_daily_interest_rate": "0.03",
+    "40p_minimum_daily_interest_rate": "0.035",
+    "60p_minimum_daily_interest_rate": "0.04",
+    "80p_minimum_daily_interest_rate": "0.05",
+    "big_player_size_threshold": "200000",
+    "happy_daily_interest_rate": "0.06",
+    "happy_cumulative_size_threshold": "50000",
+    "term_14_daily_interest_rate": "0.07",
+    "term_28_daily_interest_rate": "0.08",
+}
+
+CURRENCY_MINIMUM_LENDING_SIZE = Decimal(10)
+LENDING_DECIMAL_PLACES = 0
+
+
+# The StepBot decisions before they were compiled into StepBotPolicy, on the fixed fields they used to read
+def legacy_decide(step_bot: SimpleNamespace, balance_utilization_rate: Decimal, daily_interest_rate: Decimal, total_balance: Decimal) -> tuple:
+    if balance_utilization_rate >= 80:
+        min_daily_interest_rate = step_bot.min_80p_daily_interest_rate
+    elif balance_utilization_rate >= 60:
+        min_daily_interest_rate = step_bot.min_60p_daily_interest_rate
+    elif balance_utilization_rate >= 40:
+        min_daily_interest_rate = step_bot.min_40p_daily_interest_rate
+    else:
+        min_daily_interest_rate = step_bot.min_daily_interest_rate
+
+    if daily_interest_rate >= step_bot.term_28_daily_interest_rate:
+        term = 28
+    elif daily_interest_rate >= step_bot.term_14_daily_interest_rate:
+        term = 14
+    else:
+        term = 7
+
+    minimum_size = total_balance * step_bot.min_lending_size_ratio
+    if minimum_size < CURRENCY_MINIMUM_LENDING_SIZE:
+        minimum_size = CURRENCY_MINIMUM_LENDING_SIZE
+    maximum_size = total_balance * step_bot.max_lending_size_ratio
+    if maximum_size < CURRENCY_MINIMUM_LENDING_SIZE:
+        maximum_size = CURRENCY_MINIMUM_LENDING_SIZE
+
+    return min_daily_interest_rate, term, utils.round_down(minimum_size, LENDING_DECIMAL_PLACES), utils.round_down(maximum_size, LENDING_DECIMAL_PLACES)
+
+
+def create_legacy_step_bot(step_bot_data: dict) -> SimpleNamespace:
+    # The attribute names StepBotConfiguration used for the fixed fields, with its clamp of the size ratios
+    step_bot = SimpleNamespace(**{name.replace("minimum", "min").replace("maximum", "max").replace("40p_min", "min_40p").replace("60p_min", "min_60p").replace("80p_min", "min_80p"): Decimal(value) for name, value in step_bot_data.items()})
+    step_bot.max_lending_size_ratio = max(step_bot.max_lending_size_ratio, step_bot.min_lending_size_ratio)
+    return step_bot
+
+
+def policy_decide(policy: StepBotPolicy, balance_utilization_rate: Decimal, daily_interest_rate: Decimal, total_balance: Decimal) -> tuple:
+    return (policy.get_minimum_daily_interest_rate(balance_utilization_rate), policy.get_allowed_terms(daily_interest_rate)[-1]) + policy.get_lending_size_limits(total_balance)
+
+
+def main() -> None:
+    inputs = [(Decimal(random.randint(0, 10000)) / 100, Decimal(random.randint(20, 100)) / 1000, Decimal(random.randint(0, 10 ** 8)) / 100) for _ in range(10000)]
+
+    step_bot = StepBotConfiguration("benchmark", STEP_BOT_DATA)
+    policy = StepBotPolicy(step_bot, CURRENCY_MINIMUM_LENDING_SIZE, LENDING_DECIMAL_PLACES)
+    legacy_step_bot = create_legacy_step_bot(STEP_BOT_DATA)
+    assert [legacy_decide(legacy_step_bot, *values) for values in inputs] == [policy_decide(policy, *values) for values in inputs]
+
+    number = 10
+    legacy = timeit.timeit(lambda: [legacy_decide(legacy_step_bot, *values) for values in inputs], number=number)
+    compiled = timeit.timeit(lambda: [policy_decide(policy, *values) for values in inputs], number=number)
+    build = timeit.timeit(lambda: StepBotPolicy(step_bot, CURRENCY_MINIMUM_LENDING_SIZE, LENDING_DECIMAL_PLACES), number=1000)
+
+    print(f"Decisions=[{len(inputs)}] Legacy=[{legacy / number / len(inputs) * 1e6:.2f}us] Policy=[{compiled / number / len(inputs) * 1e6:.2f}us] Build=[{build:.3f}ms]")
+
+    # More tiers only deepen the bisect
+    tiers = {str(utilization): str(Decimal(30 + utilization) / 1000) for utilization in range(5, 100, 5)}
+    tiered_policy = StepBotPolicy(StepBotConfiguration("benchmark", dict(STEP_BOT_DATA, minimum_daily_interest_rate_tiers=tiers)), CURRENCY_MINIMUM_LENDING_SIZE, LENDING_DECIMAL_PLACES)
+    tiered = timeit.timeit(lambda: [policy_decide(tiered_policy, *values) for values in inputs], number=number)
+    print(f"Tiers=[{len(tiers)}] Policy=[{tiered / number / len(inputs) * 1e6:.2f}us]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import random
+import statistics
+import time
+from collections import Counter
+from decimal import Decimal
+
+import configuration
+import daemon
+from benchmarks.end_to_end import create_firestore
+from benchmarks.kucoin_simulator import KucoinSimulator
+
+
+ACCOUNT_READ_PATHS = ("/api/v1/accounts", "/api/v1/margin/lend/active")
+SETTLE_SECONDS = 1
+
+
+# Notes when every account is executed, to measure how fast the daemon reacts to a fill
+class MeasuredDaemon(daemon.LendingDaemon):
+
+    def __init__(self, accounts: list, subscribe_feed) -> None:
+        super().__init__(accounts, subscribe_feed)
+        self.executions = Counter()
+        # Account name to the time of its oldest fill not executed on yet
+        self.fills = dict()
+        self.reaction_seconds = dict()
+
+
+    def execute(self, config, account_snapshot):
+        fill_time = self.fills.pop(config.name, None)
+        if fill_time is not None:
+            self.reaction_seconds.setdefault(config.name, list()).append(time.perf_counter() - fill_time)
+        self.executions[config.name] += 1
+        return super().execute(config, account_snapshot)
+
+
+def create_subscribe_feed(broken_accounts: set):
+    async def subscribe_feed(config, on_message, on_subscribed) -> None:
+        if config.name in broken_accounts:
+            raise ConnectionError("Injected WebSocket handshake failure")
+        await daemon.subscribe_private_feed(config, on_message, on_subscribed)
+
+    return subscribe_feed
+
+
+async def borrow(simulator: KucoinSimulator, measured_daemon: MeasuredDaemon, accounts: list, interval_seconds: float) -> None:
+    # Fills a random open lend order of a random account every interval
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval_seconds)
+        config = random.choice(accounts)
+        with simulator.lock:
+            order_ids = [order["orderId"] for order in simulator.get_account(config.api_key, config.currency)["open_orders"]]
+        if len(order_ids) == 0:
+            continue
+
+        measured_daemon.fills.setdefault(config.name, time.perf_counter())
+        await loop.run_in_executor(None, simulator.fill_order, config.api_key, config.currency, random.choice(order_ids), Decimal(random.randint(10, 2000)))
+
+
+def count_state_mismatches(simulator: KucoinSimulator, states: list) -> int:
+    # The account state kept from the events against what the simulator holds, where the daemon has one
+    mismatches = 0
+    for state in states:
+        with simulator.lock:
+            main_account = simulator.get_main_account(state.config.api_key, state.config.currency)
+            open_orders = {order["orderId"]: Decimal(order["filledSize"]) for order in simulator.get_account(state.config.api_key, state.config.currency)["open_orders"]}
+
+        if state.account_list is not None:
+            account = next(account for account in state.account_list if account["id"] == main_account["id"])
+            if any(Decimal(account[field]) != Decimal(main_account[field]) for field in ("balance", "available", "holds")):
+                mismatches += 1
+        if state.active_orders is not None:
+            if {item["orderId"]: Decimal(item["filledSize"]) for item in state.active_orders["items"]} != open_orders:
+                mismatches += 1
+    return mismatches
+
+
+async def run_benchmark(simulator: KucoinSimulator, measured_daemon: MeasuredDaemon, accounts: list, seconds: float, fill_interval_seconds: float) -> int:
+    daemon_task = asyncio.ensure_future(measured_daemon.run())
+    try:
+        await asyncio.wait_for(borrow(simulator, measured_daemon, accounts, fill_interval_seconds), timeout=seconds)
+    except asyncio.TimeoutError:
+        pass
+
+    # Let the last events arrive before comparing
+    await asyncio.sleep(SETTLE_SECONDS)
+    mismatches = count_state_mismatches(simulator, measured_daemon.states)
+
+    daemon_task.cancel()
+    await asyncio.wait([daemon_task])
+    return mismatches
+
+
+def main_benchmark() -> None:
+    parser = argparse.ArgumentParser(description="Run the push driven daemon against the local KuCoin simulator and its WebSocket feed")
+    parser.add_argument("--accounts", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per KuCoin call")
+    parser.add_argument("--fill-interval", type=float, default=0.5, help="Seconds between two borrower fills")
+    parser.add_argument("--broken-feeds", type=int, default=1, help="Accounts whose WebSocket subscription always fails")
+    parser.add_argument("--verbose", action="store_true", help="Show the bot logs")
+    args = parser.parse_args()
+
+    simulator = KucoinSimulator(latency_seconds=args.latency).start()
+    configuration.use_client(create_firestore(simulator.base_url, args.accounts, args.accounts, ["USDT"]))
+    accounts = [account_config for account_config in configuration.load_configuration().accounts if account_config.active]
+    broken_accounts = {account_config.name for account_config in accounts[:args.broken_feeds]}
+
+    measured_daemon = MeasuredDaemon(accounts, create_subscribe_feed(broken_accounts))
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output) if not args.verbose else contextlib.nullcontext():
+        mismatches = asyncio.run(run_benchmark(simulator, measured_daemon, accounts, args.seconds, args.fill_interval))
+    simulator.stop()
+
+    feed_failures = output.getvalue().count("subscribe_feed()")
+    for name, group in (("Healthy", [config for config in accounts if config.name not in broken_accounts]), ("BrokenFeed", [config for config in accounts if config.name in broken_accounts])):
+        if len(group) == 0:
+            continue
+        executions = sum(measured_daemon.executions[config.name] for config in group)
+        account_reads = sum(simulator.request_counts[(config.api_key, path)] for config in group for path in ACCOUNT_READ_PATHS)
+        reaction_seconds = [seconds for config in group for seconds in measured_daemon.reaction_seconds.get(config.name, list())] or [0]
+        print(f"{name}: Accounts=[{len(group)}] Executions=[{executions}] AccountReadsPerExecution=[{account_reads / max(executions, 1):.2f}] Fills=[{len(reaction_seconds)}] ReactionMedian=[{statistics.median(reaction_seconds) * 1000:.1f}ms] ReactionMax=[{max(reaction_seconds) * 1000:.1f}ms]")
+
+    print(f"Seconds=[{args.seconds}] FeedFailures=[{feed_failures}] StateMismatches=[{mismatches}] Requests=[{simulator.request_count}]")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,100 @@
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+from collections import Counter
+from decimal import Decimal
+
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from benchmarks.kucoin_simulator import KucoinSimulator
+from bots.factory import create_bot
+from bots.snapshot import TickSnapshot
+from configuration import AccountConfiguration
+from unsettled_store import UnsettledOrderStore
+
+
+PAGE_SIZE = 50
+
+# Borrower events, each one followed by a sync of the unsettled order store
+EVENTS = ("settle", "repay_first_page", "repay_later_page")
+
+
+class CountingStore(UnsettledOrderStore):
+
+    def __init__(self, path: str) -> None:
+        super().__init__(path)
+        self.reconcile_count = 0
+
+
+    def reconcile(self, account_key: str, source, main_balances: dict) -> None:
+        self.reconcile_count += 1
+        super().reconcile(account_key, source, main_balances)
+
+
+def apply_event(simulator: KucoinSimulator, config: AccountConfiguration, event: str) -> None:
+    with simulator.lock:
+        loans = list(simulator.get_account(config.api_key, config.currency)["unsettled_orders"])
+
+    if event == "settle":
+        loan = random.choice(loans)
+        simulator.repay_loan(config.api_key, config.currency, loan["tradeId"])
+    else:
+        loan = random.choice(loans[:PAGE_SIZE] if event == "repay_first_page" else loans[PAGE_SIZE:])
+        remaining_size = Decimal(loan["size"]) - Decimal(loan["repaid"])
+        simulator.repay_loan(config.api_key, config.currency, loan["tradeId"], max(remaining_size // 2, 1))
+
+
+def get_expected_totals(simulator: KucoinSimulator, config: AccountConfiguration) -> tuple:
+    with simulator.lock:
+        loans = simulator.get_account(config.api_key, config.currency)["unsettled_orders"]
+        return len(loans), sum((Decimal(loan["size"]) - Decimal(loan["repaid"]) for loan in loans), Decimal(0))
+
+
+def sync(store: UnsettledOrderStore, config: AccountConfiguration) -> dict:
+    bot = create_bot(config, TickSnapshot())
+    with contextlib.redirect_stdout(io.StringIO()):
+        return store.sync(bot.unsettled_store_key, bot, config.currency)
+
+
+def main_benchmark() -> None:
+    parser = argparse.ArgumentParser(description="Sync the unsettled order store after borrower repayments and count the full reconciles")
+    parser.add_argument("--loans", type=int, default=500)
+    parser.add_argument("--events", type=int, default=60)
+    args = parser.parse_args()
+
+    simulator = KucoinSimulator(unsettled_orders=args.loans, balance=Decimal(10 ** 6)).start()
+    config = AccountConfiguration("repayments", dict(CURRENCY_DATA, active=True, name="repayments", kill=False, base_url=simulator.base_url, api_key="repayments", api_secret="secret", api_passphrase="passphrase", currency="USDT"), STEP_BOT_DATA)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = CountingStore(os.path.join(directory, "unsettled_orders.sqlite3"))
+        sync(store, config)
+
+        events = Counter()
+        reconciles = Counter()
+        requests = Counter()
+        mismatches = 0
+        for index in range(args.events):
+            event = EVENTS[index % len(EVENTS)]
+            apply_event(simulator, config, event)
+
+            reconcile_count = store.reconcile_count
+            request_count = simulator.request_count
+            totals = sync(store, config)
+
+            events[event] += 1
+            reconciles[event] += store.reconcile_count - reconcile_count
+            requests[event] += simulator.request_count - request_count
+            if (totals["Count"], totals["RemainingSize"]) != get_expected_totals(simulator, config):
+                mismatches += 1
+
+    simulator.stop()
+
+    for event in EVENTS:
+        print(f"{event}: Events=[{events[event]}] Incremental=[{events[event] - reconciles[event]}] Reconciles=[{reconciles[event]}] RequestsPerSync=[{requests[event] / max(events[event], 1):.1f}]")
+    print(f"Loans=[{args.loans}] TotalsMismatches=[{mismatches}]")
+
+
+if __name__ == "__main__":
+    main_benchmark()
@@ -0,0 +1,51 @@
+import random
+import timeit
+from decimal import Decimal
+
+import utils
+
+
+# The string slicing helpers utils used before switching to Decimal.quantize
+def legacy_round_down_to_decimal_places_string(value: Decimal, decimal_places: int) -> str:
+    value_str = str(value)
+
+    separator_index = value_str.rfind(".")
+    if separator_index == -1:
+        if decimal_places == 0:
+            return value_str
+        return value_str + "." + ("0" * decimal_places)
+
+    if decimal_places == 0:
+        return value_str[:separator_index]
+
+    current_precision = len(value_str) - separator_index - 1
+    if current_precision < decimal_places:
+        return value_str + ("0" * (decimal_places - current_precision))
+
+    return value_str[:separator_index + decimal_places + 1]
+
+
+# Rounds a whole book with one quantum lookup
+def round_down_all(values: list, decimal_places: int) -> list:
+    quantum = utils.get_quantum(decimal_places)
+    return [utils.round_down_to_quantum(value, quantum) for value in values]
+
+
+def make_book(lines: int) -> list:
+    return [Decimal(f"0.000{random.randint(100, 999)}{random.randint(0, 99)}") * 100 for _ in range(lines)]
+
+
+def main() -> None:
+    for lines in (100, 1000, 10000):
+        book = make_book(lines)
+        number = max(10, 100000 // lines)
+
+        legacy = timeit.timeit(lambda: [Decimal(legacy_round_down_to_decimal_places_string(rate, 3)) for rate in book], number=number)
+        quantized = timeit.timeit(lambda: [utils.round_down(rate, 3) for rate in book], number=number)
+        vectorized = timeit.timeit(lambda: round_down_all(book, 3), number=number)
+
+        print(f"Lines=[{lines}] Legacy=[{legacy / number * 1000:.3f}ms] RoundDown=[{quantized / number * 1000:.3f}ms] RoundDownAll=[{vectorized / number * 1000:.3f}ms]")
+
+
+if __name__ == "__main__":
+    main()
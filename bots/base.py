@@ -1,11 +1,25 @@
+import sys
 from abc import abstractmethod
 from decimal import Decimal
+from time import monotonic, sleep, time
+from typing import TYPE_CHECKING
 
-from kucoin.client import User as UserClient
-from kucoin.client import Margin as MarginClient
-
+import clients
+import market_cache
+import recorder
+import unsettled_store
 import utils
 from configuration import AccountConfiguration
+from scheduler import scheduler
+from timing import TickTimings
+from . import book
+from .projection import MaturityProjection
+from .records import LendOrder, from_scaled, parse_rate, parse_scaled
+from .snapshot import TickSnapshot
+
+if TYPE_CHECKING:
+    from kucoin.client import User as UserClient
+    from kucoin.client import Margin as MarginClient
 
 
 class BaseBot:
@@ -13,33 +27,78 @@ class BaseBot:
     EPOCH_PER_HOUR = 60 * 60
     EPOCH_PER_DAY = EPOCH_PER_HOUR * 24
 
+    RELEASE_POLL_INITIAL_SECONDS = 0.05
+    RELEASE_POLL_MAX_SECONDS = 0.4
+    RELEASE_TIMEOUT_SECONDS = 3
+
+    UNSETTLED_RATE_DECIMAL_PLACES = 6
+
     config: AccountConfiguration
-    user_client: UserClient
-    margin_client: MarginClient
+    user_client: "UserClient"
+    margin_client: "MarginClient"
 
     response_log: list = None
 
     all_unsettled_orders: list = None
+    unsettled_store_synced: bool = False
+
+    deadline: float = None
 
+    decision: dict = None
 
-    def __init__(self, config: AccountConfiguration) -> None:
+    # Lend orders created or canceled during the tick, the account reads taken before are outdated once non-zero
+    lend_order_writes: int = 0
+
+    # Reads of the currency's lending book
+    snapshot: TickSnapshot
+    # Reads of the whole account. The bots of a multi-currency account share one and split it by currency.
+    account_snapshot: TickSnapshot
+    timings: TickTimings
+
+    def __init__(self, config: AccountConfiguration, user_client: "UserClient" = None, margin_client: "MarginClient" = None, account_snapshot: TickSnapshot = None) -> None:
         self.config = config
 
-        self.user_client = UserClient(
-            key=self.config.api_key,
-            secret=self.config.api_secret,
-            passphrase=self.config.api_passphrase,
-            is_sandbox=False,
-            url=self.config.base_url
-        )
+        if user_client is None or margin_client is None:
+            user_client, margin_client = clients.get_clients(
+                self.config.base_url,
+                self.config.api_key,
+                self.config.api_secret,
+                self.config.api_passphrase
+            )
+
+        self.user_client = user_client
+        self.margin_client = margin_client
+
+        self.snapshot = TickSnapshot()
+        self.account_snapshot = account_snapshot if account_snapshot is not None else self.snapshot
+        self.timings = TickTimings()
+
 
-        self.margin_client = MarginClient(
-            key=self.config.api_key,
-            secret=self.config.api_secret,
-            passphrase=self.config.api_passphrase,
-            is_sandbox=False,
-            url=self.config.base_url
-        )
+    @property
+    def size_decimal_places(self) -> int:
+        # Filled sizes and book lines can be finer than the lending step, so sizes keep the full currency precision
+        return self.config.currency_precision_decimal_places
+
+
+    @property
+    def unsettled_store_key(self) -> str:
+        if self.config.multi_currency:
+            return f"{self.config.id}:*"
+        return f"{self.config.id}:{self.config.currency}"
+
+
+    @property
+    def currency_filter(self) -> dict:
+        # Account-wide reads of multi-currency accounts are not filtered, the results are split locally
+        if self.config.multi_currency:
+            return dict()
+        return {"currency": self.config.currency}
+
+
+    def filter_currency(self, items: list) -> list:
+        if not self.config.multi_currency:
+            return items
+        return [item for item in items if item["currency"] == self.config.currency]
 
 
     @abstractmethod
@@ -48,37 +107,100 @@ class BaseBot:
 
 
     def log(self, message) -> None:
-        print(message)
+        # Accounts run on parallel threads, each line is written in one call and says which account it is about
+        sys.stdout.write(f"[{self.config.name}] {message}\n")
         if self.response_log is not None:
             self.response_log.append(message)
 
 
-    def get_account_balance(self) -> dict:
-        account_response = self.user_client.get_account_list(self.config.currency, "main")
+    def call(self, name: str, fn, *args, labels: dict = None, **kwargs):
+        # A run past its deadline may still be going after main.run_accounts gave up on it, it must not trade anymore
+        deadline = self.deadline if name in scheduler.WRITE_ENDPOINTS else None
+        with self.timings.measure(name, **(labels or dict())):
+            return scheduler.submit(self.config.base_url, self.config.api_key, name, fn, *args, deadline=deadline, **kwargs)
+
+
+    def record_tick(self) -> None:
+        snapshot_recorder = recorder.get_recorder()
+        if snapshot_recorder is None:
+            return
+
+        lending_market = self.snapshot.completed_result("lending_market")
+        if lending_market is None:
+            return
 
-        total_balance = Decimal(account_response[0]["balance"])
-        available_balance = Decimal(account_response[0]["available"])
-        total_accrued_interest = Decimal(0)
-        culumative_weighted_interest_rate = Decimal(0)
-        culumative_unsettled_size = Decimal(0)
+        active_orders_response = self.account_snapshot.completed_result("active_orders") or dict()
+        snapshot_recorder.record(int(time() * 1000), self.config.name, self.config.currency, lending_market, self.filter_currency(active_orders_response.get("items", list())), self.decision or dict())
 
-        all_unsettled_orders = self.get_all_unsettled_orders()
 
-        for order in all_unsettled_orders:
-            order_total_size = Decimal(order["size"])
-            order_remaining_size = order_total_size - Decimal(order["repaid"])
-            total_balance += order_remaining_size
-            total_accrued_interest += Decimal(order["accruedInterest"])
+    def is_past_deadline(self) -> bool:
+        return self.deadline is not None and monotonic() > self.deadline
+
+
+    def prefetch(self) -> None:
+        # None of these reads depend on each other, send them all at once
+        self.prefetch_decision_inputs()
+        self.prefetch_unsettled_orders()
+
+
+    def prefetch_account(self) -> None:
+        # Everything but the lending book, for callers that only report on the account
+        self.account_snapshot.submit("account_list", self.get_account_list)
+        self.account_snapshot.submit("active_orders", self.get_active_orders)
+        self.prefetch_unsettled_orders()
+
+
+    def prefetch_decision_inputs(self) -> None:
+        self.account_snapshot.submit("account_list", self.get_account_list)
+        self.account_snapshot.submit("active_orders", self.get_active_orders)
+        self.snapshot.submit("lending_market", self.get_lending_market)
+
+
+    def prefetch_unsettled_orders(self) -> None:
+        self.account_snapshot.submit("unsettled_orders_page_1", self.get_unsettled_orders, 1)
+        self.account_snapshot.submit("settled_orders_page_1", self.fetch_settled_orders, 1)
+
+
+    def get_account_list(self) -> list:
+        return self.call("get_account_list", self.user_client.get_account_list, self.currency_filter.get("currency"), "main")
+
+
+    def get_main_account(self, account_response: list = None) -> dict:
+        if account_response is None:
+            account_response = self.account_snapshot.result("account_list", self.get_account_list)
+
+        for account in account_response:
+            if account["currency"] == self.config.currency:
+                return account
+
+        # KuCoin only lists the currencies the account ever held
+        return {"currency": self.config.currency, "balance": "0", "available": "0"}
+
+
+    def get_main_balances(self) -> dict:
+        # Main account balances of every currency the store key covers, see UnsettledOrderStore
+        account_response = self.account_snapshot.result("account_list", self.get_account_list)
+        return {account["currency"]: account["balance"] for account in account_response}
+
+
+    def get_account_balance(self) -> dict:
+        account = self.get_main_account()
 
-            order_daily_interest_rate = Decimal(order["dailyIntRate"])
-            culumative_weighted_interest_rate += order_remaining_size * order_daily_interest_rate
-            culumative_unsettled_size += order_remaining_size
+        total_balance = Decimal(account["balance"])
+        available_balance = Decimal(account["available"])
+
+        unsettled_order_totals = self.get_unsettled_order_totals()
+
+        total_balance += unsettled_order_totals["RemainingSize"]
+        total_accrued_interest = unsettled_order_totals["AccruedInterest"]
+        culumative_weighted_interest_rate = unsettled_order_totals["WeightedDailyInterestRate"]
+        culumative_unsettled_size = unsettled_order_totals["RemainingSize"]
 
         unrealized_accrued_interest = total_accrued_interest * (100 - self.config.lending_fee_rate) / 100
 
         reserved_balance = self.config.reserved_balance
         if reserved_balance > 0:
-            reserved_percentage = utils.round_down_to_decimal_places(reserved_balance / total_balance * 100, 2)
+            reserved_percentage = utils.round_down(reserved_balance / total_balance * 100, 2)
             if reserved_percentage > 100:
                 reserved_percentage = 100
             self.log(f"ReservedBalance=[{reserved_balance}] ReservedPercentage=[{reserved_percentage}%]")
@@ -106,8 +228,66 @@ class BaseBot:
         return result
 
 
+    def get_unsettled_order_totals(self) -> dict:
+        try:
+            totals = unsettled_store.get_store().sync(self.unsettled_store_key, self, self.config.currency)
+            self.unsettled_store_synced = True
+            return totals
+        except Exception as ex:
+            self.log(f"[Exception] UnsettledOrderStore.sync(): [{repr(ex)}]")
+
+        size_decimal_places = self.size_decimal_places
+        count = 0
+        remaining_size = 0
+        weighted_daily_interest_rate = 0
+        accrued_interest = 0
+
+        for order in self.filter_currency(self.get_all_unsettled_orders()):
+            order_remaining_size = parse_scaled(order["size"], size_decimal_places) - parse_scaled(order["repaid"], size_decimal_places)
+            count += 1
+            remaining_size += order_remaining_size
+            weighted_daily_interest_rate += order_remaining_size * parse_scaled(order["dailyIntRate"], self.UNSETTLED_RATE_DECIMAL_PLACES)
+            accrued_interest += parse_scaled(order["accruedInterest"], size_decimal_places)
+
+        totals = {
+            "Count": count,
+            "RemainingSize": from_scaled(remaining_size, size_decimal_places),
+            "WeightedDailyInterestRate": from_scaled(weighted_daily_interest_rate, size_decimal_places + self.UNSETTLED_RATE_DECIMAL_PLACES),
+            "AccruedInterest": from_scaled(accrued_interest, size_decimal_places),
+        }
+
+        return totals
+
+
+    def get_maturity_projection(self) -> MaturityProjection:
+        # Reads the loans synced by get_unsettled_order_totals, the pages fetched for its fallback otherwise
+        store = unsettled_store.UnsettledOrderStore
+        if self.unsettled_store_synced:
+            rows = unsettled_store.get_store().get_orders(self.unsettled_store_key, self.config.currency)
+        else:
+            rows = [store.to_order_row(order) for order in self.filter_currency(self.get_all_unsettled_orders())]
+
+        return MaturityProjection(rows, int(time() * 1000), store.SIZE_SCALE, store.RATE_SCALE)
+
+
     def get_unsettled_orders(self, current_page: int) -> list:
-        return self.margin_client.get_active_list(currency=self.config.currency, currentPage=current_page, pageSize=50)
+        return self.call("get_active_list", self.margin_client.get_active_list, currentPage=current_page, pageSize=50, labels={"page": current_page}, **self.currency_filter)
+
+
+    def get_unsettled_orders_page(self, current_page: int) -> dict:
+        if current_page == 1:
+            return self.account_snapshot.result("unsettled_orders_page_1", self.get_unsettled_orders, 1)
+        return self.get_unsettled_orders(current_page)
+
+
+    def get_settled_orders(self, current_page: int) -> dict:
+        if current_page == 1:
+            return self.account_snapshot.result("settled_orders_page_1", self.fetch_settled_orders, 1)
+        return self.fetch_settled_orders(current_page)
+
+
+    def fetch_settled_orders(self, current_page: int) -> dict:
+        return self.call("get_settled_order", self.margin_client.get_settled_order, currentPage=current_page, pageSize=50, labels={"page": current_page}, **self.currency_filter)
 
 
     def get_all_unsettled_orders(self):
@@ -116,51 +296,66 @@ class BaseBot:
 
         self.all_unsettled_orders = list()
 
-        active_order_list_current_page = 1
-        while True:
-            unsettled_orders_response = self.get_unsettled_orders(current_page=active_order_list_current_page)
+        unsettled_orders_response = self.account_snapshot.result("unsettled_orders_page_1", self.get_unsettled_orders, 1)
+        if unsettled_orders_response["totalNum"] == 0:
+            return self.all_unsettled_orders
 
-            if unsettled_orders_response["totalNum"] == 0:
-                break
+        self.all_unsettled_orders += unsettled_orders_response["items"]
 
-            self.all_unsettled_orders += unsettled_orders_response["items"]
+        # The remaining pages are only known after the first one, fetch them concurrently
+        total_page = unsettled_orders_response["totalPage"]
+        page_futures = self.snapshot.submit_all(self.get_unsettled_orders, [(current_page,) for current_page in range(2, total_page + 1)])
+        for page_future in page_futures:
+            self.all_unsettled_orders += page_future.result()["items"]
 
-            if unsettled_orders_response["totalPage"] == active_order_list_current_page:
-                break
+        return self.all_unsettled_orders
 
-            active_order_list_current_page += 1
 
-        return self.all_unsettled_orders
+    def get_active_orders(self) -> dict:
+        return self.call("get_active_order", self.margin_client.get_active_order, **self.currency_filter)
 
 
     def get_my_active_open_orders(self) -> list:
-        active_open_orders_response = self.margin_client.get_active_order(currency=self.config.currency)
+        active_open_orders_response = self.account_snapshot.result("active_orders", self.get_active_orders)
 
         if active_open_orders_response["totalNum"] == 0:
             return list()
 
-        result = list()
-        for order in active_open_orders_response["items"]:
-            order_info = {
-                "OrderId": order["orderId"],
-                "DailyInterestRate": Decimal(utils.round_down_to_decimal_places_string(Decimal(order["dailyIntRate"]) * 100, 3)),
-                "Size": Decimal(order["size"]),
-                "FilledSize": Decimal(order["filledSize"]),
-            }
-            result.append(order_info)
+        size_decimal_places = self.size_decimal_places
+        return [
+            LendOrder(
+                order["orderId"],
+                parse_rate(order["dailyIntRate"]),
+                parse_scaled(order["size"], size_decimal_places),
+                parse_scaled(order["filledSize"], size_decimal_places),
+            )
+            for order in self.filter_currency(active_open_orders_response["items"])
+        ]
 
-        return result
+
+    def get_lending_market(self) -> list:
+        return market_cache.get_lending_market(self.config.base_url, self.config.currency, lambda: self.call("get_lending_market", self.margin_client.get_lending_market, self.config.currency))
 
 
     def get_lending_market_data(self) -> list:
-        return self.margin_client.get_lending_market(self.config.currency)
+        return self.snapshot.result("lending_market", self.get_lending_market)
+
+
+    def iter_book_lines(self, min_rate: int):
+        # (rate, size) of the lending book from min_rate up as scaled integers, see records.RATE_DECIMAL_PLACES
+        return book.iter_book_lines(self.get_lending_market_data(), min_rate, self.size_decimal_places)
+
+
+    def get_lowest_rate(self) -> int:
+        return parse_rate(self.get_lending_market_data()[0]["dailyIntRate"])
 
 
     def create_lend_order(self, daily_interest_rate: Decimal, size: Decimal, term: int) -> None:
         daily_interest_rate_str = utils.round_down_to_decimal_places_string(daily_interest_rate / 100, 5)
 
+        self.lend_order_writes += 1
         try:
-            self.margin_client.create_lend_order(self.config.currency, str(size), daily_interest_rate_str, term)
+            self.call("create_lend_order", self.margin_client.create_lend_order, self.config.currency, str(size), daily_interest_rate_str, term)
             effective_daily_interest_rate = self.calculate_effective_daily_interest_rate(daily_interest_rate)
             effective_yeary_interest_rate = effective_daily_interest_rate * 365
             self.log(f"Created lend order: DailyInterestRate=[{daily_interest_rate}%] Size=[{size}] Term=[{term}] EffectiveDailyInterestRate=[{utils.round_down_to_decimal_places_string(effective_daily_interest_rate, 3)}%] EffectiveYearlyInterestRate=[{utils.round_down_to_decimal_places_string(effective_yeary_interest_rate, 3)}%]")
@@ -169,7 +364,43 @@ class BaseBot:
 
 
     def cancel_lend_order(self, order_id: str):
-        self.margin_client.cancel_lend_order(order_id)
+        self.lend_order_writes += 1
+        self.call("cancel_lend_order", self.margin_client.cancel_lend_order, order_id)
+
+
+    def wait_for_available_balance(self, required_balance: Decimal) -> float:
+        # Canceled sizes are released asynchronously. Poll with a short exponential backoff instead of sleeping blindly.
+        start = monotonic()
+        delay = self.RELEASE_POLL_INITIAL_SECONDS
+
+        while True:
+            account = self.get_main_account(self.get_account_list())
+            available_balance = Decimal(account["available"]) - self.config.reserved_balance
+            release_latency = monotonic() - start
+
+            if available_balance >= required_balance:
+                self.timings.add("release_latency", release_latency)
+                self.log(f"Balance released: AvailableBalance=[{available_balance}] ReleaseLatency=[{release_latency:.3f}s]")
+                return release_latency
+
+            if release_latency + delay > self.RELEASE_TIMEOUT_SECONDS or self.is_past_deadline():
+                self.log(f"Balance not released: AvailableBalance=[{available_balance}] RequiredBalance=[{required_balance}] Waited=[{release_latency:.3f}s]")
+                return None
+
+            sleep(delay)
+            delay = min(delay * 2, self.RELEASE_POLL_MAX_SECONDS)
+
+
+    def cancel_and_replace_lend_order(self, order_id: str, daily_interest_rate: Decimal, size: Decimal, term: int, available_balance: Decimal) -> None:
+        # available_balance is the one before the cancel, only wait for the release when it does not cover the size
+        self.cancel_lend_order(order_id)
+        if available_balance < size:
+            self.wait_for_available_balance(size)
+
+        if self.is_past_deadline():
+            self.log("Deadline exceeded, skip placing the replacement order")
+            return
+        self.create_lend_order(daily_interest_rate, size, term)
 
 
     def calculate_effective_daily_interest_rate(self, daily_interest_rate: Decimal) -> Decimal:
@@ -0,0 +1,42 @@
+from itertools import islice
+
+from .records import parse_rate, parse_scaled
+
+
+def find_first_line_index(market_data_response: list, rate: int) -> int:
+    # The lending book is sorted by rate, so the lines below the minimum rate are found by bisection
+    # instead of parsing every one of them
+    low = 0
+    high = len(market_data_response)
+    while low < high:
+        middle = (low + high) // 2
+        if parse_rate(market_data_response[middle]["dailyIntRate"]) < rate:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def iter_book_lines(market_data_response: list, min_rate: int, size_decimal_places: int):
+    # Yields (rate, size) as scaled integers, see records.RATE_DECIMAL_PLACES
+    start = find_first_line_index(market_data_response, min_rate)
+    for line in islice(market_data_response, start, None):
+        yield parse_rate(line["dailyIntRate"]), parse_scaled(line["size"], size_decimal_places)
+
+
+def iter_lines_to_big_player(book_lines, my_pending_sizes_by_rate: dict, big_player_size_threshold: int):
+    # Takes the (rate, size) lines of iter_book_lines and stops after the first rate whose size without our own
+    # orders is above the threshold, which are all the lines a StepBot decision looks at
+    big_player_rate = 0
+    size = 0
+    for line_rate, line_size in book_lines:
+        yield line_rate, line_size
+
+        if line_rate > big_player_rate:
+            big_player_rate = line_rate
+            size = line_size - my_pending_sizes_by_rate.get(line_rate, 0)
+        else:
+            size += line_size
+
+        if size > big_player_size_threshold:
+            return
@@ -0,0 +1,15 @@
+from configuration import AccountConfiguration
+from .base import BaseBot
+from .ladder import LadderBot
+from .snapshot import TickSnapshot
+from .step import StepBot
+
+
+BOT_TYPES = {
+    "step": StepBot,
+    "ladder": LadderBot,
+}
+
+
+def create_bot(config: AccountConfiguration, account_snapshot: TickSnapshot = None) -> BaseBot:
+    return BOT_TYPES[config.bot](config, account_snapshot=account_snapshot)
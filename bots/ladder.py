@@ -0,0 +1,165 @@
+from decimal import Decimal
+
+import recorder
+import utils
+from .base import BaseBot
+from .records import from_rate, from_size, to_rate, to_scaled
+
+
+class LadderBot(BaseBot):
+
+    def execute(self, params: dict) -> None:
+        if params.get("get_lending_status"):
+            self.response_log = list()
+
+        self.prefetch()
+
+        try:
+            account_balance = self.get_account_balance()
+        except Exception as ex:
+            self.log(f"[Exception] get_account_balance(): [{repr(ex)}]")
+            return self.response_log
+
+        total_balance = account_balance["Balance"]
+        available_balance = account_balance["Available"]
+
+        if total_balance <= 0:
+            self.log("TotalBalance=[0]")
+            return self.response_log
+
+        try:
+            my_active_open_orders = self.get_my_active_open_orders()
+        except Exception as ex:
+            self.log(f"[Exception] get_my_active_open_orders(): [{repr(ex)}]")
+            return self.response_log
+
+        size_decimal_places = self.size_decimal_places
+        pending_size = 0
+        for open_order in my_active_open_orders:
+            pending_size += open_order.pending_size
+            self.log(f"Active open order: DailyInterestRate=[{from_rate(open_order.rate)}%] Size=[{from_size(open_order.size, size_decimal_places)}] PendingSize=[{from_size(open_order.pending_size, size_decimal_places)}]")
+
+        pending_balance = from_size(pending_size, size_decimal_places)
+        balance_lent = total_balance - available_balance - pending_balance
+        balance_utilization_rate = utils.round_down(balance_lent / total_balance * 100, 2)
+        self.log(f"TotalBalance=[{total_balance}] AvailableBalance=[{available_balance}] PendingBalance=[{pending_balance}] UtilizationRate=[{balance_utilization_rate}%]")
+
+        try:
+            ladder = self.get_ladder(my_active_open_orders, available_balance + pending_balance)
+        except Exception as ex:
+            self.log(f"[Exception] get_ladder(): [{repr(ex)}]")
+            return self.response_log
+
+        for level in ladder:
+            self.log(f"Ladder level: DailyInterestRate=[{from_rate(level['Rate'])}%] Size=[{from_size(level['Size'], size_decimal_places)}] Term=[{level['Term']}]")
+
+        orders_to_cancel, levels_to_create = self.diff_ladder(ladder, my_active_open_orders)
+
+        if not params.get("should_execute"):
+            return self.response_log
+
+        if self.is_past_deadline():
+            self.log("Deadline exceeded, skip placing orders")
+            return self.response_log
+
+        self.decision = {"Action": recorder.ACTION_KEEP}
+
+        released_size = 0
+        for open_order in orders_to_cancel:
+            try:
+                self.cancel_lend_order(open_order.order_id)
+                released_size += open_order.pending_size
+                self.decision["Action"] |= recorder.ACTION_CANCEL
+                self.log(f"Canceled open order: DailyInterestRate=[{from_rate(open_order.rate)}%] CanceledSize=[{from_size(open_order.pending_size, size_decimal_places)}]")
+            except Exception as ex:
+                self.log(f"Failed to cancel lend order: Error:[{repr(ex)}]")
+
+        # Kept orders may be larger than their level, so only place what the freed balance covers
+        remaining_balance = available_balance + from_size(released_size, size_decimal_places)
+        sizes_to_create = list()
+        for level in levels_to_create:
+            size = utils.round_down(min(from_size(level["Size"], size_decimal_places), remaining_balance), self.config.currency_lending_decimal_places)
+            if size < self.config.currency_minimum_lending_size:
+                break
+            sizes_to_create.append((level, size))
+            remaining_balance -= size
+
+        if len(sizes_to_create) == 0:
+            if len(orders_to_cancel) == 0:
+                self.log("Keep my open orders")
+            return self.response_log
+
+        required_balance = sum(size for _, size in sizes_to_create)
+        if available_balance < required_balance:
+            self.wait_for_available_balance(required_balance)
+
+        for level, size in sizes_to_create:
+            if self.is_past_deadline():
+                self.log("Deadline exceeded, skip placing orders")
+                break
+            daily_interest_rate = from_rate(level["Rate"])
+            self.decision.update({"Action": self.decision["Action"] | recorder.ACTION_CREATE, "DailyInterestRate": daily_interest_rate, "Size": size, "Term": level["Term"]})
+            self.create_lend_order(daily_interest_rate, size, level["Term"])
+
+        return self.response_log
+
+
+    def get_ladder(self, my_active_open_orders: list, deployable_balance: Decimal) -> list:
+        # Levels hold the rate and size as scaled integers, see records
+        ladder_bot = self.config.ladder_bot
+        size_decimal_places = self.size_decimal_places
+        min_rate = to_rate(ladder_bot.min_daily_interest_rate)
+        ladder_depth_size = to_scaled(ladder_bot.ladder_depth_size, size_decimal_places)
+
+        # Cumulative book size per rate without our own orders, up to the ladder depth
+        my_sizes_by_rate = {order.rate: order.pending_size for order in my_active_open_orders}
+        line_rates = list()
+        cumulative_sizes = list()
+        cumulative_size = 0
+        for line_rate, line_size in self.iter_book_lines(min_rate):
+            cumulative_size += line_size - my_sizes_by_rate.pop(line_rate, 0)
+            if len(line_rates) > 0 and line_rates[-1] == line_rate:
+                cumulative_sizes[-1] = cumulative_size
+            else:
+                line_rates.append(line_rate)
+                cumulative_sizes.append(cumulative_size)
+
+            if cumulative_size > ladder_depth_size:
+                break
+
+        # Spread the levels evenly over the depth, each one just below the book at that depth
+        rates = list()
+        for level in range(1, ladder_bot.number_of_levels + 1):
+            target_size = -(-ladder_depth_size * level // ladder_bot.number_of_levels)
+            rate = min_rate
+            for line_rate, line_cumulative_size in zip(line_rates, cumulative_sizes):
+                rate = max(line_rate - 1, min_rate)
+                if line_cumulative_size >= target_size:
+                    break
+            if rate not in rates:
+                rates.append(rate)
+
+        minimum_size = self.config.currency_minimum_lending_size
+        number_of_levels = min(len(rates), int(deployable_balance / minimum_size)) if minimum_size > 0 else len(rates)
+        if number_of_levels <= 0:
+            return list()
+
+        rates = rates[:number_of_levels]
+        size = to_scaled(utils.round_down(deployable_balance / number_of_levels, self.config.currency_lending_decimal_places), size_decimal_places)
+
+        return [{"Rate": rate, "Size": size, "Term": self.calculate_term(from_rate(rate))} for rate in rates]
+
+
+    def diff_ladder(self, ladder: list, my_active_open_orders: list) -> tuple:
+        # An open order at a ladder rate stays as it is, which keeps cancel/create calls to the minimum
+        ladder_rates = {level["Rate"] for level in ladder}
+        open_order_rates = {order.rate for order in my_active_open_orders}
+
+        orders_to_cancel = [order for order in my_active_open_orders if order.rate not in ladder_rates]
+        levels_to_create = [level for level in ladder if level["Rate"] not in open_order_rates]
+
+        return orders_to_cancel, levels_to_create
+
+
+    def calculate_term(self, daily_interest_rate: Decimal) -> int:
+        return self.config.ladder_bot_policy.get_allowed_terms(daily_interest_rate)[-1]
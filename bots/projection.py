@@ -0,0 +1,78 @@
+from bisect import bisect_right
+from decimal import Decimal
+from itertools import accumulate
+
+
+MILLISECONDS_PER_HOUR = 60 * 60 * 1000
+MILLISECONDS_PER_DAY = 24 * MILLISECONDS_PER_HOUR
+
+
+# Unsettled loans sorted by maturity once, with prefix sums over them, so every query about the next hours is a
+# bisect. Rows are (remaining_size, daily_interest_rate, accrued_interest, maturity_time) scaled like the
+# unsettled order store, the rate being KuCoin's dailyIntRate fraction.
+class MaturityProjection:
+
+    size_scale: int
+    interest_scale: int
+
+    maturity_offsets: list
+    size_sums: list
+    size_offset_sums: list
+    interest_sums: list
+    interest_offset_sums: list
+
+    def __init__(self, rows: list, now: int, size_scale: int, rate_scale: int) -> None:
+        self.size_scale = size_scale
+        self.interest_scale = size_scale * rate_scale
+
+        # Milliseconds from now, loans past their maturity are about to be repaid
+        rows = sorted(rows, key=lambda row: row[3])
+        self.maturity_offsets = [max(row[3] - now, 0) for row in rows]
+
+        sizes = [row[0] for row in rows]
+        daily_interests = [row[0] * row[1] for row in rows]
+
+        self.size_sums = [0] + list(accumulate(sizes))
+        self.size_offset_sums = [0] + list(accumulate(size * offset for size, offset in zip(sizes, self.maturity_offsets)))
+        self.interest_sums = [0] + list(accumulate(daily_interests))
+        self.interest_offset_sums = [0] + list(accumulate(interest * offset for interest, offset in zip(daily_interests, self.maturity_offsets)))
+
+
+    def get_index(self, hours) -> int:
+        # Number of loans maturing within the next hours
+        return bisect_right(self.maturity_offsets, int(hours * MILLISECONDS_PER_HOUR))
+
+
+    def get_maturing_size(self, hours) -> Decimal:
+        return Decimal(self.size_sums[self.get_index(hours)]) / self.size_scale
+
+
+    def get_maturing_size_between(self, start_hours, end_hours) -> Decimal:
+        return Decimal(self.size_sums[self.get_index(end_hours)] - self.size_sums[self.get_index(start_hours)]) / self.size_scale
+
+
+    def get_maturing_size_per_hour(self, hours: int) -> list:
+        # The first hour also holds the loans already past their maturity
+        indexes = [0] + [self.get_index(hour) for hour in range(1, hours + 1)]
+        return [Decimal(self.size_sums[indexes[hour + 1]] - self.size_sums[indexes[hour]]) / self.size_scale for hour in range(hours)]
+
+
+    def get_interest(self, hours) -> Decimal:
+        # Loans earn until they mature or the window ends, whichever comes first
+        index = self.get_index(hours)
+        horizon = int(hours * MILLISECONDS_PER_HOUR)
+        interest = self.interest_offset_sums[index] + horizon * (self.interest_sums[-1] - self.interest_sums[index])
+        return Decimal(interest) / (self.interest_scale * MILLISECONDS_PER_DAY)
+
+
+    def get_cashflow(self, hours, fee_ratio: Decimal) -> Decimal:
+        # Principal coming back plus the interest earned, fee_ratio being the share of interest kept after the lending fee
+        return self.get_maturing_size(hours) + self.get_interest(hours) * fee_ratio
+
+
+    def get_relent_interest(self, hours, daily_interest_rate: Decimal) -> Decimal:
+        # Interest of the principal maturing within the window if it is lent again right away at daily_interest_rate%
+        index = self.get_index(hours)
+        horizon = int(hours * MILLISECONDS_PER_HOUR)
+        relent_size_time = horizon * self.size_sums[index] - self.size_offset_sums[index]
+        return Decimal(relent_size_time) * daily_interest_rate / (self.size_scale * MILLISECONDS_PER_DAY * 100)
@@ -0,0 +1,87 @@
+from decimal import Decimal
+
+
+# Rates are kept as daily percentages with 3 decimal places, e.g. 0.051% is 51
+RATE_DECIMAL_PLACES = 3
+
+# KuCoin reports dailyIntRate as a fraction, two places more than the percentage
+API_RATE_DECIMAL_PLACES = RATE_DECIMAL_PLACES + 2
+
+_powers_of_ten = [10 ** decimal_places for decimal_places in range(19)]
+
+
+def parse_scaled(text, decimal_places: int) -> int:
+    # Parses a KuCoin decimal string straight into a scaled integer, rounding down like utils.round_down
+    text = str(text)
+    if "e" in text or "E" in text:
+        text = format(Decimal(text), "f")
+
+    negative = text.startswith("-")
+    if negative:
+        text = text[1:]
+
+    whole, _, fraction = text.partition(".")
+    value = int(whole or "0") * _powers_of_ten[decimal_places]
+    if decimal_places > 0 and len(fraction) > 0:
+        value += int(fraction[:decimal_places].ljust(decimal_places, "0"))
+
+    return -value if negative else value
+
+
+def to_scaled(value: Decimal, decimal_places: int) -> int:
+    return int(value.scaleb(decimal_places))
+
+
+def from_scaled(value: int, decimal_places: int) -> Decimal:
+    return Decimal(value).scaleb(-decimal_places)
+
+
+def from_size(value: int, decimal_places: int) -> Decimal:
+    # Sizes read back without the trailing zeros of the scaling, like KuCoin formats them
+    size = from_scaled(value, decimal_places)
+    return size.quantize(1) if size == size.to_integral_value() else size.normalize()
+
+
+def parse_rate(daily_int_rate) -> int:
+    return parse_scaled(daily_int_rate, API_RATE_DECIMAL_PLACES)
+
+
+def to_rate(daily_interest_rate: Decimal) -> int:
+    return to_scaled(daily_interest_rate, RATE_DECIMAL_PLACES)
+
+
+def from_rate(rate: int) -> Decimal:
+    return from_scaled(rate, RATE_DECIMAL_PLACES)
+
+
+class LendOrder:
+
+    __slots__ = ("order_id", "rate", "size", "filled_size")
+
+    order_id: str
+    rate: int
+    size: int
+    filled_size: int
+
+    def __init__(self, order_id: str, rate: int, size: int, filled_size: int) -> None:
+        self.order_id = order_id
+        self.rate = rate
+        self.size = size
+        self.filled_size = filled_size
+
+
+    @property
+    def pending_size(self) -> int:
+        return self.size - self.filled_size
+
+
+class BookLine:
+
+    __slots__ = ("rate", "size")
+
+    rate: int
+    size: int
+
+    def __init__(self, rate: int, size: int) -> None:
+        self.rate = rate
+        self.size = size
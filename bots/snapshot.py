@@ -0,0 +1,50 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+MAX_WORKERS = 32
+
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="prefetch")
+
+
+# Holds the KuCoin reads of one tick. Reads submitted by prefetch run concurrently,
+# anything not prefetched is fetched on the calling thread on first use.
+class TickSnapshot:
+
+    def __init__(self) -> None:
+        self.futures = dict()
+
+
+    def submit(self, name: str, fn, *args) -> None:
+        # Bots sharing a snapshot each prefetch the same reads, only the first one is sent
+        if name not in self.futures:
+            self.futures[name] = executor.submit(fn, *args)
+
+
+    def submit_all(self, fn, args_list: list) -> list:
+        return [executor.submit(fn, *args) for args in args_list]
+
+
+    def result(self, name: str, fn, *args):
+        future = self.futures.get(name)
+        if future is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as ex:
+                future.set_exception(ex)
+            self.futures[name] = future
+        return future.result()
+
+
+    def set_result(self, name: str, value) -> None:
+        # A read already known without asking KuCoin, e.g. kept up to date from push events
+        future = Future()
+        future.set_result(value)
+        self.futures[name] = future
+
+
+    def completed_result(self, name: str):
+        future = self.futures.get(name)
+        if future is None or not future.done() or future.exception() is not None:
+            return None
+        return future.result()
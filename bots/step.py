@@ -1,16 +1,51 @@
 from decimal import Decimal
-from time import sleep
+from time import monotonic
 
+import decision_cache
+import recorder
 import utils
+from . import book
 from .base import BaseBot
+from .projection import MaturityProjection
+from .records import BookLine, LendOrder, from_rate, from_size, to_rate, to_scaled
 
 
 class StepBot(BaseBot):
 
+    PROJECTION_DAYS = 7
+    MATURING_PER_HOUR_HOURS = 24
+
+    min_daily_interest_rate: Decimal = None
+
+    reusable_decision: bool = False
+
+    # Indexes of the response_log lines that change with time alone, they are left out of the cached decision
+    time_dependent_log_indexes: set = None
+
     def execute(self, params: dict) -> None:
         if params.get("get_lending_status"):
             self.response_log = list()
 
+        cache_key = (self.config.id, self.config.currency)
+        cached_decision = decision_cache.get_decision(cache_key)
+
+        # The unsettled orders only matter when the decision is made again
+        self.prefetch_decision_inputs()
+        if cached_decision is not None and self.reuse_cached_decision(params, cached_decision):
+            return self.response_log
+        self.prefetch_unsettled_orders()
+
+        self.evaluate(params)
+
+        if self.reusable_decision:
+            self.cache_decision(cache_key, params)
+        elif cached_decision is not None:
+            decision_cache.discard_decision(cache_key)
+
+        return self.response_log
+
+
+    def evaluate(self, params: dict) -> None:
         try:
             account_balance = self.get_account_balance()
         except Exception as ex:
@@ -30,19 +65,18 @@ class StepBot(BaseBot):
             self.log(f"[Exception] get_my_active_open_orders(): [{repr(ex)}]")
             return self.response_log
 
-        my_order_interest_daily_rate = None
-        pending_balance = Decimal(0)
+        size_decimal_places = self.size_decimal_places
+        pending_size = 0
 
         for open_order in my_active_open_orders:
-            my_order_interest_daily_rate = open_order["DailyInterestRate"]
-            my_order_size = open_order["Size"]
-            my_pending_size = my_order_size - open_order["FilledSize"]
-            pending_balance += my_pending_size
-            self.log(f"Active open order: DailyInterestRate=[{my_order_interest_daily_rate}%] Size=[{my_order_size}] PendingSize=[{my_pending_size}]")
+            pending_size += open_order.pending_size
+            self.log(f"Active open order: DailyInterestRate=[{from_rate(open_order.rate)}%] Size=[{from_size(open_order.size, size_decimal_places)}] PendingSize=[{from_size(open_order.pending_size, size_decimal_places)}]")
 
+        pending_balance = from_size(pending_size, size_decimal_places)
         balance_lent = total_balance - available_balance - pending_balance
-        balance_utilization_rate = Decimal(utils.round_down_to_decimal_places_string(balance_lent / total_balance * 100, 2))
-        self.log(f"TotalBalance=[{total_balance}] AvailableBalance=[{available_balance}] PendingBalance=[{pending_balance}] UtilizationRate=[{balance_utilization_rate}%] ActualAccruedInterest=[{account_balance['ActualAccruedInterest']}]")
+        balance_utilization_rate = utils.round_down(balance_lent / total_balance * 100, 2)
+        self.log(f"TotalBalance=[{total_balance}] AvailableBalance=[{available_balance}] PendingBalance=[{pending_balance}] UtilizationRate=[{balance_utilization_rate}%]")
+        self.log_time_dependent(f"UnrealizedAccruedInterest=[{account_balance['UnrealizedAccruedInterest']}]")
 
         current_daily_interest_rate = account_balance["AverageDailyInterestRate"]
         effective_daily_interest_rate_on_total_balance = account_balance["EffectiveDailyInterestRateOnTotalBalance"]
@@ -54,6 +88,7 @@ class StepBot(BaseBot):
         self.log(f"Expected HourlyInterest=[{utils.round_down_to_decimal_places_string(expected_hourly_usdt, self.config.currency_earning_report_decimal_places)}] DailyInterest=[{utils.round_down_to_decimal_places_string(expected_daily_usdt, self.config.currency_earning_report_decimal_places)}]")
 
         min_daily_interest_rate = self.calculate_minimum_daily_interest_rate(balance_utilization_rate)
+        self.min_daily_interest_rate = min_daily_interest_rate
 
         try:
             market_data = self.get_market_data(my_active_open_orders, min_daily_interest_rate)
@@ -65,48 +100,76 @@ class StepBot(BaseBot):
         my_optimal_rate = self.calculate_my_optimal_daily_interest_rate(market_data, my_active_open_orders, min_daily_interest_rate)
         self.log(f"LowestRate=[{market_data['LowestRate']}%] BigPlayerRate=[{market_data['BigPlayerRate']}%] MyOptimalRate=[{my_optimal_rate}%]")
 
+        try:
+            with self.timings.measure("maturity_projection"):
+                projection = self.get_maturity_projection()
+            self.log_maturity_projection(projection, total_balance, my_optimal_rate)
+        except Exception as ex:
+            projection = None
+            self.log(f"[Exception] get_maturity_projection(): [{repr(ex)}]")
+
         if not params.get("should_execute"):
+            self.reusable_decision = True
+            return self.response_log
+
+        if self.is_past_deadline():
+            self.log("Deadline exceeded, skip placing orders")
             return self.response_log
 
+        canceled_order = None
         canceled_size = Decimal(0)
 
+        self.decision = dict()
+
         if len(my_active_open_orders) > 1:
+            self.decision["Action"] = recorder.ACTION_KEEP
+            self.reusable_decision = True
             self.log(f"Keep my open orders")
             return self.response_log
         elif len(my_active_open_orders) == 1:
             my_active_open_order = my_active_open_orders[0]
-            my_daily_interest_rate = my_active_open_order["DailyInterestRate"]
+            my_daily_interest_rate = from_rate(my_active_open_order.rate)
             if my_daily_interest_rate > my_optimal_rate:
-                try:
-                    self.margin_client.cancel_lend_order(my_active_open_order["OrderId"])
-                    canceled_size = my_active_open_order["Size"] - my_active_open_order["FilledSize"]
-                    available_balance += canceled_size
-                    self.log(f"Canceled open order: DailyInterestRate=[{my_daily_interest_rate}%] CanceledSize=[{canceled_size}] NewAvailableBalance=[{available_balance}]")
-                except Exception as ex:
-                    self.log(f"Failed to cancel lend order: Error:[{repr(ex)}]")
-                    return self.response_log
+                # Canceled together with the creation of its replacement below
+                canceled_order = my_active_open_order
+                canceled_size = from_size(my_active_open_order.pending_size, size_decimal_places)
             else:
+                self.decision = {"Action": recorder.ACTION_KEEP, "DailyInterestRate": my_daily_interest_rate}
+                self.reusable_decision = True
                 effective_daily_interest_rate = self.calculate_effective_daily_interest_rate(my_daily_interest_rate)
                 effective_yeary_interest_rate = effective_daily_interest_rate * 365
                 self.log(f"Keep my open order: DailyInterestRate=[{my_daily_interest_rate}%] EffectiveDailyInterestRate=[{utils.round_down_to_decimal_places_string(effective_daily_interest_rate, 3)}%] EffectiveYearlyInterestRate=[{utils.round_down_to_decimal_places_string(effective_yeary_interest_rate, 3)}%]")
                 return self.response_log
 
-        lending_size = self.calculate_lending_size(total_balance, available_balance)
+        lending_size = self.calculate_lending_size(total_balance, available_balance + canceled_size)
 
         if lending_size == Decimal(0):
+            if canceled_order is not None:
+                try:
+                    self.cancel_lend_order(canceled_order.order_id)
+                    self.decision["Action"] = recorder.ACTION_CANCEL
+                    self.log(f"Canceled open order: DailyInterestRate=[{from_rate(canceled_order.rate)}%] CanceledSize=[{canceled_size}] NewAvailableBalance=[{available_balance + canceled_size}]")
+                except Exception as ex:
+                    self.log(f"Failed to cancel lend order: Error:[{repr(ex)}]")
+                    return self.response_log
+
+            self.reusable_decision = canceled_size == 0
             self.log("Not enough available balance")
             return self.response_log
 
-        if (available_balance - canceled_size) < lending_size:
-            # Wait for canceled size to be released
-            sleep(1)
+        term = self.calculate_term(my_optimal_rate, projection)
+
+        if canceled_order is not None:
+            self.decision = {"Action": recorder.ACTION_CANCEL | recorder.ACTION_CREATE, "DailyInterestRate": my_optimal_rate, "Size": lending_size, "Term": term}
+            self.log(f"Replace open order: DailyInterestRate=[{from_rate(canceled_order.rate)}%] CanceledSize=[{canceled_size}] NewAvailableBalance=[{available_balance + canceled_size}]")
+            try:
+                self.cancel_and_replace_lend_order(canceled_order.order_id, my_optimal_rate, lending_size, term, available_balance)
+            except Exception as ex:
+                self.decision = dict()
+                self.log(f"Failed to cancel lend order: Error:[{repr(ex)}]")
+            return self.response_log
 
-        if my_optimal_rate >= self.config.step_bot.term_28_daily_interest_rate:
-            term = 28
-        elif my_optimal_rate >= self.config.step_bot.term_14_daily_interest_rate:
-            term = 14
-        else:
-            term = 7
+        self.decision.update({"Action": self.decision.get("Action", 0) | recorder.ACTION_CREATE, "DailyInterestRate": my_optimal_rate, "Size": lending_size, "Term": term})
 
         try:
             self.create_lend_order(my_optimal_rate, lending_size, term)
@@ -117,138 +180,197 @@ class StepBot(BaseBot):
         return self.response_log
 
 
-    def get_market_data(self, my_active_open_orders: list, min_daily_interest_rate: Decimal) -> dict:
-        market_data_response = self.get_lending_market_data()
+    def log_time_dependent(self, message) -> None:
+        if self.response_log is not None:
+            if self.time_dependent_log_indexes is None:
+                self.time_dependent_log_indexes = set()
+            self.time_dependent_log_indexes.add(len(self.response_log))
+        self.log(message)
 
-        big_player_size_threshold = self.config.step_bot.big_player_size_threshold
 
-        lowest_rate = Decimal(market_data_response[0]["dailyIntRate"]) * 100
-        big_player_rate = Decimal(0)
-        size = Decimal(0)
+    def log_maturity_projection(self, projection: MaturityProjection, total_balance: Decimal, my_optimal_rate: Decimal) -> None:
+        earning_decimal_places = self.config.currency_earning_report_decimal_places
+        fee_ratio = (100 - self.config.lending_fee_rate) / 100
+        projection_hours = self.PROJECTION_DAYS * 24
 
-        my_orders_by_rate = {order["DailyInterestRate"]: order for order in my_active_open_orders}
+        cashflow = projection.get_cashflow(24, fee_ratio)
+        self.log_time_dependent(f"Maturing NextHour=[{utils.round_down_to_decimal_places_string(projection.get_maturing_size(1), earning_decimal_places)}] Next24Hours=[{utils.round_down_to_decimal_places_string(projection.get_maturing_size(24), earning_decimal_places)}] Next{self.PROJECTION_DAYS}Days=[{utils.round_down_to_decimal_places_string(projection.get_maturing_size(projection_hours), earning_decimal_places)}] Cashflow24Hours=[{utils.round_down_to_decimal_places_string(cashflow, earning_decimal_places)}]")
 
-        offer_list = list()
-        for line in market_data_response:
-            line_rate = Decimal(line["dailyIntRate"]) * Decimal(100)
-            if line_rate < min_daily_interest_rate:
-                continue
+        maturing_per_hour = [utils.round_down_to_decimal_places_string(size, earning_decimal_places) for size in projection.get_maturing_size_per_hour(self.MATURING_PER_HOUR_HOURS)]
+        self.log_time_dependent(f"MaturingPerHour=[{', '.join(maturing_per_hour)}]")
+
+        # What the balance would earn if every loan maturing in the window were lent again at my optimal rate
+        projected_interest = (projection.get_interest(projection_hours) + projection.get_relent_interest(projection_hours, my_optimal_rate)) * fee_ratio
+        projected_daily_interest_rate = projected_interest / total_balance / self.PROJECTION_DAYS * 100
+        self.log_time_dependent(f"Projected{self.PROJECTION_DAYS}Days Interest=[{utils.round_down_to_decimal_places_string(projected_interest, earning_decimal_places)}] EffectiveDailyInterestRateOnTotalBalance=[{utils.round_down_to_decimal_places_string(projected_daily_interest_rate, 3)}%] RelentDailyInterestRate=[{my_optimal_rate}%]")
 
-            line_rate = Decimal(utils.round_down_to_decimal_places_string(line_rate, 3))
-            line_size = Decimal(line["size"])
 
+    def reuse_cached_decision(self, params: dict, cached_decision: decision_cache.CachedDecision) -> bool:
+        if self.response_log is not None and cached_decision.log is None:
+            return False
+
+        try:
+            fingerprint = self.get_decision_fingerprint(params, cached_decision.min_daily_interest_rate)
+        except Exception as ex:
+            self.log(f"[Exception] get_decision_fingerprint(): [{repr(ex)}]")
+            return False
+
+        if fingerprint != cached_decision.fingerprint:
+            return False
+
+        self.decision = cached_decision.decision
+        if self.response_log is not None:
+            self.response_log += cached_decision.log
+        self.log(f"Decision inputs unchanged: CachedAge=[{monotonic() - cached_decision.stored_at:.1f}s]")
+        return True
+
+
+    def cache_decision(self, cache_key: tuple, params: dict) -> None:
+        try:
+            fingerprint = self.get_decision_fingerprint(params, self.min_daily_interest_rate)
+        except Exception as ex:
+            self.log(f"[Exception] get_decision_fingerprint(): [{repr(ex)}]")
+            return
+
+        log = None
+        if self.response_log is not None:
+            time_dependent_log_indexes = self.time_dependent_log_indexes or set()
+            log = [line for index, line in enumerate(self.response_log) if index not in time_dependent_log_indexes]
+        decision_cache.put_decision(cache_key, decision_cache.CachedDecision(fingerprint, self.min_daily_interest_rate, self.decision, log))
+
+
+    def get_decision_fingerprint(self, params: dict, min_daily_interest_rate: Decimal) -> tuple:
+        # Utilization is not part of it on its own, it only moves when an order fills or a loan is repaid
+        # and both show up in the main account balance
+        account = self.get_main_account()
+        my_active_open_orders = self.get_my_active_open_orders()
+
+        size_decimal_places = self.size_decimal_places
+        my_pending_sizes_by_rate = {order.rate: order.pending_size for order in my_active_open_orders}
+        big_player_size_threshold = to_scaled(self.config.step_bot.big_player_size_threshold, size_decimal_places)
+        book_lines = book.iter_lines_to_big_player(self.iter_book_lines(to_rate(min_daily_interest_rate)), my_pending_sizes_by_rate, big_player_size_threshold)
+
+        return (
+            bool(params.get("should_execute")),
+            account["balance"],
+            account["available"],
+            tuple((order.order_id, order.rate, order.size, order.filled_size) for order in my_active_open_orders),
+            tuple(vars(self.config.step_bot).items()),
+            self.config.currency_minimum_lending_size,
+            self.config.currency_lending_decimal_places,
+            self.config.lending_fee_rate,
+            self.config.reserved_balance,
+            tuple(book_lines),
+        )
+
+
+    def get_market_data(self, my_active_open_orders: list, min_daily_interest_rate: Decimal) -> dict:
+        size_decimal_places = self.size_decimal_places
+        min_rate = to_rate(min_daily_interest_rate)
+        big_player_size_threshold = to_scaled(self.config.step_bot.big_player_size_threshold, size_decimal_places)
+        happy_rate = to_rate(self.config.step_bot.happy_daily_interest_rate)
+        happy_cumulative_size_threshold = to_scaled(self.config.step_bot.happy_cumulative_size_threshold, size_decimal_places)
+
+        lowest_rate = self.get_lowest_rate()
+        big_player_rate = 0
+
+        # Track the happy threshold while walking the book, so the optimal rate needs no second pass
+        happy_cumulative_size = 0
+        happy_index = None
+
+        my_pending_sizes_by_rate = {order.rate: order.pending_size for order in my_active_open_orders}
+
+        offer_list = list()
+        for line_rate, line_size in book.iter_lines_to_big_player(self.iter_book_lines(min_rate), my_pending_sizes_by_rate, big_player_size_threshold):
             if line_rate > big_player_rate:
-                offer_list.append({
-                    "Rate": line_rate,
-                    "Size": line_size,
-                })
+                offer_list.append(BookLine(line_rate, line_size))
 
                 big_player_rate = line_rate
-                size = line_size
-
-                my_open_order = my_orders_by_rate.get(line_rate)
-                if my_open_order is not None:
-                    my_size = my_open_order["Size"] - my_open_order["FilledSize"]
-                    size -= my_size
-            else:
-                size += line_size
 
-            if size > big_player_size_threshold:
-                break
+                if happy_index is None and line_rate >= min_rate and line_rate >= happy_rate:
+                    happy_cumulative_size += line_size
+                    if happy_cumulative_size > happy_cumulative_size_threshold:
+                        happy_index = len(offer_list) - 1
 
         if big_player_rate == 0:
             raise Exception("BigPlayerRate is zero. Something seems to be wrong.")
 
         result = {
-            "LowestRate": Decimal(utils.round_down_to_decimal_places_string(lowest_rate, 3)),
-            "BigPlayerRate": Decimal(utils.round_down_to_decimal_places_string(big_player_rate, 3)),
+            "LowestRate": from_rate(lowest_rate),
+            "BigPlayerRate": from_rate(big_player_rate),
             "OfferList": offer_list,
+            "HappyIndex": happy_index,
         }
 
         return result
 
 
-    def calculate_used_balance_percentage(self, account_balance: dict, my_active_open_order: dict) -> Decimal:
+    def calculate_used_balance_percentage(self, account_balance: dict, my_active_open_order: LendOrder) -> Decimal:
         total_balance = account_balance["Balance"]
 
         available_balance_include_open_order = account_balance["Available"]
         if my_active_open_order is not None:
-            available_balance_include_open_order += my_active_open_order["Size"] - my_active_open_order["FilledSize"]
+            available_balance_include_open_order += from_size(my_active_open_order.pending_size, self.size_decimal_places)
 
         return (total_balance - available_balance_include_open_order) / total_balance
 
 
     def calculate_minimum_daily_interest_rate(self, balance_utilization_rate: Decimal) -> Decimal:
-        if balance_utilization_rate >= 80:
-            return self.config.step_bot.min_80p_daily_interest_rate
-        if balance_utilization_rate >= 60:
-            return self.config.step_bot.min_60p_daily_interest_rate
-        if balance_utilization_rate >= 40:
-            return self.config.step_bot.min_40p_daily_interest_rate
-
-        return self.config.step_bot.min_daily_interest_rate
+        return self.config.step_bot_policy.get_minimum_daily_interest_rate(balance_utilization_rate)
 
 
     def calculate_my_optimal_daily_interest_rate(self, market_data: dict, my_active_open_orders: list, min_daily_interest_rate: Decimal) -> Decimal:
-        my_lowest_daily_interest_rate = None
+        my_lowest_rate = None
         if len(my_active_open_orders) >= 1:
-            my_lowest_daily_interest_rate = my_active_open_orders[0]["DailyInterestRate"]
+            my_lowest_rate = my_active_open_orders[0].rate
 
-        happy_rate = self.config.step_bot.happy_daily_interest_rate
-        big_player_rate = market_data["BigPlayerRate"]
-
-        happy_cumulative_size_threshold = self.config.step_bot.happy_cumulative_size_threshold
-
-        happy_cumulative_size = Decimal(0)
+        big_player_rate = to_rate(market_data["BigPlayerRate"])
         offer_list = market_data["OfferList"]
-        for line in offer_list:
-            line_rate = line["Rate"]
-            line_size = line["Size"]
 
-            if line_rate < min_daily_interest_rate:
-                continue
+        # Every line before the last one is below the big player rate, so only the happy threshold can decide there
+        happy_index = market_data["HappyIndex"]
+        if happy_index is not None and happy_index < len(offer_list) - 1:
+            line_rate = offer_list[happy_index].rate
+            if line_rate == my_lowest_rate:
+                return from_rate(line_rate)
+            return from_rate(line_rate - 1)
 
-            if line_rate == big_player_rate and line_rate == min_daily_interest_rate:
-                return line_rate
+        if len(offer_list) > 0:
+            line_rate = offer_list[-1].rate
+            min_rate = to_rate(min_daily_interest_rate)
 
-            if line_rate >= big_player_rate:
-                if my_lowest_daily_interest_rate is not None and line_rate == my_lowest_daily_interest_rate:
-                    return line_rate
-                return big_player_rate - Decimal("0.001")
+            if line_rate < min_rate:
+                return min_daily_interest_rate
 
-            if line_rate >= happy_rate:
-                happy_cumulative_size += line_size
-                if happy_cumulative_size > happy_cumulative_size_threshold:
-                    if my_lowest_daily_interest_rate is not None and line_rate == my_lowest_daily_interest_rate:
-                        return line_rate
-                    return line_rate - Decimal("0.001")
+            if line_rate == big_player_rate and line_rate == min_rate:
+                return from_rate(line_rate)
 
-        if len(offer_list) > 0:
-            rate = offer_list[-1]["Rate"]
-            if rate < min_daily_interest_rate:
-                return min_daily_interest_rate
-            else:
-                return rate
+            if line_rate == my_lowest_rate:
+                return from_rate(line_rate)
+            return from_rate(big_player_rate - 1)
 
         return Decimal(2)
 
 
-    def calculate_lending_size(self, total_balance: Decimal, available_balance: Decimal) -> Decimal:
-        minimum_size = total_balance * self.config.step_bot.min_lending_size_ratio
-        if minimum_size < self.config.currency_minimum_lending_size:
-            minimum_size = self.config.currency_minimum_lending_size
+    def calculate_term(self, daily_interest_rate: Decimal, projection: MaturityProjection = None) -> int:
+        terms = self.config.step_bot_policy.get_allowed_terms(daily_interest_rate)
 
-        maximum_size = total_balance * self.config.step_bot.max_lending_size_ratio
-        if maximum_size < self.config.currency_minimum_lending_size:
-            maximum_size = self.config.currency_minimum_lending_size
+        maturity_spread_hours = self.config.step_bot.maturity_spread_hours
+        if projection is None or maturity_spread_hours <= 0 or len(terms) == 1:
+            return terms[-1]
 
-        available_balance = Decimal(utils.round_down_to_decimal_places_string(available_balance, self.config.currency_lending_decimal_places))
-        minimum_size = Decimal(utils.round_down_to_decimal_places_string(minimum_size, self.config.currency_lending_decimal_places))
-        maximum_size = Decimal(utils.round_down_to_decimal_places_string(maximum_size, self.config.currency_lending_decimal_places))
+        # Spread the maturities: of the terms the rate allows, take the one whose maturity lands next to the least
+        # balance maturing anyway, the longest one on a tie
+        return min(reversed(terms), key=lambda term: projection.get_maturing_size_between(term * 24 - maturity_spread_hours, term * 24 + maturity_spread_hours))
+
+
+    def calculate_lending_size(self, total_balance: Decimal, available_balance: Decimal) -> Decimal:
+        minimum_size, maximum_size = self.config.step_bot_policy.get_lending_size_limits(total_balance)
+        available_balance = utils.round_down(available_balance, self.config.currency_lending_decimal_places)
 
         self.log(f"MinimumSize=[{minimum_size}] MaximumSize=[{maximum_size}] AvailableBalance=[{available_balance}]")
         if available_balance < minimum_size:
-            return Decimal(utils.round_down_to_decimal_places_string(0, self.config.currency_lending_decimal_places))
+            return utils.round_down(0, self.config.currency_lending_decimal_places)
 
         result = available_balance
         if available_balance > maximum_size:
@@ -0,0 +1,109 @@
+from threading import Lock
+from urllib.parse import urlsplit
+
+from bots import snapshot
+
+
+# Keeps KuCoin clients and their keep-alive connections alive across accounts and warm invocations
+class ClientPool:
+
+    # Every prefetch worker can hold a connection to the same host, a smaller pool closes the extra ones after each call
+    POOL_MAXSIZE = snapshot.MAX_WORKERS
+
+    installed: bool = False
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.sessions = dict()
+        self.clients = dict()
+
+
+    def install(self) -> None:
+        # Imported lazily, see main.prewarm
+        from kucoin.base_request import base_request
+
+        with self.lock:
+            if not self.installed:
+                base_request.requests = PooledRequests(self)
+                self.installed = True
+
+
+    def get_session(self, url: str):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        url_parts = urlsplit(url)
+        origin = f"{url_parts.scheme}://{url_parts.netloc}"
+
+        with self.lock:
+            session = self.sessions.get(origin)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_MAXSIZE)
+                session.mount(origin, adapter)
+                self.sessions[origin] = session
+
+        return session
+
+
+    def get_clients(self, base_url: str, api_key: str, api_secret: str, api_passphrase: str) -> tuple:
+        key = (base_url, api_key)
+        credentials = (api_secret, api_passphrase)
+
+        if not self.installed:
+            self.install()
+
+        with self.lock:
+            entry = self.clients.get(key)
+            if entry is None or entry[0] != credentials:
+                from kucoin.client import User as UserClient
+                from kucoin.client import Margin as MarginClient
+
+                user_client = UserClient(
+                    key=api_key,
+                    secret=api_secret,
+                    passphrase=api_passphrase,
+                    is_sandbox=False,
+                    url=base_url
+                )
+
+                margin_client = MarginClient(
+                    key=api_key,
+                    secret=api_secret,
+                    passphrase=api_passphrase,
+                    is_sandbox=False,
+                    url=base_url
+                )
+
+                entry = (credentials, user_client, margin_client)
+                self.clients[key] = entry
+
+        return entry[1], entry[2]
+
+
+# The KuCoin SDK calls the module-level requests.request(), which opens a new connection for every call.
+# Route those calls through the pooled sessions instead.
+class PooledRequests:
+
+    def __init__(self, pool: ClientPool) -> None:
+        self.pool = pool
+
+
+    def __getattr__(self, name):
+        import requests
+        return getattr(requests, name)
+
+
+    def request(self, method: str, url: str, **kwargs):
+        return self.pool.get_session(url).request(method, url, **kwargs)
+
+
+_pool = ClientPool()
+
+
+def install() -> None:
+    _pool.install()
+
+
+def get_clients(base_url: str, api_key: str, api_secret: str, api_passphrase: str) -> tuple:
+    return _pool.get_clients(base_url, api_key, api_secret, api_passphrase)
@@ -1,4 +1,19 @@
 from decimal import Decimal
+from threading import Lock
+from time import monotonic
+
+from policy import StepBotPolicy, TermPolicy
+
+
+def parse_term_daily_interest_rate_tiers(data: dict) -> tuple:
+    # Minimum daily interest rate per term, e.g. { "14": "0.07", "28": "0.08" }, the fixed 14/28 day fields otherwise
+    term_daily_interest_rate_tiers = data.get("term_daily_interest_rate_tiers")
+    if term_daily_interest_rate_tiers is None:
+        term_daily_interest_rate_tiers = {
+            "14": data["term_14_daily_interest_rate"],
+            "28": data["term_28_daily_interest_rate"],
+        }
+    return tuple(sorted((Decimal(rate), int(term)) for term, rate in term_daily_interest_rate_tiers.items()))
 
 
 class StepBotConfiguration:
@@ -9,29 +24,37 @@ class StepBotConfiguration:
     max_lending_size_ratio: Decimal
 
     min_daily_interest_rate: Decimal
-    min_40p_daily_interest_rate: Decimal
-    min_60p_daily_interest_rate: Decimal
-    min_80p_daily_interest_rate: Decimal
+    # Sorted (utilization %, minimum daily interest rate) pairs, each one applies from its utilization upwards
+    min_daily_interest_rate_tiers: tuple
     big_player_size_threshold: Decimal
 
     happy_daily_interest_rate: Decimal
     happy_cumulative_size_threshold: Decimal
 
-    term_14_daily_interest_rate: Decimal
-    term_28_daily_interest_rate: Decimal
+    # Sorted (daily interest rate, term) pairs, a rate reaching the tier allows its term
+    term_daily_interest_rate_tiers: tuple
 
-    def __init__(self, parent_name: str, doc) -> None:
-        data = doc.to_dict()
+    # Hours around the maturity of each allowed term to look for loans maturing anyway, 0 keeps the longest term
+    maturity_spread_hours: Decimal
 
+    def __init__(self, parent_name: str, data: dict) -> None:
         self.parent_name = parent_name
 
         self.min_lending_size_ratio = Decimal(data["minimum_lending_size_ratio"])
         self.max_lending_size_ratio = Decimal(data["maximum_lending_size_ratio"])
 
         self.min_daily_interest_rate = Decimal(data["minimum_daily_interest_rate"])
-        self.min_40p_daily_interest_rate = Decimal(data["40p_minimum_daily_interest_rate"])
-        self.min_60p_daily_interest_rate = Decimal(data["60p_minimum_daily_interest_rate"])
-        self.min_80p_daily_interest_rate = Decimal(data["80p_minimum_daily_interest_rate"])
+
+        # Any number of tiers, e.g. { "40": "0.035", "60": "0.04", "80": "0.05" }, the fixed 40/60/80% fields otherwise
+        min_daily_interest_rate_tiers = data.get("minimum_daily_interest_rate_tiers")
+        if min_daily_interest_rate_tiers is None:
+            min_daily_interest_rate_tiers = {
+                "40": data["40p_minimum_daily_interest_rate"],
+                "60": data["60p_minimum_daily_interest_rate"],
+                "80": data["80p_minimum_daily_interest_rate"],
+            }
+        self.min_daily_interest_rate_tiers = tuple(sorted((Decimal(utilization), Decimal(rate)) for utilization, rate in min_daily_interest_rate_tiers.items()))
+
         self.big_player_size_threshold = Decimal(data["big_player_size_threshold"])
 
         if self.max_lending_size_ratio < self.min_lending_size_ratio:
@@ -45,15 +68,43 @@ class StepBotConfiguration:
             print(f"HappyDailyInterestRate=[{self.happy_daily_interest_rate}%] is lower than MinDailyInterestRate=[{self.min_daily_interest_rate}%]. Will use MinDailyInterestRate instead.")
             self.happy_daily_interest_rate = self.min_daily_interest_rate
 
-        self.term_14_daily_interest_rate = Decimal(data["term_14_daily_interest_rate"])
-        self.term_28_daily_interest_rate = Decimal(data["term_28_daily_interest_rate"])
+        self.term_daily_interest_rate_tiers = parse_term_daily_interest_rate_tiers(data)
+
+        self.maturity_spread_hours = Decimal(data.get("maturity_spread_hours", 0))
+
+
+class LadderBotConfiguration:
+
+    parent_name: str
+
+    min_daily_interest_rate: Decimal
+    number_of_levels: int
+    ladder_depth_size: Decimal
+
+    # Sorted (daily interest rate, term) pairs, a rate reaching the tier allows its term
+    term_daily_interest_rate_tiers: tuple
+
+    def __init__(self, parent_name: str, data: dict) -> None:
+        self.parent_name = parent_name
+
+        self.min_daily_interest_rate = Decimal(data["minimum_daily_interest_rate"])
+        self.number_of_levels = int(data["number_of_levels"])
+        self.ladder_depth_size = Decimal(data["ladder_depth_size"])
+
+        if self.number_of_levels < 1:
+            print(f"NumberOfLevels=[{self.number_of_levels}] is lower than 1. Will use 1 instead.")
+            self.number_of_levels = 1
+
+        self.term_daily_interest_rate_tiers = parse_term_daily_interest_rate_tiers(data)
 
 
 class AccountConfiguration:
 
+    id: str
     name: str
     active: bool
     kill: bool
+    bot: str
 
     base_url: str
     api_key: str
@@ -69,11 +120,16 @@ class AccountConfiguration:
 
     reserved_balance: Decimal
 
-    step_bot: StepBotConfiguration
+    # Set when the account doc lends several currencies, each of them gets its own AccountConfiguration
+    multi_currency: bool = False
 
-    def __init__(self, doc, accounts_ref) -> None:
-        data = doc.to_dict()
+    step_bot: StepBotConfiguration = None
+    step_bot_policy: StepBotPolicy = None
+    ladder_bot: LadderBotConfiguration = None
+    ladder_bot_policy: TermPolicy = None
 
+    def __init__(self, account_id: str, data: dict, bot_data: dict, currency: str = None) -> None:
+        self.id = account_id
         self.active = bool(data["active"])
         if not self.active:
             return
@@ -81,6 +137,14 @@ class AccountConfiguration:
         self.name = data["name"]
         self.kill = bool(data["kill"])
 
+        if currency is not None:
+            # Settings of the currency entry override the ones of the account doc
+            data = {**data, **data["currencies"][currency], "currency": currency}
+            self.name = f"{self.name}/{currency}"
+            self.multi_currency = True
+
+        self.bot = data.get("bot", "step")
+
         self.base_url = data["base_url"]
         self.api_key = data["api_key"]
         self.api_secret = data["api_secret"]
@@ -96,17 +160,164 @@ class AccountConfiguration:
 
         self.reserved_balance = Decimal(data["reserved_balance"])
 
-        step_bot_doc = accounts_ref.document(doc.id).collection(u"bots").document(u"step").get()
-        self.step_bot = StepBotConfiguration(self.name, step_bot_doc)
+        if self.bot == "ladder":
+            self.ladder_bot = LadderBotConfiguration(self.name, bot_data)
+            self.ladder_bot_policy = TermPolicy(self.ladder_bot.term_daily_interest_rate_tiers)
+        else:
+            self.step_bot = StepBotConfiguration(self.name, bot_data)
+            self.step_bot_policy = StepBotPolicy(self.step_bot, self.currency_minimum_lending_size, self.currency_lending_decimal_places)
 
 
 class Configuration:
 
+    DEFAULT_MAX_CONCURRENT_ACCOUNTS = 4
+    DEFAULT_ACCOUNT_DEADLINE_SECONDS = 30
+    DEFAULT_CACHE_TTL_SECONDS = 60
+    DEFAULT_SHARD_TIMEOUT_SECONDS = 540
+
     accounts: list
 
+    max_concurrent_accounts: int
+    account_deadline_seconds: float
+
+    cache_ttl_seconds: float
+    watch: bool
+
+    recorder_path: str
+
+    # Accounts are split over this many worker invocations of shard_url, see sharding.py
+    shards: int
+    shard_url: str
+    shard_timeout_seconds: float
+
     def __init__(self, db) -> None:
         self.accounts = list()
 
+        lending_ref = db.collection(u"kucoin").document(u"lending")
+        accounts_ref = lending_ref.collection(u"accounts")
+
+        account_docs = list(accounts_ref.stream())
+
+        # Fetch the settings and every bot document in a single batch instead of one round trip per account.
+        # Accounts lending several currencies have a bot document per currency, e.g. bots/step_BTC.
+        bot_refs = dict()
+        for doc in account_docs:
+            account_data = doc.to_dict()
+            if not account_data.get("active"):
+                continue
+
+            bots_ref = accounts_ref.document(doc.id).collection(u"bots")
+            currencies = account_data.get("currencies")
+            if currencies:
+                for currency, currency_data in currencies.items():
+                    bot = currency_data.get("bot", account_data.get("bot", u"step"))
+                    bot_refs[(doc.id, currency)] = bots_ref.document(f"{bot}_{currency}")
+            else:
+                bot_refs[(doc.id, None)] = bots_ref.document(account_data.get("bot", u"step"))
+        snapshots = {snapshot.reference.path: snapshot.to_dict() for snapshot in db.get_all([lending_ref] + list(bot_refs.values()))}
+
+        data = snapshots.get(lending_ref.path) or dict()
+
+        self.max_concurrent_accounts = max(int(data.get("max_concurrent_accounts", self.DEFAULT_MAX_CONCURRENT_ACCOUNTS)), 1)
+        self.account_deadline_seconds = float(data.get("account_deadline_seconds", self.DEFAULT_ACCOUNT_DEADLINE_SECONDS))
+
+        self.cache_ttl_seconds = float(data.get("configuration_cache_ttl_seconds", self.DEFAULT_CACHE_TTL_SECONDS))
+        self.watch = bool(data.get("watch_configuration", False))
+
+        self.recorder_path = data.get("recorder_path")
+
+        self.shards = max(int(data.get("shards", 1)), 1)
+        self.shard_url = data.get("shard_url")
+        if self.shards > 1 and not self.shard_url:
+            # The URL a request arrives at is not the public URL of the function on Cloud Functions
+            raise ValueError(f"kucoin/lending: shard_url is required when shards is {self.shards}")
+        self.shard_timeout_seconds = float(data.get("shard_timeout_seconds", self.DEFAULT_SHARD_TIMEOUT_SECONDS))
+
+        for account_doc in account_docs:
+            account_data = account_doc.to_dict()
+            currencies = account_data.get("currencies") if account_data.get("active") else None
+            for currency in sorted(currencies) if currencies else [None]:
+                bot_ref = bot_refs.get((account_doc.id, currency))
+                bot_data = snapshots.get(bot_ref.path) if bot_ref is not None else None
+                self.accounts.append(AccountConfiguration(account_doc.id, account_data, bot_data, currency))
+
+
+# Keeps the Firestore client and the loaded configuration alive across warm invocations
+class ConfigurationCache:
+
+    db = None
+    configuration: Configuration = None
+    loaded_at: float = None
+    watches: list = None
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+
+
+    def get_client(self):
+        if self.db is None:
+            # Imported lazily, see main.prewarm
+            from google.cloud import firestore
+            self.db = firestore.Client()
+        return self.db
+
+
+    def get(self) -> Configuration:
+        with self.lock:
+            if self.configuration is None or self.loaded_at is None or monotonic() - self.loaded_at > self.configuration.cache_ttl_seconds:
+                self.configuration = Configuration(self.get_client())
+                self.loaded_at = monotonic()
+
+                if self.configuration.watch and self.watches is None:
+                    self.start_watching()
+
+            return self.configuration
+
+
+    def set_client(self, db) -> None:
+        with self.lock:
+            self.db = db
+            self.configuration = None
+            self.loaded_at = None
+
+
+    def invalidate(self) -> None:
+        self.loaded_at = None
+
+
+    def start_watching(self) -> None:
+        db = self.get_client()
         accounts_ref = db.collection(u"kucoin").document(u"lending").collection(u"accounts")
-        for account_doc in accounts_ref.stream():
-            self.accounts.append(AccountConfiguration(account_doc, accounts_ref))
+
+        self.watches = [
+            self.watch_query(accounts_ref),
+            self.watch_query(db.collection_group(u"bots")),
+        ]
+
+
+    def watch_query(self, query):
+        is_initial_snapshot = [True]
+
+        def on_snapshot(snapshots, changes, read_time):
+            # The first callback only delivers the current state, which is already loaded
+            if is_initial_snapshot[0]:
+                is_initial_snapshot[0] = False
+                return
+            self.invalidate()
+
+        return query.on_snapshot(on_snapshot)
+
+
+_cache = ConfigurationCache()
+
+
+def load_configuration() -> Configuration:
+    return _cache.get()
+
+
+def get_client():
+    return _cache.get_client()
+
+
+def use_client(db) -> None:
+    _cache.set_client(db)
@@ -0,0 +1,367 @@
+import asyncio
+
+from kucoin.client import WsToken
+from kucoin.ws_client import KucoinWsClient
+
+import clients
+import market_cache
+import recorder
+from bots import book
+from bots.base import BaseBot
+from bots.factory import create_bot
+from bots.records import to_rate, to_scaled
+from bots.snapshot import TickSnapshot
+from configuration import AccountConfiguration, load_configuration
+from scheduler import scheduler
+from ws_connection import FeedConnection, check_sdk_version
+
+
+async def subscribe_private_feed(config: AccountConfiguration, on_message, on_subscribed) -> None:
+    # Runs until the feed is lost, the caller subscribes again
+    token_client = WsToken(
+        key=config.api_key,
+        secret=config.api_secret,
+        passphrase=config.api_passphrase,
+        is_sandbox=False,
+        url=config.base_url
+    )
+
+    async def handle_message(message: dict) -> None:
+        on_message(message)
+
+    ws_client = await KucoinWsClient.create(asyncio.get_running_loop(), token_client, handle_message, private=True)
+    connection = FeedConnection(ws_client)
+    await ws_client.subscribe("/account/balance")
+    await ws_client.subscribe(f"/margin/loan:{config.currency}")
+
+    # Wait for the task the connection runs in, the SDK neither raises nor returns when the feed is lost
+    try:
+        if connection.connected:
+            on_subscribed()
+        else:
+            connection.task.cancel()
+        await asyncio.wait([connection.task])
+    finally:
+        await connection.close()
+
+    if not connection.task.cancelled() and connection.task.exception() is not None:
+        raise ConnectionError("Private feed closed") from connection.task.exception()
+    raise ConnectionError("Private feed closed")
+
+
+def calculate_book_fingerprint(lending_market: list, config: AccountConfiguration) -> tuple:
+    # Only the lines between the minimum rate and the depth the bot looks at can change its decision
+    if config.ladder_bot is not None:
+        min_daily_interest_rate = config.ladder_bot.min_daily_interest_rate
+        depth_size = config.ladder_bot.ladder_depth_size
+    else:
+        min_daily_interest_rate = config.step_bot.min_daily_interest_rate
+        depth_size = config.step_bot.big_player_size_threshold
+
+    size_decimal_places = config.currency_precision_decimal_places
+    depth_size = to_scaled(depth_size, size_decimal_places)
+
+    fingerprint = list()
+    size = 0
+    for line_rate, line_size in book.iter_book_lines(lending_market, to_rate(min_daily_interest_rate), size_decimal_places):
+        fingerprint.append((line_rate, line_size))
+        size += line_size
+        if size > depth_size:
+            break
+    return tuple(fingerprint)
+
+
+# What the daemon knows about an account between ticks. While the feed is subscribed, the account list and active
+# lend orders are kept as the REST reads return them and updated from the push events, so a tick only asks KuCoin
+# for them after they were invalidated. None until a tick seeds them.
+class AccountState:
+
+    config: AccountConfiguration
+    dirty: asyncio.Event
+    book_fingerprint: tuple = None
+    subscribed: bool = False
+
+    account_list: list = None
+    active_orders: dict = None
+    # Bumped by every event, reads taken by a tick are only current if no event arrived in the meantime
+    version: int = 0
+
+    def __init__(self, config: AccountConfiguration) -> None:
+        self.config = config
+        self.dirty = asyncio.Event()
+        self.dirty.set()
+
+
+    def invalidate(self) -> None:
+        self.account_list = None
+        self.active_orders = None
+        self.version += 1
+
+
+    def apply_balance(self, data: dict) -> bool:
+        self.version += 1
+        if self.account_list is not None:
+            for account in self.account_list:
+                if account["id"] == data.get("accountId"):
+                    account.update({"balance": data["total"], "available": data["available"], "holds": data["hold"]})
+                    break
+            else:
+                # A main account the list does not hold yet, e.g. the first deposit of a currency
+                if data.get("relationEvent", "").startswith("main."):
+                    self.account_list = None
+
+        return data.get("currency") == self.config.currency
+
+
+    def apply_loan(self, subject: str, data: dict) -> None:
+        self.version += 1
+        if self.active_orders is None:
+            return
+
+        items = self.active_orders["items"]
+        order = next((item for item in items if item["orderId"] == data.get("orderId")), None)
+        if subject == "order.open":
+            if order is None:
+                items.append({"orderId": data["orderId"], "currency": data["currency"], "dailyIntRate": str(data["dailyIntRate"]), "term": data["term"], "size": str(data["size"]), "filledSize": "0"})
+        elif subject == "order.update":
+            if order is None:
+                self.active_orders = None
+                return
+            order["filledSize"] = str(data["lentSize"])
+        elif subject == "order.done":
+            if order is not None:
+                items.remove(order)
+
+        self.active_orders["totalNum"] = len(items)
+
+
+    def create_snapshot(self) -> TickSnapshot:
+        # Copies, events keep coming in while the bot runs on another thread
+        account_snapshot = TickSnapshot()
+        if self.account_list is not None:
+            account_snapshot.set_result("account_list", [dict(account) for account in self.account_list])
+        if self.active_orders is not None:
+            account_snapshot.set_result("active_orders", dict(self.active_orders, items=[dict(item) for item in self.active_orders["items"]]))
+        return account_snapshot
+
+
+    def seed(self, bot, version: int) -> None:
+        # The tick's reads predate its own lend order writes, their events keep the state current from now on
+        if not self.subscribed or self.version != version or bot.lend_order_writes > 0:
+            return
+
+        if self.account_list is None:
+            self.account_list = bot.account_snapshot.completed_result("account_list")
+        if self.active_orders is None:
+            self.active_orders = bot.account_snapshot.completed_result("active_orders")
+
+
+def get_feed_key(config: AccountConfiguration) -> tuple:
+    # A change of any of these needs a new subscription
+    return config.base_url, config.api_key, config.api_secret, config.api_passphrase, config.currency
+
+
+def load_active_accounts() -> list:
+    return [account_config for account_config in load_configuration().accounts if account_config.active]
+
+
+# Long running alternative to the scheduled Cloud Function. Accounts are re-evaluated only when a push event
+# reports a balance or lend order change, or when the relevant part of their lending book moves.
+class LendingDaemon:
+
+    MARKET_POLL_SECONDS = 5
+    FULL_REFRESH_SECONDS = 5 * 60
+    # The configuration itself is only read again once its cache expires or a watch invalidates it
+    CONFIGURATION_POLL_SECONDS = 5
+
+    FEED_RETRY_INITIAL_SECONDS = 1
+    FEED_RETRY_MAX_SECONDS = 60
+
+    states: list
+    account_tasks: dict
+    market_tasks: dict
+
+    def __init__(self, accounts: list, subscribe_feed=subscribe_private_feed, load_accounts=None) -> None:
+        self.accounts = accounts
+        self.subscribe_feed = subscribe_feed
+        # Called again and again to pick up accounts turned off or on and edited settings, see update_accounts
+        self.load_accounts = load_accounts
+
+
+    async def run(self) -> None:
+        # Events have to be created inside the running loop
+        self.states = list()
+        self.account_tasks = dict()
+        self.market_tasks = dict()
+        self.update_accounts(self.accounts)
+
+        try:
+            if self.load_accounts is not None:
+                await self.watch_configuration()
+            else:
+                await asyncio.get_running_loop().create_future()
+        finally:
+            for state in list(self.states):
+                self.stop_account(state)
+
+
+    def update_accounts(self, accounts: list) -> None:
+        # Matched on the account doc and currency, so a rename or a rate edit keeps the state and the feed
+        configs = {(config.id, config.currency): config for config in accounts}
+
+        for state in list(self.states):
+            config = configs.get((state.config.id, state.config.currency))
+            if config is None or get_feed_key(config) != get_feed_key(state.config):
+                self.stop_account(state)
+            elif config is not state.config:
+                state.config = config
+                state.book_fingerprint = None
+                state.dirty.set()
+
+        running_keys = {(state.config.id, state.config.currency) for state in self.states}
+        for key, config in configs.items():
+            if key not in running_keys:
+                self.start_account(config)
+
+
+    def start_account(self, config: AccountConfiguration) -> None:
+        # Every task handles its own failures, one account can not stop the others
+        state = AccountState(config)
+        self.states.append(state)
+        self.account_tasks[state] = [asyncio.ensure_future(self.watch_account(state)), asyncio.ensure_future(self.trade(state))]
+
+        market_key = (config.base_url, config.currency)
+        if market_key not in self.market_tasks:
+            self.market_tasks[market_key] = asyncio.ensure_future(self.watch_market(*market_key))
+
+
+    def stop_account(self, state: AccountState) -> None:
+        # A tick already running on the executor still completes
+        self.states.remove(state)
+        for task in self.account_tasks.pop(state):
+            task.cancel()
+
+        market_key = (state.config.base_url, state.config.currency)
+        if len(self.get_market_states(*market_key)) == 0:
+            self.market_tasks.pop(market_key).cancel()
+
+
+    def get_market_states(self, base_url: str, currency: str) -> list:
+        return [state for state in self.states if (state.config.base_url, state.config.currency) == (base_url, currency)]
+
+
+    async def watch_configuration(self) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await asyncio.sleep(self.CONFIGURATION_POLL_SECONDS)
+            try:
+                accounts = await loop.run_in_executor(None, self.load_accounts)
+                self.update_accounts(accounts)
+            except Exception as ex:
+                print(f"[Exception] watch_configuration(): [{repr(ex)}]")
+
+
+    def on_message(self, state: AccountState, message: dict) -> None:
+        topic = message.get("topic", "")
+        data = message.get("data") or dict()
+
+        if topic == "/account/balance":
+            if state.apply_balance(data):
+                state.dirty.set()
+        elif topic.startswith("/margin/loan:"):
+            state.apply_loan(message.get("subject"), data)
+            state.dirty.set()
+
+
+    async def watch_account(self, state: AccountState) -> None:
+        loop = asyncio.get_running_loop()
+        delay = self.FEED_RETRY_INITIAL_SECONDS
+
+        def on_subscribed() -> None:
+            # Reads taken before the subscription may have missed events
+            state.subscribed = True
+            state.invalidate()
+
+        while True:
+            subscribed_at = loop.time()
+            try:
+                await self.subscribe_feed(state.config, lambda message: self.on_message(state, message), on_subscribed)
+            except Exception as ex:
+                print(f"[{state.config.name}] [Exception] subscribe_feed(): [{repr(ex)}]")
+
+            # Nothing keeps the state current until the next subscription
+            state.subscribed = False
+            state.invalidate()
+            state.dirty.set()
+
+            if loop.time() - subscribed_at > self.FEED_RETRY_MAX_SECONDS:
+                delay = self.FEED_RETRY_INITIAL_SECONDS
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.FEED_RETRY_MAX_SECONDS)
+
+
+    async def watch_market(self, base_url: str, currency: str) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                # Accounts come and go with the configuration
+                states = self.get_market_states(base_url, currency)
+                config = states[0].config
+                _, margin_client = clients.get_clients(config.base_url, config.api_key, config.api_secret, config.api_passphrase)
+
+                fetch = lambda: scheduler.submit(base_url, config.api_key, "get_lending_market", margin_client.get_lending_market, currency)
+                lending_market = await loop.run_in_executor(None, market_cache.get_lending_market, base_url, currency, fetch)
+
+                for state in states:
+                    book_fingerprint = calculate_book_fingerprint(lending_market, state.config)
+                    if book_fingerprint != state.book_fingerprint:
+                        state.book_fingerprint = book_fingerprint
+                        state.dirty.set()
+            except Exception as ex:
+                print(f"[Exception] watch_market({currency}): [{repr(ex)}]")
+
+            await asyncio.sleep(self.MARKET_POLL_SECONDS)
+
+
+    async def trade(self, state: AccountState) -> None:
+        loop = asyncio.get_running_loop()
+
+        while True:
+            try:
+                await asyncio.wait_for(state.dirty.wait(), timeout=self.FULL_REFRESH_SECONDS)
+            except asyncio.TimeoutError:
+                # Read everything from KuCoin again now and then, in case an event got lost
+                state.invalidate()
+
+            state.dirty.clear()
+
+            version = state.version
+            try:
+                bot = await loop.run_in_executor(None, self.execute, state.config, state.create_snapshot())
+                state.seed(bot, version)
+            except Exception as ex:
+                print(f"[{state.config.name}] [Exception] execute(): [{repr(ex)}]")
+
+
+    def execute(self, config: AccountConfiguration, account_snapshot: TickSnapshot) -> BaseBot:
+        bot = create_bot(config, account_snapshot)
+        bot.execute({"should_execute": True})
+        bot.record_tick()
+        return bot
+
+
+def main() -> None:
+    # Fail now rather than on every subscription
+    check_sdk_version()
+
+    config = load_configuration()
+    recorder.configure(config.recorder_path)
+
+    daemon = LendingDaemon(load_active_accounts(), load_accounts=load_active_accounts)
+    asyncio.run(daemon.run())
+
+
+if __name__ == "__main__":
+    main()
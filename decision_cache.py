@@ -0,0 +1,66 @@
+from decimal import Decimal
+from threading import Lock
+from time import monotonic
+
+
+class CachedDecision:
+
+    fingerprint: tuple
+    min_daily_interest_rate: Decimal
+    decision: dict
+    log: list
+    stored_at: float
+
+    def __init__(self, fingerprint: tuple, min_daily_interest_rate: Decimal, decision: dict, log: list) -> None:
+        self.fingerprint = fingerprint
+        self.min_daily_interest_rate = min_daily_interest_rate
+        self.decision = decision
+        self.log = log
+        self.stored_at = monotonic()
+
+
+# Last reusable decision per account, kept across warm invocations. A bot whose decision inputs still match the
+# stored fingerprint returns the stored status instead of evaluating the tick again. The status lines that change
+# with time alone, like accrued interest and maturities, are not stored. Entries expire so that the reported balances
+# and interest are refreshed now and then even when nothing changes.
+class DecisionCache:
+
+    MAX_AGE_SECONDS = 5 * 60
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.entries = dict()
+
+
+    def get(self, key: tuple) -> CachedDecision:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and monotonic() - entry.stored_at > self.MAX_AGE_SECONDS:
+                del self.entries[key]
+                entry = None
+            return entry
+
+
+    def put(self, key: tuple, entry: CachedDecision) -> None:
+        with self.lock:
+            self.entries[key] = entry
+
+
+    def discard(self, key: tuple) -> None:
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+_cache = DecisionCache()
+
+
+def get_decision(key: tuple) -> CachedDecision:
+    return _cache.get(key)
+
+
+def put_decision(key: tuple, entry: CachedDecision) -> None:
+    _cache.put(key, entry)
+
+
+def discard_decision(key: tuple) -> None:
+    _cache.discard(key)
@@ -1,9 +1,9 @@
 source gcloud_env.sh
 gcloud functions deploy kucoin-lendingbot \
 --region ${GCLOUD_FUNCTIONS_REGION} \
---runtime python38 \
+--runtime python39 \
 --entry-point http_request \
 --trigger-http --allow-unauthenticated \
---max-instances 1 \
+--max-instances ${GCLOUD_FUNCTIONS_MAX_INSTANCES:-1} \
 --project ${GCLOUD_FUNCTIONS_PROJECT} \
 --service-account ${GCLOUD_FUNCTIONS_SERVICE_ACCOUNT} \
@@ -1,3 +1,5 @@
 export GCLOUD_FUNCTIONS_REGION=
 export GCLOUD_FUNCTIONS_PROJECT=
 export GCLOUD_FUNCTIONS_SERVICE_ACCOUNT=
+# At least shards + 1 when the accounts are sharded
+export GCLOUD_FUNCTIONS_MAX_INSTANCES=1
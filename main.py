@@ -1,20 +1,55 @@
 import json
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
+from math import ceil
 from random import shuffle
-
-from flask import request
-from flask.wrappers import Response
-from google.cloud import firestore
-from pytz import timezone
-
-from bots.step import StepBot
-from configuration import Configuration
-
-
-def http_request(request: request):
-
-    db = firestore.Client()
-    config = get_configuration(db)
+from threading import Thread
+from time import monotonic, perf_counter
+from uuid import uuid4
+from zoneinfo import ZoneInfo
+
+from bots.factory import create_bot
+from bots.snapshot import TickSnapshot
+import clients
+import configuration
+import portfolio
+import recorder
+import sharding
+import timing
+from scheduler import scheduler
+from configuration import AccountConfiguration, load_configuration
+
+
+def prewarm() -> None:
+    # Firestore and the KuCoin SDK are imported lazily. A cold instance starts loading them right away in the
+    # background, so the first request only waits for whatever is still left.
+    try:
+        import google.cloud.firestore
+        import kucoin.client
+        clients.install()
+    except Exception as ex:
+        print(f"[Exception] prewarm(): [{repr(ex)}]")
+
+
+prewarm_thread = Thread(target=prewarm, name="prewarm", daemon=True)
+prewarm_thread.start()
+
+
+def http_request(request):
+    from flask.wrappers import Response
+
+    if request.args.get("metrics") == "1":
+        return Response(timing.metrics.to_prometheus() + scheduler.to_prometheus(), mimetype="text/plain")
+
+    config_load_start = perf_counter()
+    config = load_configuration()
+    config_load_seconds = perf_counter() - config_load_start
+    timing.metrics.observe("load_configuration", config_load_seconds)
+
+    if request.args.get("portfolio") == "1":
+        active_accounts = [account_config for account_config in config.accounts if account_config.active]
+        report = portfolio.build_report(active_accounts, config.max_concurrent_accounts)
+        return Response(json.dumps(report, separators=(",", ":")), mimetype="application/json")
 
     json_params = request.get_json(silent=True)
 
@@ -27,18 +62,40 @@ def http_request(request: request):
 
     response = dict()
     if bot_params.get("get_lending_status"):
-        response["timestamp"] = datetime.now(timezone("Asia/Bangkok")).strftime("%H:%M:%S%z")
+        response["timestamp"] = datetime.now(ZoneInfo("Asia/Bangkok")).strftime("%H:%M:%S%z")
         response["accounts"] = dict()
-
-    shuffle(config.accounts)
-    for account_config in config.accounts:
-        if not account_config.active:
-            continue
-
-        bot = StepBot(account_config)
-        bot_response = bot.execute(bot_params)
+        response["timings"] = { "load_configuration_ms": round(config_load_seconds * 1000, 3) }
+
+    try:
+        shard, shards = sharding.parse_shard_args(request.args, config.shards)
+    except ValueError as ex:
+        return Response(str(ex), status=400, mimetype="text/plain")
+
+    if shard is None and shards > 1:
+        # Coordinator: every shard runs as its own invocation, this one only merges the statuses they return
+        shard_args = {"execute": "1"} if bot_params["should_execute"] else dict()
+        shard_headers = {"Authorization": request.headers["Authorization"]} if "Authorization" in request.headers else dict()
+        bot_responses, shard_statuses = sharding.fan_out(config.shard_url, shards, shard_args, json_params, shard_headers, config.shard_timeout_seconds)
+        if bot_params.get("get_lending_status"):
+            response["shards"] = shard_statuses
+    else:
+        recorder.configure(config.recorder_path)
+
+        active_accounts = [account_config for account_config in config.accounts if account_config.active]
+        if shard is not None:
+            active_accounts = sharding.select_shard(active_accounts, shard, shards)
+
+        # Runs may overlap, with each other or with a timed out run that is still going, so every one takes leases
+        lease_owner = uuid4().hex
+        bot_responses = run_accounts(active_accounts, bot_params, config.max_concurrent_accounts, config.account_deadline_seconds, lease_owner)
+
+        recorder.flush()
+
+    # Accounts are executed in random order, report them in a stable one
+    for account_name in sorted(bot_responses.keys()):
+        bot_response = bot_responses[account_name]
         if bot_response is not None:
-            response["accounts"][account_config.name] = { "log": bot_response }
+            response["accounts"][account_name] = bot_response
 
     if len(response) == 0:
         return "OK"
@@ -46,7 +103,94 @@ def http_request(request: request):
     return Response(json.dumps(response), mimetype="application/json")
 
 
-def get_configuration(db) -> Configuration:
-    config = Configuration(db)
-
-    return config
+def run_accounts(accounts: list, bot_params: dict, max_concurrent_accounts: int, account_deadline_seconds: float, lease_owner: str = None) -> dict:
+    if len(accounts) == 0:
+        return dict()
+
+    # The currencies of a multi-currency account run one after another on the same account reads
+    account_groups = dict()
+    for account_config in accounts:
+        account_groups.setdefault(account_config.id, list()).append(account_config)
+    account_groups = list(account_groups.values())
+    shuffle(account_groups)
+
+    results = dict()
+    executor = ThreadPoolExecutor(max_workers=max_concurrent_accounts)
+    futures = {executor.submit(run_account_group, account_group, bot_params, account_deadline_seconds, lease_owner): account_group for account_group in account_groups}
+
+    # Each slot runs its accounts one after another, so the slowest slot is bounded by the per-account deadline
+    # times the number of accounts it may get. The bot itself also stops trading once its own deadline passes.
+    timeout = account_deadline_seconds * ceil(len(account_groups) / max_concurrent_accounts)
+    done, not_done = wait(futures, timeout=timeout)
+
+    for future in done:
+        results.update(future.result())
+
+    for future in not_done:
+        future.cancel()
+        for account_config in futures[future]:
+            message = f"[Timeout] Account did not finish within {account_deadline_seconds} seconds"
+            print(f"[{account_config.name}] {message}")
+            results[account_config.name] = { "log": [message] } if bot_params.get("get_lending_status") else None
+
+    executor.shutdown(wait=False)
+
+    return results
+
+
+def run_account_group(account_group: list, bot_params: dict, account_deadline_seconds: float, lease_owner: str = None) -> dict:
+    deadline = monotonic() + account_deadline_seconds
+    account_snapshot = TickSnapshot()
+    account_id = account_group[0].id
+
+    results = dict()
+
+    # Runs hold a lease on the account while they trade it, it expires a grace period after the deadline
+    if lease_owner is not None:
+        try:
+            leased = sharding.acquire_lease(configuration.get_client(), account_id, lease_owner, account_deadline_seconds + sharding.LEASE_GRACE_SECONDS)
+            message = "[Lease] Account is being run by another instance"
+        except Exception as ex:
+            leased = False
+            message = f"[Exception] acquire_lease(): [{repr(ex)}]"
+
+        if not leased:
+            for account_config in account_group:
+                print(f"[{account_config.name}] {message}")
+                results[account_config.name] = { "log": [message] } if bot_params.get("get_lending_status") else None
+            return results
+
+    try:
+        for account_config in account_group:
+            try:
+                results[account_config.name] = run_account(account_config, bot_params, deadline, account_snapshot)
+            except Exception as ex:
+                message = f"[Exception] execute(): [{repr(ex)}]"
+                print(f"[{account_config.name}] {message}")
+                results[account_config.name] = { "log": [message] } if bot_params.get("get_lending_status") else None
+    finally:
+        if lease_owner is not None:
+            try:
+                sharding.release_lease(configuration.get_client(), account_id, lease_owner)
+            except Exception as ex:
+                print(f"[{account_id}] [Exception] release_lease(): [{repr(ex)}]")
+
+    return results
+
+
+def run_account(account_config: AccountConfiguration, bot_params: dict, deadline: float, account_snapshot: TickSnapshot = None) -> dict:
+    bot = create_bot(account_config, account_snapshot)
+    bot.deadline = deadline
+
+    with bot.timings.measure("execute"):
+        bot_log = bot.execute(bot_params)
+
+    bot.record_tick()
+
+    if bot_log is None:
+        return None
+
+    return {
+        "log": bot_log,
+        "timings": bot.timings.to_list(),
+    }
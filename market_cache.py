@@ -0,0 +1,43 @@
+from concurrent.futures import Future
+from threading import Lock
+from time import monotonic
+
+
+# Lending books shared by every bot lending the same currency. Entries outlive the invocation for a few
+# seconds, so warm instances reuse them too. Callers must treat the returned book as read-only.
+class MarketDataCache:
+
+    TTL_SECONDS = 5
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.entries = dict()
+
+
+    def get(self, base_url: str, currency: str, fetch) -> list:
+        key = (base_url, currency)
+        is_owner = False
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or monotonic() - entry[0] > self.TTL_SECONDS or (entry[1].done() and entry[1].exception() is not None):
+                # Only one bot fetches, the others wait for its result
+                entry = (monotonic(), Future())
+                self.entries[key] = entry
+                is_owner = True
+
+        future = entry[1]
+        if is_owner:
+            try:
+                future.set_result(fetch())
+            except Exception as ex:
+                future.set_exception(ex)
+
+        return future.result()
+
+
+_cache = MarketDataCache()
+
+
+def get_lending_market(base_url: str, currency: str, fetch) -> list:
+    return _cache.get(base_url, currency, fetch)
@@ -0,0 +1,58 @@
+from bisect import bisect_right
+from decimal import Decimal
+
+import utils
+
+
+# The sorted (daily interest rate, term) tiers of a bot configuration compiled for bisect, used by every bot
+class TermPolicy:
+
+    term_rates: list
+    allowed_terms: list
+
+    def __init__(self, term_daily_interest_rate_tiers: tuple) -> None:
+        # allowed_terms[i] are the terms allowed for a rate reaching the first i tier rates, shortest first
+        self.term_rates = [rate for rate, _ in term_daily_interest_rate_tiers]
+        self.allowed_terms = [(7,)]
+        for _, term in term_daily_interest_rate_tiers:
+            self.allowed_terms.append(tuple(sorted(set(self.allowed_terms[-1] + (term,)))))
+
+
+    def get_allowed_terms(self, daily_interest_rate: Decimal) -> tuple:
+        return self.allowed_terms[bisect_right(self.term_rates, daily_interest_rate)]
+
+
+# StepBotConfiguration compiled into sorted tier tables, built once per loaded configuration. Every decision the
+# StepBot takes from its settings is then a bisect or a multiplication and a quantize.
+class StepBotPolicy(TermPolicy):
+
+    min_rate_utilizations: list
+    min_rates: list
+
+    min_lending_size_ratio: Decimal
+    max_lending_size_ratio: Decimal
+    currency_minimum_lending_size: Decimal
+    lending_quantum: Decimal
+
+    def __init__(self, step_bot, currency_minimum_lending_size: Decimal, lending_decimal_places: int) -> None:
+        super().__init__(step_bot.term_daily_interest_rate_tiers)
+
+        # min_rates[i] applies once the utilization reaches min_rate_utilizations[i - 1], the first one below all tiers
+        self.min_rate_utilizations = [utilization for utilization, _ in step_bot.min_daily_interest_rate_tiers]
+        self.min_rates = [step_bot.min_daily_interest_rate] + [rate for _, rate in step_bot.min_daily_interest_rate_tiers]
+
+        self.min_lending_size_ratio = step_bot.min_lending_size_ratio
+        self.max_lending_size_ratio = step_bot.max_lending_size_ratio
+        self.currency_minimum_lending_size = utils.round_down(currency_minimum_lending_size, lending_decimal_places)
+        self.lending_quantum = utils.get_quantum(lending_decimal_places)
+
+
+    def get_minimum_daily_interest_rate(self, balance_utilization_rate: Decimal) -> Decimal:
+        return self.min_rates[bisect_right(self.min_rate_utilizations, balance_utilization_rate)]
+
+
+    def get_lending_size_limits(self, total_balance: Decimal) -> tuple:
+        # Never below the currency's minimum lending size, both rounded down to the lending step
+        minimum_size = max(utils.round_down_to_quantum(total_balance * self.min_lending_size_ratio, self.lending_quantum), self.currency_minimum_lending_size)
+        maximum_size = max(utils.round_down_to_quantum(total_balance * self.max_lending_size_ratio, self.lending_quantum), self.currency_minimum_lending_size)
+        return minimum_size, maximum_size
@@ -0,0 +1,167 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import unsettled_store
+from bots.factory import create_bot
+from bots.records import from_scaled
+from bots.snapshot import TickSnapshot
+from configuration import AccountConfiguration
+
+
+# Upper bounds in hours of the maturity buckets, the last bucket holds every loan maturing later
+MATURITY_BUCKET_HOURS = (1, 6, 24, 72, 7 * 24, 14 * 24)
+
+MILLISECONDS_PER_HOUR = 60 * 60 * 1000
+
+RATE_DECIMAL_PLACES = 5
+AMOUNT_DECIMAL_PLACES = 8
+
+
+def collect_account(account_config: AccountConfiguration, account_snapshot: TickSnapshot) -> dict:
+    # Brings the local unsettled order store up to date, the loans themselves are read from there
+    bot = create_bot(account_config, account_snapshot)
+    bot.prefetch_account()
+    unsettled_store.get_store().sync(bot.unsettled_store_key, bot, account_config.currency)
+
+    account = bot.get_main_account()
+    pending_size = sum(order.pending_size for order in bot.get_my_active_open_orders())
+
+    return {
+        "StoreKey": bot.unsettled_store_key,
+        "Balance": float(account["balance"]),
+        "Available": float(account["available"]),
+        "Pending": float(from_scaled(pending_size, bot.size_decimal_places)),
+    }
+
+
+def collect_account_group(account_group: list) -> list:
+    # The currencies of a multi-currency account share the account reads, like in main.run_account_group
+    account_snapshot = TickSnapshot()
+
+    results = list()
+    for account_config in account_group:
+        try:
+            results.append((account_config, collect_account(account_config, account_snapshot), None))
+        except Exception as ex:
+            print(f"[{account_config.name}] [Exception] collect_account(): [{repr(ex)}]")
+            results.append((account_config, None, repr(ex)))
+
+    return results
+
+
+def collect_accounts(accounts: list, max_workers: int) -> tuple:
+    account_groups = dict()
+    for account_config in accounts:
+        account_groups.setdefault(account_config.id, list()).append(account_config)
+
+    collected = list()
+    errors = dict()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for results in executor.map(collect_account_group, account_groups.values()):
+            for account_config, account, error in results:
+                if error is None:
+                    collected.append((account_config, account))
+                else:
+                    errors[account_config.name] = error
+
+    return collected, errors
+
+
+def build_report(accounts: list, max_workers: int, now: int = None) -> dict:
+    import numpy
+
+    if now is None:
+        now = int(time() * 1000)
+
+    collected, errors = collect_accounts(accounts, max_workers)
+
+    store = unsettled_store.get_store()
+    order_blocks = [numpy.array(store.get_orders(account["StoreKey"], account_config.currency), dtype=numpy.int64).reshape(-1, 4) for account_config, account in collected]
+    number_of_accounts = len(collected)
+    number_of_buckets = len(MATURITY_BUCKET_HOURS) + 1
+
+    # Every loan of every account in one set of columns, tagged with the index of its account
+    if number_of_accounts > 0:
+        orders = numpy.concatenate(order_blocks)
+        account_index = numpy.repeat(numpy.arange(number_of_accounts), [len(block) for block in order_blocks])
+    else:
+        orders = numpy.zeros((0, 4), dtype=numpy.int64)
+        account_index = numpy.zeros(0, dtype=numpy.int64)
+
+    remaining_size = orders[:, 0] / store.SIZE_SCALE
+    daily_interest_rate = orders[:, 1] / store.RATE_SCALE
+    accrued_interest = orders[:, 2] / store.SIZE_SCALE
+    hours_to_maturity = (orders[:, 3] - now) / MILLISECONDS_PER_HOUR
+    maturity_bucket = numpy.searchsorted(numpy.array(MATURITY_BUCKET_HOURS, dtype=numpy.float64), hours_to_maturity, side="right")
+
+    loans = numpy.bincount(account_index, minlength=number_of_accounts)
+    lent_size = numpy.bincount(account_index, weights=remaining_size, minlength=number_of_accounts)
+    weighted_daily_interest_rate = numpy.bincount(account_index, weights=remaining_size * daily_interest_rate, minlength=number_of_accounts)
+    total_accrued_interest = numpy.bincount(account_index, weights=accrued_interest, minlength=number_of_accounts)
+    maturity = numpy.bincount(account_index * number_of_buckets + maturity_bucket, weights=remaining_size, minlength=number_of_accounts * number_of_buckets).reshape(number_of_accounts, number_of_buckets)
+
+    # Same balance definitions as BaseBot.get_account_balance and the utilization of StepBot
+    reserved_balance = numpy.array([float(account_config.reserved_balance) for account_config, _ in collected], dtype=numpy.float64)
+    fee_ratio = numpy.array([float(100 - account_config.lending_fee_rate) / 100 for account_config, _ in collected], dtype=numpy.float64)
+    total_balance = numpy.array([account["Balance"] for _, account in collected], dtype=numpy.float64) + lent_size - reserved_balance
+    available_balance = numpy.array([account["Available"] for _, account in collected], dtype=numpy.float64) - reserved_balance
+    pending_balance = numpy.array([account["Pending"] for _, account in collected], dtype=numpy.float64)
+
+    expected_daily_interest = weighted_daily_interest_rate * fee_ratio
+    unrealized_accrued_interest = total_accrued_interest * fee_ratio
+
+    currencies, currency_index = numpy.unique([account_config.currency for account_config, _ in collected], return_inverse=True)
+    number_of_currencies = len(currencies)
+
+    def sum_by_currency(values):
+        return numpy.bincount(currency_index, weights=values, minlength=number_of_currencies)
+
+    currency_maturity = numpy.zeros((number_of_currencies, number_of_buckets))
+    numpy.add.at(currency_maturity, currency_index, maturity)
+
+    report = {
+        "timestamp": now,
+        "maturity_bucket_hours": list(MATURITY_BUCKET_HOURS),
+        "accounts": create_rows([account_config.name for account_config, _ in collected], [account_config.currency for account_config, _ in collected], loans, total_balance, available_balance, pending_balance, lent_size, weighted_daily_interest_rate, expected_daily_interest, unrealized_accrued_interest, maturity),
+        "currencies": create_rows(list(currencies), list(currencies), numpy.bincount(currency_index, weights=loans, minlength=number_of_currencies), sum_by_currency(total_balance), sum_by_currency(available_balance), sum_by_currency(pending_balance), sum_by_currency(lent_size), sum_by_currency(weighted_daily_interest_rate), sum_by_currency(expected_daily_interest), sum_by_currency(unrealized_accrued_interest), currency_maturity),
+    }
+
+    if len(errors) > 0:
+        report["errors"] = errors
+
+    return report
+
+
+def create_rows(names: list, currencies: list, loans, total_balance, available_balance, pending_balance, lent_size, weighted_daily_interest_rate, expected_daily_interest, accrued_interest, maturity) -> dict:
+    import numpy
+
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        utilization_rate = numpy.where(total_balance > 0, (total_balance - available_balance - pending_balance) / total_balance * 100, 0)
+        average_daily_interest_rate = numpy.where(lent_size > 0, weighted_daily_interest_rate / lent_size * 100, 0)
+        effective_daily_interest_rate = numpy.where(total_balance > 0, expected_daily_interest / total_balance * 100, 0)
+
+    # Plain lists convert to JSON much faster than the scalars of a NumPy array
+    columns = {
+        "loans": loans.astype(numpy.int64).tolist(),
+        "balance": numpy.round(total_balance, AMOUNT_DECIMAL_PLACES).tolist(),
+        "available": numpy.round(available_balance, AMOUNT_DECIMAL_PLACES).tolist(),
+        "pending": numpy.round(pending_balance, AMOUNT_DECIMAL_PLACES).tolist(),
+        "lent": numpy.round(lent_size, AMOUNT_DECIMAL_PLACES).tolist(),
+        "utilization_rate": numpy.round(utilization_rate, 2).tolist(),
+        "average_daily_interest_rate": numpy.round(average_daily_interest_rate, RATE_DECIMAL_PLACES).tolist(),
+        "effective_daily_interest_rate": numpy.round(effective_daily_interest_rate, RATE_DECIMAL_PLACES).tolist(),
+        "expected_hourly_interest": numpy.round(expected_daily_interest / 24, AMOUNT_DECIMAL_PLACES).tolist(),
+        "expected_daily_interest": numpy.round(expected_daily_interest, AMOUNT_DECIMAL_PLACES).tolist(),
+        "accrued_interest": numpy.round(accrued_interest, AMOUNT_DECIMAL_PLACES).tolist(),
+        "maturity": numpy.round(maturity, AMOUNT_DECIMAL_PLACES).tolist(),
+    }
+
+    rows = dict()
+    for index, name in enumerate(names):
+        row = {"currency": currencies[index]}
+        for column, values in columns.items():
+            row[column] = values[index]
+        rows[str(name)] = row
+
+    return rows
@@ -0,0 +1,177 @@
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from datetime import datetime, timezone
+from decimal import Decimal
+from queue import Queue
+from threading import Lock, Thread
+
+
+# Frame layout: MAGIC, payload length and the zlib compressed payload. The payload starts with a length
+# prefixed JSON header that lists the column arrays following it, all little endian int64.
+MAGIC = b"KLB1"
+FRAME_HEADER = struct.Struct("<4sI")
+HEADER_LENGTH = struct.Struct("<I")
+
+# Rates are stored as KuCoin's dailyIntRate fraction, sizes in currency units, both scaled to integers
+SCALE = 10 ** 8
+
+ACTION_KEEP = 1
+ACTION_CANCEL = 2
+ACTION_CREATE = 4
+
+TICK_COLUMNS = ("timestamp", "account", "currency", "book_offset", "book_count", "order_offset", "order_count", "action", "rate", "size", "term")
+BOOK_COLUMNS = ("rate", "size", "term")
+ORDER_COLUMNS = ("rate", "size", "filled_size")
+
+
+def to_scaled(value) -> int:
+    return int(Decimal(value) * SCALE)
+
+
+# Batches recorded ticks on a background thread and appends them as compressed columnar frames
+class SnapshotRecorder:
+
+    BATCH_SIZE = 256
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.queue = Queue()
+        self.thread = Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+
+    def record(self, timestamp: int, account: str, currency: str, lending_market: list, active_orders: list, decision: dict) -> None:
+        # Conversion and compression happen on the writer thread, the caller only enqueues references
+        self.queue.put((timestamp, account, currency, lending_market, active_orders, decision))
+
+
+    def flush(self) -> None:
+        self.queue.put(None)
+        self.queue.join()
+
+
+    def run(self) -> None:
+        batch = list()
+        while True:
+            item = self.queue.get()
+            try:
+                if item is not None:
+                    batch.append(item)
+                if len(batch) > 0 and (item is None or len(batch) >= self.BATCH_SIZE):
+                    self.write(batch)
+                    batch = list()
+            except Exception as ex:
+                print(f"[Exception] SnapshotRecorder.write(): [{repr(ex)}]")
+                batch = list()
+            finally:
+                self.queue.task_done()
+
+
+    def write(self, batch: list) -> None:
+        accounts = list()
+        currencies = list()
+        ticks = {column: array("q") for column in TICK_COLUMNS}
+        book = {column: array("q") for column in BOOK_COLUMNS}
+        orders = {column: array("q") for column in ORDER_COLUMNS}
+
+        for timestamp, account, currency, lending_market, active_orders, decision in batch:
+            if account not in accounts:
+                accounts.append(account)
+            if currency not in currencies:
+                currencies.append(currency)
+
+            ticks["timestamp"].append(timestamp)
+            ticks["account"].append(accounts.index(account))
+            ticks["currency"].append(currencies.index(currency))
+
+            ticks["book_offset"].append(len(book["rate"]))
+            ticks["book_count"].append(len(lending_market))
+            for line in lending_market:
+                book["rate"].append(to_scaled(line["dailyIntRate"]))
+                book["size"].append(to_scaled(line["size"]))
+                book["term"].append(int(line.get("term", 0)))
+
+            ticks["order_offset"].append(len(orders["rate"]))
+            ticks["order_count"].append(len(active_orders))
+            for order in active_orders:
+                orders["rate"].append(to_scaled(order["dailyIntRate"]))
+                orders["size"].append(to_scaled(order["size"]))
+                orders["filled_size"].append(to_scaled(order["filledSize"]))
+
+            ticks["action"].append(decision.get("Action", 0))
+            ticks["rate"].append(to_scaled(decision.get("DailyInterestRate", 0) / 100))
+            ticks["size"].append(to_scaled(decision.get("Size", 0)))
+            ticks["term"].append(decision.get("Term", 0))
+
+        header = {"accounts": accounts, "currencies": currencies, "ticks": len(batch), "book": len(book["rate"]), "orders": len(orders["rate"])}
+        header_bytes = json.dumps(header).encode("utf-8")
+
+        chunks = [HEADER_LENGTH.pack(len(header_bytes)), header_bytes]
+        for columns in (ticks, book, orders):
+            for values in columns.values():
+                if sys.byteorder != "little":
+                    values.byteswap()
+                chunks.append(values.tobytes())
+
+        payload = zlib.compress(b"".join(chunks))
+
+        os.makedirs(self.path, exist_ok=True)
+        file_name = datetime.now(timezone.utc).strftime("history-%Y%m%d.klb")
+        with open(os.path.join(self.path, file_name), "ab") as history_file:
+            history_file.write(FRAME_HEADER.pack(MAGIC, len(payload)) + payload)
+
+
+def read_history(file_path: str):
+    # Yields one dict of NumPy column arrays per recorded frame
+    import numpy
+
+    with open(file_path, "rb") as history_file:
+        while True:
+            frame_header = history_file.read(FRAME_HEADER.size)
+            if len(frame_header) < FRAME_HEADER.size:
+                return
+
+            magic, payload_length = FRAME_HEADER.unpack(frame_header)
+            if magic != MAGIC:
+                raise ValueError(f"Unexpected frame magic {magic!r} in {file_path}")
+
+            payload = zlib.decompress(history_file.read(payload_length))
+            header_length = HEADER_LENGTH.unpack_from(payload)[0]
+            header = json.loads(payload[HEADER_LENGTH.size:HEADER_LENGTH.size + header_length])
+
+            offset = HEADER_LENGTH.size + header_length
+            frame = {"accounts": header["accounts"], "currencies": header["currencies"]}
+            for name, columns, count in (("ticks", TICK_COLUMNS, header["ticks"]), ("book", BOOK_COLUMNS, header["book"]), ("orders", ORDER_COLUMNS, header["orders"])):
+                frame[name] = dict()
+                for column in columns:
+                    frame[name][column] = numpy.frombuffer(payload, dtype="<i8", count=count, offset=offset)
+                    offset += count * 8
+
+            yield frame
+
+
+_recorder = None
+_recorder_lock = Lock()
+
+
+def configure(path: str) -> None:
+    global _recorder
+    with _recorder_lock:
+        if path is None:
+            _recorder = None
+        elif _recorder is None or _recorder.path != path:
+            _recorder = SnapshotRecorder(path)
+
+
+def get_recorder() -> SnapshotRecorder:
+    return _recorder
+
+
+def flush() -> None:
+    recorder = _recorder
+    if recorder is not None:
+        recorder.flush()
@@ -0,0 +1,2 @@
+source configure_env.sh
+python daemon.py
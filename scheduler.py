@@ -0,0 +1,149 @@
+import heapq
+import itertools
+import random
+from threading import Condition
+from time import monotonic, sleep
+
+
+class TokenBucket:
+
+    def __init__(self, capacity: float, refill_per_second: float) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.tokens = capacity
+        self.updated_at = monotonic()
+
+
+    def take(self, weight: float) -> float:
+        # Returns 0 when the tokens were taken, otherwise the seconds until enough tokens are available
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+        if self.tokens >= weight:
+            self.tokens -= weight
+            return 0
+
+        return (weight - self.tokens) / self.refill_per_second
+
+
+# Every KuCoin call of every bot goes through here. Calls are throttled by a token bucket per API key (and one
+# per host for public endpoints), writes are served before reads, and rate limited calls are retried with jitter.
+class RequestScheduler:
+
+    PRIVATE_CAPACITY = 30
+    PRIVATE_REFILL_PER_SECOND = 10
+    PUBLIC_CAPACITY = 30
+    PUBLIC_REFILL_PER_SECOND = 10
+
+    PUBLIC_ENDPOINTS = {"get_lending_market"}
+    WRITE_ENDPOINTS = {"create_lend_order", "cancel_lend_order"}
+    ENDPOINT_WEIGHTS = {
+        "get_active_list": 2,
+        "get_settled_order": 2,
+    }
+
+    PRIORITY_WRITE = 0
+    PRIORITY_READ = 1
+
+    MAX_RETRIES = 3
+    RETRY_BASE_SECONDS = 0.5
+
+    def __init__(self) -> None:
+        self.condition = Condition()
+        self.buckets = dict()
+        self.queues = dict()
+        self.sequence = itertools.count()
+
+        self.max_queue_depths = dict()
+        self.throttled_count = 0
+        self.retried_count = 0
+
+
+    def submit(self, base_url: str, api_key: str, name: str, fn, *args, deadline: float = None, **kwargs):
+        # deadline is a monotonic() time after which the call is no longer sent, checked right before every attempt
+        # since waiting for a token or a retry may take long
+        if name in self.PUBLIC_ENDPOINTS:
+            bucket_key = f"public:{base_url}"
+        else:
+            bucket_key = api_key
+
+        attempt = 0
+        while True:
+            self.acquire(bucket_key, name)
+            if deadline is not None and monotonic() > deadline:
+                raise TimeoutError(f"Deadline exceeded before {name}")
+            try:
+                return fn(*args, **kwargs)
+            except Exception as ex:
+                if not self.is_rate_limited(ex) or attempt >= self.MAX_RETRIES:
+                    raise
+
+            with self.condition:
+                self.retried_count += 1
+            sleep(self.RETRY_BASE_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+            attempt += 1
+
+
+    def is_rate_limited(self, ex: Exception) -> bool:
+        # The KuCoin SDK raises a plain Exception of "<HTTP status>-<response body>", the limit shows up either as
+        # HTTP 429 or as the 429000 error code in the body
+        message = str(ex)
+        return message.startswith("429") or '"429000"' in message
+
+
+    def acquire(self, bucket_key: str, name: str) -> None:
+        priority = self.PRIORITY_WRITE if name in self.WRITE_ENDPOINTS else self.PRIORITY_READ
+        weight = self.ENDPOINT_WEIGHTS.get(name, 1)
+
+        with self.condition:
+            bucket = self.buckets.get(bucket_key)
+            if bucket is None:
+                if bucket_key.startswith("public:"):
+                    bucket = TokenBucket(self.PUBLIC_CAPACITY, self.PUBLIC_REFILL_PER_SECOND)
+                else:
+                    bucket = TokenBucket(self.PRIVATE_CAPACITY, self.PRIVATE_REFILL_PER_SECOND)
+                self.buckets[bucket_key] = bucket
+                self.queues[bucket_key] = list()
+
+            queue = self.queues[bucket_key]
+            ticket = (priority, next(self.sequence))
+            heapq.heappush(queue, ticket)
+            self.max_queue_depths[bucket_key] = max(self.max_queue_depths.get(bucket_key, 0), len(queue))
+
+            while True:
+                if queue[0] == ticket:
+                    wait_seconds = bucket.take(weight)
+                    if wait_seconds == 0:
+                        heapq.heappop(queue)
+                        self.condition.notify_all()
+                        return
+                    self.throttled_count += 1
+                    self.condition.wait(wait_seconds)
+                else:
+                    self.condition.wait()
+
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP kucoin_lendingbot_scheduler_queue_depth Calls waiting for a token",
+            "# TYPE kucoin_lendingbot_scheduler_queue_depth gauge",
+            "# TYPE kucoin_lendingbot_scheduler_max_queue_depth gauge",
+            "# TYPE kucoin_lendingbot_scheduler_throttled_total counter",
+            "# TYPE kucoin_lendingbot_scheduler_retried_total counter",
+        ]
+
+        with self.condition:
+            # API keys are secrets, label the buckets with a short prefix only
+            for bucket_key in sorted(self.queues.keys()):
+                label = bucket_key if bucket_key.startswith("public:") else bucket_key[:6]
+                lines.append(f'kucoin_lendingbot_scheduler_queue_depth{{bucket="{label}"}} {len(self.queues[bucket_key])}')
+                lines.append(f'kucoin_lendingbot_scheduler_max_queue_depth{{bucket="{label}"}} {self.max_queue_depths.get(bucket_key, 0)}')
+
+            lines.append(f"kucoin_lendingbot_scheduler_throttled_total {self.throttled_count}")
+            lines.append(f"kucoin_lendingbot_scheduler_retried_total {self.retried_count}")
+
+        return "\n".join(lines) + "\n"
+
+
+scheduler = RequestScheduler()
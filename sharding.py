@@ -0,0 +1,117 @@
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, time
+
+
+LEASE_GRACE_SECONDS = 30
+
+
+def get_shard(account_id: str, shards: int) -> int:
+    # Jump consistent hash of the account doc id: changing the number of shards only moves the accounts that
+    # have to move, the currencies of a multi-currency account always land on the same shard
+    key = int.from_bytes(hashlib.blake2b(account_id.encode("utf-8"), digest_size=8).digest(), "big")
+    shard = -1
+    next_shard = 0
+    while next_shard < shards:
+        shard = next_shard
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        next_shard = int((shard + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return shard
+
+
+def parse_shard_args(args, configured_shards: int) -> tuple:
+    # The function is public, a request may lower the number of shards but never fan out wider than configured.
+    # Returns (shard, shards), shard is None for a coordinator or unsharded run.
+    shards = args.get("shards")
+    if shards is None or shards == "":
+        shards = configured_shards
+    else:
+        shards = parse_int_arg("shards", shards)
+        if shards < 1:
+            raise ValueError(f"shards must be at least 1, got {shards}")
+        shards = min(shards, configured_shards)
+
+    shard = args.get("shard")
+    if shard is not None:
+        shard = parse_int_arg("shard", shard)
+        if shard < 0 or shard >= shards:
+            raise ValueError(f"shard must be between 0 and {shards - 1}, got {shard}")
+
+    return shard, shards
+
+
+def parse_int_arg(name: str, value: str) -> int:
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from None
+
+
+def select_shard(accounts: list, shard: int, shards: int) -> list:
+    return [account_config for account_config in accounts if get_shard(account_config.id, shards) == shard]
+
+
+def run_transaction(db, function, *args):
+    # Imported lazily, see main.prewarm
+    from google.cloud.firestore import transactional
+    return transactional(function)(db.transaction(), *args)
+
+
+def get_lease_ref(db, account_id: str):
+    return db.collection(u"kucoin").document(u"lending").collection(u"leases").document(account_id)
+
+
+def acquire_lease(db, account_id: str, owner: str, lease_seconds: float) -> bool:
+    # Only one instance at a time may trade an account. A lease left behind by a crashed instance expires.
+    def acquire(transaction, lease_ref) -> bool:
+        now = time()
+        lease = lease_ref.get(transaction=transaction).to_dict()
+        if lease is not None and lease["owner"] != owner and lease["expires_at"] > now:
+            return False
+
+        transaction.set(lease_ref, {"owner": owner, "expires_at": now + lease_seconds})
+        return True
+
+    return run_transaction(db, acquire, get_lease_ref(db, account_id))
+
+
+def release_lease(db, account_id: str, owner: str) -> None:
+    def release(transaction, lease_ref) -> None:
+        lease = lease_ref.get(transaction=transaction).to_dict()
+        if lease is not None and lease["owner"] == owner:
+            transaction.delete(lease_ref)
+
+    run_transaction(db, release, get_lease_ref(db, account_id))
+
+
+def invoke_shard(url: str, shard: int, shards: int, args: dict, json_params: dict, headers: dict, timeout_seconds: float) -> tuple:
+    import requests
+
+    start = perf_counter()
+    try:
+        shard_response = requests.post(url, params=dict(args, shard=shard, shards=shards), json=json_params, headers=headers, timeout=timeout_seconds)
+        shard_response.raise_for_status()
+        is_json = shard_response.headers.get("Content-Type", "").startswith("application/json")
+        return shard_response.json() if is_json else None, None, perf_counter() - start
+    except Exception as ex:
+        return None, repr(ex), perf_counter() - start
+
+
+def fan_out(url: str, shards: int, args: dict, json_params: dict, headers: dict, timeout_seconds: float) -> tuple:
+    # Runs every shard as its own invocation of the worker URL and merges the account statuses they return
+    with ThreadPoolExecutor(max_workers=shards) as executor:
+        shard_results = list(executor.map(lambda shard: invoke_shard(url, shard, shards, args, json_params, headers, timeout_seconds), range(shards)))
+
+    accounts = dict()
+    shard_statuses = list()
+    for shard, (shard_response, error, seconds) in enumerate(shard_results):
+        shard_status = {"shard": shard, "ms": round(seconds * 1000, 3)}
+        if error is not None:
+            print(f"[Shard {shard}] [Exception] invoke_shard(): [{error}]")
+            shard_status["error"] = error
+        elif shard_response is not None:
+            accounts.update(shard_response.get("accounts", dict()))
+            shard_status["accounts"] = len(shard_response.get("accounts", dict()))
+        shard_statuses.append(shard_status)
+
+    return accounts, shard_statuses
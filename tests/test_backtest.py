@@ -0,0 +1,85 @@
+import json
+import random
+from decimal import Decimal
+
+import pytest
+
+import backtest
+import recorder
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+
+
+TICKS = 500
+MILLISECONDS_PER_MINUTE = 60 * 1000
+
+BACKTEST_CONFIG = {
+    "account": dict(CURRENCY_DATA, currency="USDT"),
+    "step_bot": dict(STEP_BOT_DATA, big_player_size_threshold="20000", happy_cumulative_size_threshold="5000"),
+    "initial_balance": "10000",
+    "sweep": {"happy_daily_interest_rate": ["0.05", "0.06"]},
+}
+
+
+def to_daily_interest_rate(rate: int) -> str:
+    return str(Decimal(rate).scaleb(-6).normalize())
+
+
+def create_snapshots(seed: int) -> list:
+    # A book that borrowers eat from the cheapest end while new offers come in, one tick a minute
+    random.seed(seed)
+    book = dict()
+    snapshots = list()
+    for index in range(TICKS):
+        for _ in range(random.randint(0, 5)):
+            rate = random.randint(300, 800)
+            book[rate] = book.get(rate, 0) + random.randint(100, 8000)
+
+        taken_size = random.randint(0, 6000)
+        for rate in sorted(book):
+            taken = min(book[rate], taken_size)
+            book[rate] -= taken
+            taken_size -= taken
+            if book[rate] == 0:
+                del book[rate]
+            if taken_size == 0:
+                break
+
+        # Now and then the live bot had an order of its own resting in the book
+        items = list()
+        if len(book) > 0 and random.random() < 0.5:
+            rate = random.choice(list(book))
+            size = random.randint(1, book[rate])
+            items.append({"orderId": str(index), "currency": "USDT", "dailyIntRate": to_daily_interest_rate(rate), "size": str(size), "filledSize": str(random.randint(0, size - 1))})
+
+        lending_market = [{"dailyIntRate": to_daily_interest_rate(rate), "size": str(size), "term": 7} for rate, size in sorted(book.items())]
+        snapshots.append({"timestamp": index * MILLISECONDS_PER_MINUTE, "lending_market": lending_market, "active_orders": {"totalNum": len(items), "items": items}})
+    return snapshots
+
+
+def write_history(path: str, snapshots_by_account: dict) -> None:
+    snapshot_recorder = recorder.SnapshotRecorder(path)
+    for snapshots in zip(*snapshots_by_account.values()):
+        for account, snapshot in zip(snapshots_by_account, snapshots):
+            snapshot_recorder.record(snapshot["timestamp"], account, "USDT", snapshot["lending_market"], snapshot["active_orders"]["items"], dict())
+    snapshot_recorder.flush()
+
+
+def test_history_replays_like_jsonl(tmp_path) -> None:
+    snapshots = create_snapshots(10)
+    snapshots_path = tmp_path / "snapshots.jsonl"
+    snapshots_path.write_text("".join(json.dumps(snapshot) + "\n" for snapshot in snapshots))
+
+    history_path = tmp_path / "history"
+    write_history(str(history_path), {"main": snapshots, "other": create_snapshots(11)})
+
+    expected = backtest.run_sweep(str(snapshots_path), BACKTEST_CONFIG, max_workers=1)
+    assert backtest.run_sweep(str(history_path), BACKTEST_CONFIG, max_workers=1, account="main") == expected
+    assert all(result["ticks"] == TICKS and result["created_orders"] > 0 and result["filled_size"] != "0" for result in expected)
+
+
+def test_history_of_several_accounts_needs_an_account(tmp_path) -> None:
+    write_history(str(tmp_path), {"main": create_snapshots(10), "other": create_snapshots(11)})
+
+    with pytest.raises(ValueError, match="several accounts"):
+        backtest.load_history(str(tmp_path), None, "USDT", CURRENCY_DATA["currency_precision_decimal_places"])
+    assert backtest.load_history(str(tmp_path), "missing", "USDT", CURRENCY_DATA["currency_precision_decimal_places"]) == list()
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+import daemon
+import ws_connection
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from benchmarks.kucoin_simulator import KucoinSimulator
+from configuration import AccountConfiguration
+
+
+@pytest.fixture
+def simulator():
+    simulator = KucoinSimulator().start()
+    yield simulator
+    simulator.stop()
+
+
+def create_config(base_url: str, name: str, active: bool = True, happy_daily_interest_rate: str = STEP_BOT_DATA["happy_daily_interest_rate"]) -> AccountConfiguration:
+    data = dict(CURRENCY_DATA, active=active, name=name, kill=False, base_url=base_url, api_key=f"daemon-{name}", api_secret="secret", api_passphrase="passphrase", currency="USDT")
+    return AccountConfiguration(name, data, dict(STEP_BOT_DATA, happy_daily_interest_rate=happy_daily_interest_rate))
+
+
+# Notes the configuration of every execution instead of trading
+class RecordingDaemon(daemon.LendingDaemon):
+
+    CONFIGURATION_POLL_SECONDS = 0.05
+
+    def __init__(self, accounts: list, load_accounts) -> None:
+        super().__init__(accounts, self.subscribe_feed, load_accounts)
+        self.executed_configs = list()
+        self.subscriptions = list()
+
+
+    async def subscribe_feed(self, config, on_message, on_subscribed) -> None:
+        self.subscriptions.append(config.name)
+        await asyncio.get_running_loop().create_future()
+
+
+    def execute(self, config, account_snapshot):
+        self.executed_configs.append(config)
+
+
+async def wait_until(condition) -> None:
+    for _ in range(100):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    raise AssertionError("Condition never met")
+
+
+def test_daemon_follows_configuration(simulator) -> None:
+    accounts = [create_config(simulator.base_url, "kept"), create_config(simulator.base_url, "removed")]
+    loaded_accounts = [accounts]
+
+    async def run() -> RecordingDaemon:
+        recording_daemon = RecordingDaemon(accounts, lambda: [config for config in loaded_accounts[0] if config.active])
+        daemon_task = asyncio.ensure_future(recording_daemon.run())
+        try:
+            await wait_until(lambda: {config.name for config in recording_daemon.executed_configs} == {"kept", "removed"})
+
+            # A rate edit, an account turned off and a new one
+            edited_config = create_config(simulator.base_url, "kept", happy_daily_interest_rate="0.09")
+            loaded_accounts[0] = [edited_config, create_config(simulator.base_url, "removed", active=False), create_config(simulator.base_url, "added")]
+            await wait_until(lambda: edited_config in recording_daemon.executed_configs and "added" in {config.name for config in recording_daemon.executed_configs})
+
+            assert [state.config for state in recording_daemon.states] == [edited_config, loaded_accounts[0][2]]
+            assert len(recording_daemon.account_tasks) == 2 and len(recording_daemon.market_tasks) == 1
+            # The edit keeps the feed of the account
+            assert sorted(recording_daemon.subscriptions) == ["added", "kept", "removed"]
+
+            executions = len(recording_daemon.executed_configs)
+            await asyncio.sleep(0.2)
+            assert all(config.name != "removed" for config in recording_daemon.executed_configs[executions:])
+        finally:
+            daemon_task.cancel()
+            await asyncio.wait([daemon_task])
+        return recording_daemon
+
+    recording_daemon = asyncio.run(run())
+    assert recording_daemon.states == list() and recording_daemon.market_tasks == dict()
+
+
+def test_feed_connection_needs_pinned_sdk(monkeypatch) -> None:
+    monkeypatch.setattr(ws_connection, "_checked", False)
+    monkeypatch.setattr(ws_connection.metadata, "version", lambda name: "1.0.7")
+
+    with pytest.raises(RuntimeError, match="kucoin-python 1.0.6, found 1.0.7"):
+        ws_connection.FeedConnection(object())
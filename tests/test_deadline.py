@@ -0,0 +1,75 @@
+import json
+from time import monotonic
+
+import pytest
+
+import configuration
+import main
+import sharding
+import unsettled_store
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA, BenchmarkRequest, create_firestore
+from benchmarks.kucoin_simulator import KucoinSimulator
+from bots.step import StepBot
+from configuration import AccountConfiguration
+from scheduler import RequestScheduler
+
+
+def test_write_is_not_sent_past_deadline() -> None:
+    calls = list()
+    with pytest.raises(TimeoutError, match="before create_lend_order"):
+        RequestScheduler().submit("http://127.0.0.1:1/", "deadline", "create_lend_order", calls.append, "order", deadline=monotonic() - 1)
+    assert calls == list()
+
+
+def test_retry_is_not_sent_past_deadline(monkeypatch) -> None:
+    scheduler = RequestScheduler()
+    monkeypatch.setattr(scheduler, "RETRY_BASE_SECONDS", 0.05)
+    calls = list()
+
+    def create_lend_order() -> None:
+        calls.append(monotonic())
+        raise Exception('429-{"code":"429000"}')
+
+    # The deadline passes while the scheduler sleeps before the retry
+    with pytest.raises(TimeoutError):
+        scheduler.submit("http://127.0.0.1:1/", "deadline", "create_lend_order", create_lend_order, deadline=monotonic() + 0.01)
+    assert len(calls) == 1
+
+
+def test_unsharded_runs_take_leases(tmp_path, monkeypatch) -> None:
+    simulator = KucoinSimulator(unsettled_orders=10).start()
+    db = create_firestore(simulator.base_url, 3, 2, ["USDT"])
+    # One account is still being run by another invocation
+    sharding.acquire_lease(db, "account-001", "other", 60)
+
+    leases = list()
+    acquire_lease = sharding.acquire_lease
+
+    def counting_acquire_lease(db, account_id: str, owner: str, lease_seconds: float) -> bool:
+        leases.append(account_id)
+        return acquire_lease(db, account_id, owner, lease_seconds)
+
+    monkeypatch.setattr(sharding, "acquire_lease", counting_acquire_lease)
+    monkeypatch.setattr(unsettled_store, "_store", unsettled_store.UnsettledOrderStore(str(tmp_path / "unsettled_orders.sqlite3")))
+    configuration.use_client(db)
+    try:
+        accounts = json.loads(main.http_request(BenchmarkRequest(False)).get_data())["accounts"]
+    finally:
+        configuration.use_client(None)
+        simulator.stop()
+
+    assert sorted(leases) == ["account-000", "account-001", "account-002"]
+    assert accounts["account-001"] == {"log": ["[Lease] Account is being run by another instance"]}
+    assert "timings" in accounts["account-000"] and "timings" in accounts["account-002"]
+    # Released again once the run is over
+    assert db.collection("kucoin").document("lending").collection("leases").document("account-000").get().to_dict() is None
+
+
+def test_bot_only_stops_writes_past_deadline() -> None:
+    config = AccountConfiguration("deadline", dict(CURRENCY_DATA, active=True, name="deadline", kill=False, base_url="http://127.0.0.1:1/", api_key="deadline", api_secret="secret", api_passphrase="passphrase", currency="USDT"), STEP_BOT_DATA)
+    bot = StepBot(config, user_client=object(), margin_client=object())
+    bot.deadline = monotonic() - 1
+
+    assert bot.call("get_active_order", lambda: "read") == "read"
+    with pytest.raises(TimeoutError):
+        bot.call("cancel_lend_order", lambda: "write")
@@ -0,0 +1,46 @@
+import pytest
+
+import unsettled_store
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from benchmarks.kucoin_simulator import KucoinSimulator
+from bots.snapshot import TickSnapshot
+from bots.step import StepBot
+from configuration import AccountConfiguration
+
+
+@pytest.fixture
+def simulator(tmp_path, monkeypatch):
+    monkeypatch.setattr(unsettled_store, "_store", unsettled_store.UnsettledOrderStore(str(tmp_path / "unsettled_orders.sqlite3")))
+    simulator = KucoinSimulator(unsettled_orders=20, open_orders=1).start()
+    yield simulator
+    simulator.stop()
+
+
+def run_tick(base_url: str, name: str, **currency_data) -> list:
+    data = dict(CURRENCY_DATA, active=True, name=name, kill=False, base_url=base_url, api_key=name, api_secret="secret", api_passphrase="passphrase", currency="USDT")
+    config = AccountConfiguration(name, dict(data, **currency_data), STEP_BOT_DATA)
+    bot = StepBot(config, account_snapshot=TickSnapshot())
+    return bot.execute({"get_lending_status": True})
+
+
+def test_cached_log_leaves_out_time_dependent_lines(simulator) -> None:
+    evaluated = run_tick(simulator.base_url, "decision_cache_log")
+    reused = run_tick(simulator.base_url, "decision_cache_log")
+
+    assert any(line.startswith("UnrealizedAccruedInterest=") for line in evaluated)
+    assert any(line.startswith("Maturing ") for line in evaluated)
+    assert reused[-1].startswith("Decision inputs unchanged")
+    assert not any(line.startswith(("UnrealizedAccruedInterest=", "Maturing ", "MaturingPerHour=", "Projected")) for line in reused)
+    assert [line for line in evaluated if line in reused] == reused[:-1]
+
+
+@pytest.mark.parametrize("currency_data", [
+    {"currency_minimum_lending_size": "20"},
+    {"currency_lending_decimal_places": 2},
+    {"lending_fee_rate": "5"},
+    {"reserved_balance": "100"},
+])
+def test_account_settings_invalidate_cached_decision(simulator, currency_data: dict) -> None:
+    run_tick(simulator.base_url, "decision_cache_settings")
+    assert run_tick(simulator.base_url, "decision_cache_settings")[-1].startswith("Decision inputs unchanged")
+    assert not run_tick(simulator.base_url, "decision_cache_settings", **currency_data)[-1].startswith("Decision inputs unchanged")
@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+import configuration
+import main
+import unsettled_store
+from benchmarks.end_to_end import BenchmarkRequest, create_firestore
+from benchmarks.kucoin_simulator import KucoinSimulator
+
+
+pytest.importorskip("pytest_benchmark")
+
+LATENCY_SECONDS = 0.005
+BOOK_DEPTH = 2000
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(unsettled_store, "_store", unsettled_store.UnsettledOrderStore(str(tmp_path / "unsettled_orders.sqlite3")))
+
+
+@pytest.mark.parametrize("number_of_accounts", [1, 10, 100])
+def test_tick(benchmark, number_of_accounts: int) -> None:
+    # Full http_request ticks over deep books, reading only: see benchmarks/end_to_end.py for the trading run
+    simulator = KucoinSimulator(latency_seconds=LATENCY_SECONDS, book_depth=BOOK_DEPTH, unsettled_orders=200, open_orders=1).start()
+    configuration.use_client(create_firestore(simulator.base_url, number_of_accounts, 8, ["USDT"]))
+    try:
+        response = benchmark.pedantic(main.http_request, args=(BenchmarkRequest(False),), rounds=3, warmup_rounds=1)
+    finally:
+        configuration.use_client(None)
+        simulator.stop()
+
+    accounts = json.loads(response.get_data())["accounts"]
+    assert len(accounts) == number_of_accounts
+    assert not any("[Exception]" in line for account in accounts.values() for line in account["log"])
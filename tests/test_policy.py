@@ -0,0 +1,64 @@
+import random
+from decimal import Decimal
+
+from benchmarks.end_to_end import CURRENCY_DATA
+from benchmarks.policy import CURRENCY_MINIMUM_LENDING_SIZE, LENDING_DECIMAL_PLACES, STEP_BOT_DATA, create_legacy_step_bot, legacy_decide, policy_decide
+from bots.ladder import LadderBot
+from configuration import AccountConfiguration, StepBotConfiguration
+from policy import StepBotPolicy
+
+
+CONFIGURATIONS = 50
+DECISIONS = 500
+
+
+def create_step_bot_data() -> dict:
+    # Thresholds and terms in any order, the fixed fields never required them to be sorted
+    rates = [str(Decimal(random.randint(20, 100)) / 1000) for _ in range(6)]
+    return dict(
+        STEP_BOT_DATA,
+        minimum_lending_size_ratio=str(Decimal(random.randint(0, 50)) / 100),
+        maximum_lending_size_ratio=str(Decimal(random.randint(0, 100)) / 100),
+        minimum_daily_interest_rate=rates[0],
+        **{"40p_minimum_daily_interest_rate": rates[1], "60p_minimum_daily_interest_rate": rates[2], "80p_minimum_daily_interest_rate": rates[3], "term_14_daily_interest_rate": rates[4], "term_28_daily_interest_rate": rates[5]},
+    )
+
+
+def test_policy_matches_fixed_fields() -> None:
+    random.seed(24)
+    for _ in range(CONFIGURATIONS):
+        step_bot_data = create_step_bot_data()
+        policy = StepBotPolicy(StepBotConfiguration("policy", step_bot_data), CURRENCY_MINIMUM_LENDING_SIZE, LENDING_DECIMAL_PLACES)
+        legacy_step_bot = create_legacy_step_bot(step_bot_data)
+
+        for _ in range(DECISIONS):
+            # Utilization and rate land on the thresholds now and then
+            balance_utilization_rate = random.choice((Decimal(random.randint(0, 10000)) / 100, Decimal(random.choice((0, 40, 60, 80, 100)))))
+            daily_interest_rate = random.choice((Decimal(random.randint(20, 100)) / 1000, legacy_step_bot.term_14_daily_interest_rate, legacy_step_bot.term_28_daily_interest_rate))
+            total_balance = Decimal(random.randint(0, 10 ** 8)) / 100
+            values = (balance_utilization_rate, daily_interest_rate, total_balance)
+            assert policy_decide(policy, *values) == legacy_decide(legacy_step_bot, *values), (step_bot_data, values)
+
+
+def create_ladder_bot(step_bot_data: dict) -> LadderBot:
+    data = dict(CURRENCY_DATA, active=True, name="ladder", kill=False, bot="ladder", base_url="", api_key="", api_secret="", api_passphrase="", currency="USDT")
+    ladder_bot_data = dict(step_bot_data, number_of_levels=4, ladder_depth_size="100000")
+    return LadderBot(AccountConfiguration("ladder", data, ladder_bot_data), user_client=object(), margin_client=object())
+
+
+def test_ladder_term_matches_fixed_fields() -> None:
+    random.seed(28)
+    for _ in range(CONFIGURATIONS):
+        step_bot_data = create_step_bot_data()
+        ladder_bot = create_ladder_bot(step_bot_data)
+        legacy_step_bot = create_legacy_step_bot(step_bot_data)
+
+        for _ in range(DECISIONS):
+            daily_interest_rate = random.choice((Decimal(random.randint(20, 100)) / 1000, legacy_step_bot.term_14_daily_interest_rate, legacy_step_bot.term_28_daily_interest_rate))
+            assert ladder_bot.calculate_term(daily_interest_rate) == legacy_decide(legacy_step_bot, Decimal(0), daily_interest_rate, Decimal(0))[1], (step_bot_data, daily_interest_rate)
+
+
+def test_ladder_term_tiers() -> None:
+    ladder_bot = create_ladder_bot(dict(STEP_BOT_DATA, term_daily_interest_rate_tiers={"14": "0.05", "28": "0.09", "21": "0.07"}))
+
+    assert [ladder_bot.calculate_term(Decimal(rate)) for rate in ("0.03", "0.05", "0.069", "0.07", "0.089", "0.09", "0.2")] == [7, 14, 14, 21, 21, 28, 28]
@@ -0,0 +1,63 @@
+import pytest
+
+import portfolio
+import unsettled_store
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from benchmarks.kucoin_simulator import KucoinSimulator
+from bots.factory import create_bot
+from bots.records import from_size
+from bots.snapshot import TickSnapshot
+from configuration import AccountConfiguration
+
+
+@pytest.fixture
+def simulator():
+    simulator = KucoinSimulator(unsettled_orders=120, open_orders=2).start()
+    yield simulator
+    simulator.stop()
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    store = unsettled_store.UnsettledOrderStore(str(tmp_path / "unsettled_orders.sqlite3"))
+    monkeypatch.setattr(unsettled_store, "_store", store)
+    return store
+
+
+def create_accounts(base_url: str) -> list:
+    accounts = list()
+    for index, reserved_balance in enumerate(("0", "0", "2500")):
+        data = dict(CURRENCY_DATA, active=True, name=f"portfolio{index}", kill=False, base_url=base_url, api_key=f"portfolio{index}", api_secret="secret", api_passphrase="passphrase", currency="USDT", reserved_balance=reserved_balance)
+        accounts.append(AccountConfiguration(f"portfolio{index}", data, STEP_BOT_DATA))
+    return accounts
+
+
+def test_report_matches_account_balance(simulator) -> None:
+    accounts = create_accounts(simulator.base_url)
+    report = portfolio.build_report(accounts, max_workers=4)
+
+    # The report never reads the lending book
+    assert all(path != "/api/v1/margin/market" for _, path in simulator.request_counts)
+    assert "errors" not in report
+
+    for account_config in accounts:
+        bot = create_bot(account_config, TickSnapshot())
+        account_balance = bot.get_account_balance()
+        totals = unsettled_store.get_store().sync(bot.unsettled_store_key, bot, account_config.currency)
+        pending_size = sum(order.pending_size for order in bot.get_my_active_open_orders())
+
+        row = report["accounts"][account_config.name]
+        assert row["loans"] == totals["Count"] == 120
+        assert row["balance"] == pytest.approx(float(account_balance["Balance"]))
+        assert row["available"] == pytest.approx(float(account_balance["Available"]))
+        assert row["pending"] == pytest.approx(float(from_size(pending_size, bot.size_decimal_places))) and row["pending"] > 0
+        assert row["lent"] == pytest.approx(float(totals["RemainingSize"]))
+        assert row["accrued_interest"] == pytest.approx(float(account_balance["UnrealizedAccruedInterest"]))
+        assert row["average_daily_interest_rate"] == pytest.approx(float(account_balance["AverageDailyInterestRate"]), abs=1e-5)
+        assert row["effective_daily_interest_rate"] == pytest.approx(float(account_balance["EffectiveDailyInterestRateOnTotalBalance"]), abs=1e-5)
+        assert row["expected_daily_interest"] == pytest.approx(float(account_balance["EffectiveDailyInterestRateOnTotalBalance"] * account_balance["Balance"] / 100))
+        assert sum(row["maturity"]) == pytest.approx(row["lent"])
+
+    currency_row = report["currencies"]["USDT"]
+    assert currency_row["loans"] == 3 * 120
+    assert currency_row["balance"] == pytest.approx(sum(row["balance"] for row in report["accounts"].values()))
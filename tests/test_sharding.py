@@ -0,0 +1,48 @@
+import pytest
+
+import configuration
+import main
+import sharding
+from benchmarks.end_to_end import ShardRequest, create_firestore
+from configuration import Configuration
+
+
+@pytest.mark.parametrize("args, expected", [
+    (dict(), (None, 4)),
+    ({"shards": "2"}, (None, 2)),
+    ({"shards": "8"}, (None, 4)),
+    ({"shard": "3", "shards": "4"}, (3, 4)),
+    ({"shard": "0"}, (0, 4)),
+])
+def test_parse_shard_args(args: dict, expected: tuple) -> None:
+    assert sharding.parse_shard_args(args, 4) == expected
+
+
+@pytest.mark.parametrize("args, message", [
+    ({"shards": "two"}, "shards must be an integer"),
+    ({"shards": "0"}, "shards must be at least 1"),
+    ({"shard": "x"}, "shard must be an integer"),
+    ({"shard": "4", "shards": "4"}, "shard must be between 0 and 3"),
+    ({"shard": "2", "shards": "2"}, "shard must be between 0 and 1"),
+    ({"shard": "-1"}, "shard must be between 0 and 3"),
+])
+def test_parse_shard_args_rejects(args: dict, message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        sharding.parse_shard_args(args, 4)
+
+
+def test_shards_need_shard_url() -> None:
+    with pytest.raises(ValueError, match="shard_url is required"):
+        Configuration(create_firestore("http://127.0.0.1:1/", 1, 1, ["USDT"], shards=2))
+    assert Configuration(create_firestore("http://127.0.0.1:1/", 1, 1, ["USDT"], shards=2, shard_url="http://127.0.0.1:2/")).shard_url == "http://127.0.0.1:2/"
+
+
+def test_bad_shard_args_are_a_bad_request() -> None:
+    configuration.use_client(create_firestore("http://127.0.0.1:1/", 1, 1, ["USDT"], shards=2, shard_url="http://127.0.0.1:2/"))
+    try:
+        response = main.http_request(ShardRequest({"shard": "5", "shards": "2"}, {"get_lending_status": 1}, dict()))
+    finally:
+        configuration.use_client(None)
+
+    assert response.status_code == 400
+    assert response.get_data(as_text=True) == "shard must be between 0 and 1, got 5"
@@ -0,0 +1,161 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+import utils
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from bots.snapshot import TickSnapshot
+from bots.step import StepBot
+from configuration import AccountConfiguration
+
+
+CASES = 20000
+
+
+# The StepBot decision before the book was walked once on scaled integers, on the raw KuCoin responses
+def legacy_get_my_active_open_orders(active_orders: list) -> list:
+    return [{"DailyInterestRate": utils.round_down(Decimal(order["dailyIntRate"]) * 100, 3), "Size": Decimal(order["size"]), "FilledSize": Decimal(order["filledSize"])} for order in active_orders]
+
+
+def legacy_get_market_data(step_bot, lending_market: list, my_active_open_orders: list, min_daily_interest_rate: Decimal) -> dict:
+    my_orders_by_rate = {order["DailyInterestRate"]: order for order in my_active_open_orders}
+
+    big_player_rate = Decimal(0)
+    size = Decimal(0)
+    offer_list = list()
+    for line in lending_market:
+        line_rate = Decimal(line["dailyIntRate"]) * 100
+        if line_rate < min_daily_interest_rate:
+            continue
+
+        line_rate = utils.round_down(line_rate, 3)
+        line_size = Decimal(line["size"])
+        if line_rate > big_player_rate:
+            offer_list.append({"Rate": line_rate, "Size": line_size})
+            big_player_rate = line_rate
+            size = line_size
+            my_open_order = my_orders_by_rate.get(line_rate)
+            if my_open_order is not None:
+                size -= my_open_order["Size"] - my_open_order["FilledSize"]
+        else:
+            size += line_size
+
+        if size > step_bot.big_player_size_threshold:
+            break
+
+    if big_player_rate == 0:
+        raise Exception("BigPlayerRate is zero. Something seems to be wrong.")
+
+    return {
+        "LowestRate": utils.round_down(Decimal(lending_market[0]["dailyIntRate"]) * 100, 3),
+        "BigPlayerRate": big_player_rate,
+        "OfferList": offer_list,
+    }
+
+
+def legacy_calculate_my_optimal_daily_interest_rate(step_bot, market_data: dict, my_active_open_orders: list, min_daily_interest_rate: Decimal) -> Decimal:
+    my_lowest_rate = None
+    if len(my_active_open_orders) >= 1:
+        my_lowest_rate = my_active_open_orders[0]["DailyInterestRate"]
+
+    big_player_rate = market_data["BigPlayerRate"]
+    cumulative_size = Decimal(0)
+    line_rate = None
+    for offer in market_data["OfferList"]:
+        line_rate = offer["Rate"]
+        if line_rate < min_daily_interest_rate:
+            continue
+
+        if line_rate == big_player_rate and line_rate == min_daily_interest_rate:
+            return line_rate
+
+        if line_rate >= big_player_rate:
+            if line_rate == my_lowest_rate:
+                return line_rate
+            return big_player_rate - Decimal("0.001")
+
+        if line_rate >= step_bot.happy_daily_interest_rate:
+            cumulative_size += offer["Size"]
+            if cumulative_size > step_bot.happy_cumulative_size_threshold:
+                if line_rate == my_lowest_rate:
+                    return line_rate
+                return line_rate - Decimal("0.001")
+
+    if line_rate is None:
+        return Decimal(2)
+    if line_rate < min_daily_interest_rate:
+        return min_daily_interest_rate
+    return line_rate
+
+
+def create_book(depth: int) -> list:
+    # Sorted like the KuCoin book, several lines per rate and some rates finer than the 3 decimal places of a percent
+    rates = sorted(random.randint(20, 100) * 10 ** 5 + random.choice((0, 0, 0, random.randint(1, 99999))) for _ in range(depth))
+    return [{"dailyIntRate": str(Decimal(rate).scaleb(-10).normalize()), "size": create_line_size()} for rate in rates]
+
+
+def create_line_size() -> str:
+    # Mostly small offers with now and then a big lender, some of them finer than the lending step
+    size = random.randint(10 ** 5, 4 * 10 ** 5) if random.random() < 0.02 else random.randint(1, 20000)
+    return random.choice((str(size), str(size), f"{size}.5", f"{size}.{random.randint(0, 10 ** 8 - 1):08d}"))
+
+
+def create_active_orders(lending_market: list) -> list:
+    active_orders = list()
+    for _ in range(random.choice((0, 1, 1, 2))):
+        # Mostly resting on a rate of the book, so the own size has to be taken out of it
+        rate = random.choice(lending_market)["dailyIntRate"] if random.random() < 0.8 else str(Decimal(random.randint(20, 100)).scaleb(-5))
+        rate = str(utils.round_down(Decimal(rate), 5))
+        size = random.randint(10, 50000)
+        active_orders.append({"orderId": str(len(active_orders)), "currency": "USDT", "dailyIntRate": rate, "size": str(size), "filledSize": str(random.randint(0, size))})
+    return active_orders
+
+
+def create_config(happy_daily_interest_rate: str, big_player_size_threshold: int, happy_cumulative_size_threshold: int) -> AccountConfiguration:
+    step_bot_data = dict(STEP_BOT_DATA, happy_daily_interest_rate=happy_daily_interest_rate, big_player_size_threshold=str(big_player_size_threshold), happy_cumulative_size_threshold=str(happy_cumulative_size_threshold))
+    return AccountConfiguration("market_data", dict(CURRENCY_DATA, active=True, name="market_data", kill=False, base_url="", api_key="", api_secret="", api_passphrase="", currency="USDT"), step_bot_data)
+
+
+def decide(config: AccountConfiguration, lending_market: list, active_orders: list, min_daily_interest_rate: Decimal) -> tuple:
+    account_snapshot = TickSnapshot()
+    account_snapshot.set_result("active_orders", {"totalNum": len(active_orders), "items": active_orders})
+    bot = StepBot(config, user_client=object(), margin_client=object(), account_snapshot=account_snapshot)
+    bot.snapshot.set_result("lending_market", lending_market)
+
+    my_active_open_orders = bot.get_my_active_open_orders()
+    market_data = bot.get_market_data(my_active_open_orders, min_daily_interest_rate)
+    offer_list = [(bot_line.rate, bot_line.size) for bot_line in market_data["OfferList"]]
+    return market_data["LowestRate"], market_data["BigPlayerRate"], offer_list, bot.calculate_my_optimal_daily_interest_rate(market_data, my_active_open_orders, min_daily_interest_rate)
+
+
+def legacy_decide(config: AccountConfiguration, lending_market: list, active_orders: list, min_daily_interest_rate: Decimal) -> tuple:
+    my_active_open_orders = legacy_get_my_active_open_orders(active_orders)
+    market_data = legacy_get_market_data(config.step_bot, lending_market, my_active_open_orders, min_daily_interest_rate)
+    offer_list = [(int(offer["Rate"] * 1000), int(offer["Size"].scaleb(config.currency_precision_decimal_places))) for offer in market_data["OfferList"]]
+    return market_data["LowestRate"], market_data["BigPlayerRate"], offer_list, legacy_calculate_my_optimal_daily_interest_rate(config.step_bot, market_data, my_active_open_orders, min_daily_interest_rate)
+
+
+def test_market_data_matches_legacy_walk() -> None:
+    random.seed(7)
+    configs = [create_config(str(Decimal(random.randint(30, 90)) / 1000), random.choice((10 ** 3, 10 ** 4, 5 * 10 ** 4, 10 ** 5)), random.choice((10 ** 2, 10 ** 3, 10 ** 4))) for _ in range(20)]
+
+    compared = 0
+    for _ in range(CASES):
+        config = random.choice(configs)
+        lending_market = create_book(random.randint(1, 60))
+        active_orders = create_active_orders(lending_market)
+        min_daily_interest_rate = Decimal(random.randint(20, 100)) / 1000
+
+        if all(Decimal(line["dailyIntRate"]) * 100 < min_daily_interest_rate for line in lending_market):
+            # Nothing at or above the minimum rate, neither walk decides on that book
+            with pytest.raises(Exception, match="BigPlayerRate is zero"):
+                legacy_decide(config, lending_market, active_orders, min_daily_interest_rate)
+            with pytest.raises(Exception, match="BigPlayerRate is zero"):
+                decide(config, lending_market, active_orders, min_daily_interest_rate)
+            continue
+
+        assert decide(config, lending_market, active_orders, min_daily_interest_rate) == legacy_decide(config, lending_market, active_orders, min_daily_interest_rate), (lending_market, active_orders, min_daily_interest_rate)
+        compared += 1
+
+    assert compared > CASES // 2
@@ -0,0 +1,38 @@
+import random
+from decimal import Decimal
+
+import pytest
+
+from benchmarks.end_to_end import CURRENCY_DATA, STEP_BOT_DATA
+from benchmarks.kucoin_simulator import KucoinSimulator
+from benchmarks.repayments import CountingStore, apply_event, get_expected_totals, sync
+from configuration import AccountConfiguration
+
+
+@pytest.fixture
+def simulator():
+    simulator = KucoinSimulator(unsettled_orders=120, balance=Decimal(10 ** 6)).start()
+    yield simulator
+    simulator.stop()
+
+
+def create_config(base_url: str, name: str) -> AccountConfiguration:
+    # One API key per test, the scheduler keeps the rate limit of each key across tests
+    return AccountConfiguration(name, dict(CURRENCY_DATA, active=True, name=name, kill=False, base_url=base_url, api_key=name, api_secret="secret", api_passphrase="passphrase", currency="USDT"), STEP_BOT_DATA)
+
+
+@pytest.mark.parametrize("event, reconciles", [("settle", 0), ("repay_first_page", 0), ("repay_later_page", 1)])
+def test_sync_after_repayment(tmp_path, simulator, event: str, reconciles: int) -> None:
+    random.seed(5)
+    config = create_config(simulator.base_url, event)
+    store = CountingStore(str(tmp_path / "unsettled_orders.sqlite3"))
+    sync(store, config)
+
+    for _ in range(3):
+        apply_event(simulator, config, event)
+        reconcile_count = store.reconcile_count
+        totals = sync(store, config)
+
+        # Only a repayment beyond the first page is missed by the incremental sync
+        assert store.reconcile_count - reconcile_count == reconciles
+        assert (totals["Count"], totals["RemainingSize"]) == get_expected_totals(simulator, config)
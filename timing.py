@@ -0,0 +1,91 @@
+from collections import deque
+from contextlib import contextmanager
+from threading import Lock
+from time import perf_counter
+
+
+# Process-wide latency samples per call name, kept across warm invocations for scraping
+class LatencyMetrics:
+
+    MAX_SAMPLES = 1024
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.samples = dict()
+        self.counts = dict()
+        self.sums = dict()
+
+
+    def observe(self, name: str, seconds: float) -> None:
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = deque(maxlen=self.MAX_SAMPLES)
+                self.samples[name] = samples
+            samples.append(seconds)
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.sums[name] = self.sums.get(name, 0.0) + seconds
+
+
+    def get_percentiles(self, name: str) -> dict:
+        with self.lock:
+            samples = sorted(self.samples.get(name, ()))
+
+        if len(samples) == 0:
+            return dict()
+
+        return {quantile: samples[min(int(quantile * len(samples)), len(samples) - 1)] for quantile in self.QUANTILES}
+
+
+    def to_prometheus(self) -> str:
+        lines = [
+            "# HELP kucoin_lendingbot_call_seconds Latency of KuCoin and Firestore calls",
+            "# TYPE kucoin_lendingbot_call_seconds summary",
+        ]
+
+        with self.lock:
+            names = sorted(self.samples.keys())
+
+        for name in names:
+            for quantile, seconds in self.get_percentiles(name).items():
+                lines.append(f'kucoin_lendingbot_call_seconds{{call="{name}",quantile="{quantile}"}} {seconds:.6f}')
+            with self.lock:
+                lines.append(f'kucoin_lendingbot_call_seconds_sum{{call="{name}"}} {self.sums[name]:.6f}')
+                lines.append(f'kucoin_lendingbot_call_seconds_count{{call="{name}"}} {self.counts[name]}')
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = LatencyMetrics()
+
+
+# Durations of the calls made during one tick, in the order they finished
+class TickTimings:
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.entries = list()
+
+
+    @contextmanager
+    def measure(self, name: str, **labels):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, perf_counter() - start, **labels)
+
+
+    def add(self, name: str, seconds: float, **labels) -> None:
+        metrics.observe(name, seconds)
+
+        entry = {"name": name, "ms": round(seconds * 1000, 3)}
+        entry.update(labels)
+        with self.lock:
+            self.entries.append(entry)
+
+
+    def to_list(self) -> list:
+        with self.lock:
+            return list(self.entries)
@@ -0,0 +1,225 @@
+import sqlite3
+from decimal import Decimal
+from threading import Lock
+from time import time
+
+
+# Local stand-in for a persistent store of unsettled lend orders keyed by tradeId. The file lives in the
+# instance's /tmp, so it survives warm invocations and is rebuilt by a full reconcile after a cold start.
+# An account key covers either one currency or, for multi-currency accounts, all of them.
+#
+# Lending moves principal between the main account and the loans: a fill takes it from the main balance and adds
+# a loan to the first unsettled page, a repayment credits it back together with the interest. So per currency, the
+# main balance plus the stored remaining sizes, less the interest paid out by the repayments read in the sync,
+# stays the same unless a loan changed on a page that was not read, or funds came in or left. An incremental sync
+# reads the settled orders and the first unsettled pages and falls back to a full reconcile whenever that sum
+# moved. The accrued interest of the loans on later pages is then up to FULL_RECONCILE_INTERVAL_SECONDS old, the
+# sizes and rates are not.
+#
+# KuCoin is read outside of the store lock, which only guards the shared SQLite connection. A lock per account
+# key keeps two syncs of the same account from interleaving.
+class UnsettledOrderStore:
+
+    DEFAULT_PATH = "/tmp/unsettled_orders_v4.sqlite3"
+    FULL_RECONCILE_INTERVAL_SECONDS = 60 * 60
+
+    # Sizes and rates are stored as scaled integers so SQLite can aggregate them without float rounding
+    SIZE_SCALE = 10 ** 8
+    RATE_SCALE = 10 ** 6
+
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        self.lock = Lock()
+        self.account_locks = dict()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS unsettled_orders (
+                account_key TEXT NOT NULL,
+                trade_id TEXT NOT NULL,
+                currency TEXT NOT NULL,
+                remaining_size INTEGER NOT NULL,
+                daily_interest_rate INTEGER NOT NULL,
+                accrued_interest INTEGER NOT NULL,
+                maturity_time INTEGER NOT NULL,
+                PRIMARY KEY (account_key, trade_id)
+            );
+            CREATE TABLE IF NOT EXISTS sync_state (
+                account_key TEXT PRIMARY KEY,
+                last_full_reconcile REAL NOT NULL,
+                last_settled_at INTEGER NOT NULL,
+                balance_marker TEXT NOT NULL
+            );
+        """)
+
+
+    def get_account_lock(self, account_key: str) -> Lock:
+        with self.lock:
+            return self.account_locks.setdefault(account_key, Lock())
+
+
+    def sync(self, account_key: str, source, currency: str) -> dict:
+        with self.get_account_lock(account_key):
+            with self.lock:
+                state = self.connection.execute("SELECT last_full_reconcile, last_settled_at, balance_marker FROM sync_state WHERE account_key = ?", (account_key,)).fetchone()
+
+            main_balances = source.get_main_balances()
+            if state is None or time() - state[0] > self.FULL_RECONCILE_INTERVAL_SECONDS or not self.sync_incrementally(account_key, source, state[1], state[2], main_balances):
+                self.reconcile(account_key, source, main_balances)
+
+            return self.get_totals(account_key, currency)
+
+
+    def reconcile(self, account_key: str, source, main_balances: dict) -> None:
+        orders = source.get_all_unsettled_orders()
+        settled_orders_response = source.get_settled_orders(1)
+        last_settled_at = max([order["settledAt"] for order in settled_orders_response["items"]], default=0)
+
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                self.connection.execute("DELETE FROM unsettled_orders WHERE account_key = ?", (account_key,))
+                self.upsert(account_key, orders)
+                balance_marker = self.to_balance_marker(self.get_balance_totals(account_key, main_balances))
+                self.connection.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?, ?)", (account_key, time(), last_settled_at, balance_marker))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+
+
+    def sync_incrementally(self, account_key: str, source, last_settled_at: int, balance_marker: str, main_balances: dict) -> bool:
+        # Drop everything settled since the last sync. Settled orders are listed newest first.
+        settled_trade_ids = list()
+        settled_interest = dict()
+        newest_settled_at = last_settled_at
+        current_page = 1
+        while True:
+            settled_orders_response = source.get_settled_orders(current_page)
+            items = [order for order in settled_orders_response["items"] if order["settledAt"] > last_settled_at]
+            settled_trade_ids += [(account_key, order["tradeId"]) for order in items]
+            for order in items:
+                # The interest credited to the main balance with the repayment, after the lending fee
+                settled_interest[order["currency"]] = settled_interest.get(order["currency"], 0) + int(Decimal(order["interest"]) * self.SIZE_SCALE)
+            newest_settled_at = max([newest_settled_at] + [order["settledAt"] for order in items])
+
+            if len(items) < len(settled_orders_response["items"]) or settled_orders_response["totalPage"] <= current_page:
+                break
+            current_page += 1
+
+        # New loans show up on the first pages. Stop as soon as the store holds as many orders as KuCoin reports.
+        # Every attempt writes all pages read so far in a fresh transaction, the lock is not held while reading.
+        # It only counts if the balance marker did not move either, once the interest paid out is taken off.
+        unsettled_orders = list()
+        current_page = 1
+        while True:
+            unsettled_orders_response = source.get_unsettled_orders_page(current_page)
+            unsettled_orders += unsettled_orders_response["items"]
+
+            with self.lock:
+                self.connection.execute("BEGIN")
+                try:
+                    paid_interest = self.get_repaid_interest(account_key, unsettled_orders, settled_interest)
+                    self.connection.executemany("DELETE FROM unsettled_orders WHERE account_key = ? AND trade_id = ?", settled_trade_ids)
+                    self.upsert(account_key, unsettled_orders)
+
+                    stored_count = self.connection.execute("SELECT COUNT(*) FROM unsettled_orders WHERE account_key = ?", (account_key,)).fetchone()[0]
+                    balance_totals = self.get_balance_totals(account_key, main_balances)
+                    unpaid_totals = {currency: balance_totals.get(currency, 0) - paid_interest.get(currency, 0) for currency in balance_totals.keys() | paid_interest.keys()}
+                    if stored_count == unsettled_orders_response["totalNum"] and self.to_balance_marker(unpaid_totals) == balance_marker:
+                        # The interest is in the main balance from now on
+                        self.connection.execute("UPDATE sync_state SET last_settled_at = ?, balance_marker = ? WHERE account_key = ?", (newest_settled_at, self.to_balance_marker(balance_totals), account_key))
+                        self.connection.execute("COMMIT")
+                        return True
+                except Exception:
+                    self.connection.execute("ROLLBACK")
+                    raise
+                self.connection.execute("ROLLBACK")
+
+            if stored_count >= unsettled_orders_response["totalNum"] or unsettled_orders_response["totalPage"] <= current_page:
+                break
+            current_page += 1
+
+        # The store drifted from KuCoin, let the caller do a full reconcile
+        return False
+
+
+    def get_repaid_interest(self, account_key: str, orders: list, settled_interest: dict) -> dict:
+        # A partial repayment pays the interest accrued so far along with the principal. The drop of the accrued
+        # interest of a stored loan whose remaining size went down is taken as paid, inside the caller's transaction.
+        # Interest accrued between the two syncs is not in there, which only costs a full reconcile.
+        paid_interest = dict(settled_interest)
+        for order in orders:
+            row = self.connection.execute("SELECT remaining_size, accrued_interest FROM unsettled_orders WHERE account_key = ? AND trade_id = ?", (account_key, order["tradeId"])).fetchone()
+            if row is None:
+                continue
+
+            remaining_size, _, accrued_interest, _ = self.to_order_row(order)
+            if remaining_size < row[0] and accrued_interest < row[1]:
+                paid_interest[order["currency"]] = paid_interest.get(order["currency"], 0) + row[1] - accrued_interest
+        return paid_interest
+
+
+    def get_balance_totals(self, account_key: str, main_balances: dict) -> dict:
+        # Main balance plus remaining sizes per currency, scaled, inside the caller's transaction
+        totals = {currency: int(Decimal(balance) * self.SIZE_SCALE) for currency, balance in main_balances.items()}
+        rows = self.connection.execute("SELECT currency, SUM(remaining_size) FROM unsettled_orders WHERE account_key = ? GROUP BY currency", (account_key,))
+        for currency, remaining_size in rows:
+            totals[currency] = totals.get(currency, 0) + remaining_size
+        return totals
+
+
+    @staticmethod
+    def to_balance_marker(totals: dict) -> str:
+        return ",".join(f"{currency}:{total}" for currency, total in sorted(totals.items()))
+
+
+    @classmethod
+    def to_order_row(cls, order: dict) -> tuple:
+        # (remaining_size, daily_interest_rate, accrued_interest, maturity_time) of a KuCoin unsettled order, scaled
+        remaining_size = Decimal(order["size"]) - Decimal(order["repaid"])
+        return (
+            int(remaining_size * cls.SIZE_SCALE),
+            int(Decimal(order["dailyIntRate"]) * cls.RATE_SCALE),
+            int(Decimal(order["accruedInterest"]) * cls.SIZE_SCALE),
+            int(order["maturityTime"]),
+        )
+
+
+    def upsert(self, account_key: str, orders: list) -> None:
+        rows = [(account_key, order["tradeId"], order["currency"]) + self.to_order_row(order) for order in orders]
+        self.connection.executemany("INSERT OR REPLACE INTO unsettled_orders VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+
+    def get_totals(self, account_key: str, currency: str) -> dict:
+        with self.lock:
+            row = self.connection.execute("""
+                SELECT COUNT(*), COALESCE(SUM(remaining_size), 0), COALESCE(SUM(remaining_size * daily_interest_rate), 0), COALESCE(SUM(accrued_interest), 0)
+                FROM unsettled_orders WHERE account_key = ? AND currency = ?
+            """, (account_key, currency)).fetchone()
+
+        return {
+            "Count": row[0],
+            "RemainingSize": Decimal(row[1]) / self.SIZE_SCALE,
+            "WeightedDailyInterestRate": Decimal(row[2]) / (self.SIZE_SCALE * self.RATE_SCALE),
+            "AccruedInterest": Decimal(row[3]) / self.SIZE_SCALE,
+        }
+
+
+    def get_orders(self, account_key: str, currency: str) -> list:
+        # Rows of (remaining_size, daily_interest_rate, accrued_interest, maturity_time), still scaled
+        with self.lock:
+            return self.connection.execute("""
+                SELECT remaining_size, daily_interest_rate, accrued_interest, maturity_time
+                FROM unsettled_orders WHERE account_key = ? AND currency = ?
+            """, (account_key, currency)).fetchall()
+
+
+_store = None
+_store_lock = Lock()
+
+
+def get_store() -> UnsettledOrderStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = UnsettledOrderStore()
+    return _store
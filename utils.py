@@ -1,24 +1,30 @@
-from decimal import Decimal
+from decimal import Context, Decimal, ROUND_DOWN
 
 
-def round_down_to_decimal_places(value: Decimal, decimal_places: int) -> Decimal:
-    return Decimal(round_down_to_decimal_places_string(value, decimal_places))
+# Quantizing needs room for the integer digits too, the default context stops at 28 digits
+_ROUNDING_CONTEXT = Context(prec=64, rounding=ROUND_DOWN)
 
+_quantums = dict()
+
+
+def get_quantum(decimal_places: int) -> Decimal:
+    quantum = _quantums.get(decimal_places)
+    if quantum is None:
+        quantum = Decimal(1).scaleb(-decimal_places)
+        _quantums[decimal_places] = quantum
+    return quantum
 
-def round_down_to_decimal_places_string(value: Decimal, decimal_places: int) -> str:
-    value_str = str(value)
 
-    separator_index = value_str.rfind(".")
-    if separator_index == -1:
-        if decimal_places == 0:
-            return value_str
-        return value_str + "." + ("0" * decimal_places)
+def round_down(value: Decimal, decimal_places: int) -> Decimal:
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    return value.quantize(get_quantum(decimal_places), context=_ROUNDING_CONTEXT)
 
-    if decimal_places == 0:
-        return value_str[:separator_index]
 
-    current_precision = len(value_str) - separator_index - 1
-    if current_precision < decimal_places:
-        return value_str + ("0" * (decimal_places - current_precision))
+def round_down_to_quantum(value: Decimal, quantum: Decimal) -> Decimal:
+    # For callers that hold on to the quantum of get_quantum and always pass a Decimal
+    return value.quantize(quantum, context=_ROUNDING_CONTEXT)
 
-    return value_str[:separator_index + decimal_places + 1]
+
+def round_down_to_decimal_places_string(value: Decimal, decimal_places: int) -> str:
+    return format(round_down(value, decimal_places), "f")
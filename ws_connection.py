@@ -0,0 +1,50 @@
+import asyncio
+from importlib import metadata
+
+
+# The private feed waits on the connection task and socket kucoin-python keeps in private attributes. Their names
+# are only known to hold for this release, see requirements.txt
+SUPPORTED_SDK_VERSION = "1.0.6"
+
+_checked: bool = False
+
+
+def check_sdk_version() -> None:
+    global _checked
+    if _checked:
+        return
+
+    try:
+        version = metadata.version("kucoin-python")
+    except metadata.PackageNotFoundError:
+        version = None
+
+    if version != SUPPORTED_SDK_VERSION:
+        raise RuntimeError(f"The private feed needs kucoin-python {SUPPORTED_SDK_VERSION}, found {version}. Check ws_connection.FeedConnection against the new release before changing the pin.")
+    _checked = True
+
+
+# The only place that reaches into the internals of the SDK WebSocket client
+class FeedConnection:
+
+    def __init__(self, ws_client) -> None:
+        check_sdk_version()
+        self.connection = ws_client._conn
+
+
+    @property
+    def task(self) -> asyncio.Future:
+        # Runs the connection, the SDK cancels it on its own reconnect
+        return self.connection._conn
+
+
+    @property
+    def connected(self) -> bool:
+        # The SDK gives up on sending the subscriptions quietly when it cannot connect
+        return self.connection._socket is not None
+
+
+    async def close(self) -> None:
+        self.task.cancel()
+        if self.connected:
+            await self.connection._socket.close()